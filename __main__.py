@@ -1,11 +1,19 @@
 """Executed when package directory is called as a script"""
-import configparser
 import os
 import logging
 import sys
 
+from pyfc.adaptive import AdaptiveInterval
 from pyfc.fancontroller import FanController
 from pyfc.deviceloader import create_device
+from pyfc.hotplug import Reconciler
+from pyfc.instrumentation import Instrumentation
+from pyfc.plan import create_devices
+from pyfc.prometheus import PrometheusExporter, parse_listen
+from pyfc.reload import Reloader, read_config
+from pyfc.sampler import ConcurrentSampler
+from pyfc.sharedstate import SharedStatePublisher
+from pyfc.trace import TraceRecorder
 from pathlib import Path
 
 log = logging.getLogger(__name__)
@@ -23,8 +31,7 @@ def main():
 
     work_dir = os.environ.get('PYFC_WORK_DIR', Path(__file__).absolute().parent)
     config_path = os.environ.get('PYFC_CONFIG_PATH', Path(work_dir).joinpath('settings.ini'))
-    config = configparser.ConfigParser(converters={'list': lambda x: [i.strip() for i in x.split(',')]})
-    config.read(config_path)
+    config = read_config(config_path)
 
     if config['log']['path'] == 'stdout':
         logging.basicConfig(stream=sys.stdout, level=config['log']['level'])
@@ -33,7 +40,10 @@ def main():
 
     device_identifiers = config['base']['devices'].split(', ')
     device_configuration = {identifier: config[identifier] for identifier in device_identifiers}
-    devices = {name: create_device(name, config) for name, config in device_configuration.items()}
+    if config['base'].get('planCache', None):
+        devices = create_devices(config, device_identifiers, Path(config_path), Path(config['base']['planCache']))
+    else:
+        devices = {name: create_device(name, config) for name, config in device_configuration.items()}
 
     valid_devices = {}
     for name, device in devices.items():
@@ -42,10 +52,65 @@ def main():
         else:
             log.warning('Configured device is not valid, removing controller. %s', name)
 
+    sampler = None
+    if config['base'].get('sampling', 'sequential') == 'concurrent':
+        sampler = ConcurrentSampler(config['base'].getint('samplerWorkers', 4), config['base'].getfloat('readTimeout', 0.5))
+
+    interval = config['base'].getfloat('interval', 5.0)
+    reconciler = None
+    if config['base'].getboolean('hotplug', True):
+        reconciler = Reconciler(valid_devices, config['base'].getfloat('hotplugRescanInterval', 30.0))
+
+    instrumentation = None
+    if config['base'].getboolean('instrumentation', False):
+        instrumentation = Instrumentation()
+        instrumentation.dump_on_signal(Path(config['base'].get('statsFile', '/run/pyfc/stats.json')))
+
+    exporter = None
+    metrics_listen = config['base'].get('metricsListen', '')
+    metrics_textfile = config['base'].get('metricsTextfile', '')
+    if metrics_listen or metrics_textfile:
+        exporter = PrometheusExporter(
+                parse_listen(metrics_listen) if metrics_listen else None,
+                Path(metrics_textfile) if metrics_textfile else None,
+                config['base'].getfloat('metricsTextfileInterval', 15.0)
+        )
+
+    recorder = None
+    if config['base'].get('traceDirectory', ''):
+        recorder = TraceRecorder(
+                Path(config['base']['traceDirectory']),
+                config['base'].getint('traceCapacity', 86400),
+                config['base'].getint('traceKeepFiles', 0)
+        )
+
+    shared_state = None
+    if config['base'].get('sharedState', ''):
+        shared_state = SharedStatePublisher(Path(config['base']['sharedState']))
+
+    reloader = Reloader(Path(config_path), config, Path(config['base'].get('reloadStatusFile', '/run/pyfc/reload.json')))
+    reloader.request_on_signal()
+
+    adaptive = {}
+    for name in valid_devices:
+        adaptive_interval = AdaptiveInterval.from_config(device_configuration[name])
+        if adaptive_interval is not None:
+            adaptive[name] = adaptive_interval
+
     fan_control = FanController(
             Path(config['base']['pid_file']).absolute(),
-            config['base'].getfloat('interval', 5.0),
-            valid_devices
+            interval,
+            valid_devices,
+            {name: device_configuration[name].getfloat('interval', interval) for name in valid_devices},
+            config['base'].get('scheduler', 'sync'),
+            sampler,
+            reconciler,
+            instrumentation,
+            exporter,
+            reloader,
+            recorder,
+            shared_state,
+            adaptive
     )
     fan_control.run()
 
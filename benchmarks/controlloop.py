@@ -0,0 +1,291 @@
+"""
+Benchmark of the whole control loop against a synthetic sysfs and /dev/disk/by-id tree, by default in /dev/shm.
+
+Devices are built from a generated config through the real create_device path, then FanController.tick() runs a fixed
+number of times, with the sensor values changing between ticks so the outputs actually get written.
+Each scenario covers one input type, output type, controller and sampling combination and reports:
+    startup_ms            building every device from config, including the topology scan, and from a cached plan
+    tick_us               tick latency percentiles
+    syscalls_per_tick     read and write syscalls, from /proc/self/io
+    alloc_*_per_tick      peak and net bytes allocated during a tick, from tracemalloc, in a separate pass
+
+python -m benchmarks.controlloop --chips 4 --sensors 6 --pwms 3 --drives 8 --output results.json
+python -m benchmarks.controlloop --baseline results.json
+"""
+import argparse
+import configparser
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from pyfc.deviceloader import create_device
+from pyfc.fancontroller import FanController
+from pyfc.plan import create_devices
+from pyfc.sampler import ConcurrentSampler
+from pyfc.sensorregistry import registry
+from pyfc import topology
+from pyfc.topology import Topology, reset_topology
+
+from .fakesysfs import FakeSysfs
+
+SCENARIOS = {
+    'componentTemp-fanPWM':            {'inputType': 'componentTemp', 'controllerType': 'temperature'},
+    'componentTemp-fanPWM-pid':        {'inputType': 'componentTemp', 'controllerType': 'pid', 'targetTemperature': '45'},
+    'componentTemp-fanPWM-concurrent': {'inputType': 'componentTemp', 'controllerType': 'temperature', 'sampling': 'concurrent'},
+    'driveDevice-fanPWM':              {'inputType': 'driveDevice', 'controllerType': 'temperature'},
+}
+
+
+def block_name(idx: int) -> str:
+    name = ''
+    idx += 1
+    while idx:
+        idx, remainder = divmod(idx - 1, 26)
+        name = chr(ord('a') + remainder) + name
+    return f'sd{name}'
+
+
+def build_tree(root: Path, chips: int, sensors: int, pwms: int, drives: int) -> Tuple[FakeSysfs, List[Path]]:
+    """
+    :return: the tree and every temp*_input in it.
+    """
+    sysfs = FakeSysfs(root)
+    for chip in range(chips):
+        sysfs.add_chip(f'bench{chip:03d}x', {idx: 30000 + idx * 1000 for idx in range(1, sensors + 1)}, range(1, pwms + 1))
+    for drive in range(drives):
+        if drive % 2:
+            sysfs.add_nvme_disk(drive // 2, f'BENCHDISK_NVME{drive:03d}')
+        else:
+            sysfs.add_ata_disk(block_name(drive // 2), f'BENCHDISK_ATA{drive:03d}', host=drive // 2)
+    return sysfs, sorted(sysfs.sysfs_root.joinpath('class', 'hwmon').glob('hwmon*/temp*_input'))
+
+
+def build_config(scenario: Dict[str, str], chips: int, sensors: int, pwms: int) -> configparser.ConfigParser:
+    config = configparser.ConfigParser(converters={'list': lambda x: [i.strip() for i in x.split(',')]})
+    config['DEFAULT'] = {'minimumSpeed': '20', 'maximumSpeed': '100', 'temps': '30, 40 | 40, 50 | 60, 70', 'outputType': 'fanPWM'}
+    section = {key: value for key, value in scenario.items() if key != 'sampling'}
+    if scenario['inputType'] == 'driveDevice':
+        config['drives'] = dict(section, diskIDs='BENCHDISK', outputDeviceName='bench000x', device='pwm1', outputEnabler='pwm1_enable')
+        return config
+    for chip in range(chips):
+        name = f'bench{chip:03d}x'
+        config[name] = dict(
+                section,
+                temperatureMonitorDeviceName=', '.join([name] * sensors),
+                temperatureMonitor=', '.join(f'temp{idx}_input' for idx in range(1, sensors + 1)),
+                outputDeviceName=name,
+                device=', '.join(f'pwm{idx}' for idx in range(1, pwms + 1)),
+                outputEnabler=', '.join(f'pwm{idx}_enable' for idx in range(1, pwms + 1)),
+        )
+    return config
+
+
+def read_io() -> Tuple[int, int]:
+    with open('/proc/self/io', 'rb') as reader:
+        fields = dict(line.split(b': ') for line in reader.read().splitlines())
+    return int(fields[b'syscr']), int(fields[b'syscw'])
+
+
+def io_overhead() -> Tuple[int, int]:
+    """
+    Syscalls read_io itself adds between two calls.
+    """
+    deltas = []
+    for _ in range(20):
+        before = read_io()
+        after = read_io()
+        deltas.append((after[0] - before[0], after[1] - before[1]))
+    return min(d[0] for d in deltas), min(d[1] for d in deltas)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {'p50': cuts[49], 'p90': cuts[89], 'p99': cuts[98], 'max': max(values), 'mean': statistics.fmean(values)}
+
+
+def fresh_topology(sysfs: FakeSysfs):
+    for sensor in list(registry._sensors.values()):
+        if hasattr(sensor, 'close'):
+            sensor.close()
+    registry.clear()
+    reset_topology(Topology(sysfs.sysfs_root, sysfs.dev_root))
+
+
+def measure_startup(sysfs: FakeSysfs, config: configparser.ConfigParser, runs: int) -> Dict[str, float]:
+    names = config.sections()
+    cold, warm = [], []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        config_path = Path(cache_dir).joinpath('settings.ini')
+        with config_path.open('w') as writer:
+            config.write(writer)
+        cache_path = Path(cache_dir).joinpath('plan.json')
+        for timings in (cold, warm):
+            for _ in range(runs):
+                if timings is cold:
+                    cache_path.unlink(missing_ok=True)
+                # the topology gets scanned from the fake tree on first use, like a real start would scan /sys.
+                registry.clear()
+                reset_topology()
+                start = time.perf_counter()
+                create_devices(config, names, config_path, cache_path, sysfs.sysfs_root)
+                timings.append((time.perf_counter() - start) * 1000)
+                gc.collect()
+    return {'cold': statistics.median(cold), 'plan': statistics.median(warm)}
+
+
+def vary(temp_inputs: List[Path], tick: int):
+    for idx, path in enumerate(temp_inputs):
+        path.write_text(f'{30000 + ((tick * 700 + idx * 1300) % 40000)}\n')
+
+
+def measure_ticks(root: Path, sysfs: FakeSysfs, temp_inputs: List[Path], config: configparser.ConfigParser,
+                  scenario: Dict[str, str], args) -> Dict:
+    fresh_topology(sysfs)
+    devices = {section: create_device(section, config[section]) for section in config.sections()}
+    sampler = ConcurrentSampler(args.sampler_workers) if scenario.get('sampling') == 'concurrent' else None
+    fan_controller = FanController(root.joinpath('pyfc.pid'), 1.0, devices, sampler=sampler)
+    for device in devices.values():
+        device.enable()
+
+    try:
+        overhead = io_overhead()
+        latencies, reads, writes = [], [], []
+        for tick in range(args.ticks):
+            vary(temp_inputs, tick)
+            io_before = read_io()
+            start = time.perf_counter()
+            fan_controller.tick()
+            latencies.append((time.perf_counter() - start) * 1e6)
+            io_after = read_io()
+            reads.append(io_after[0] - io_before[0] - overhead[0])
+            writes.append(io_after[1] - io_before[1] - overhead[1])
+
+        tracemalloc.start()
+        peaks, nets = [], []
+        for tick in range(args.ticks, args.ticks + args.alloc_ticks):
+            vary(temp_inputs, tick)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fan_controller.tick()
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            nets.append(current - before)
+        tracemalloc.stop()
+    finally:
+        for device in devices.values():
+            device.disable()
+        if sampler is not None:
+            sampler.shutdown()
+
+    return {
+        'devices':                   len(devices),
+        'inputs':                    sum(len(d.inputs) for d in devices.values()),
+        'outputs':                   sum(len(d.outputs) for d in devices.values()),
+        'tick_us':                   percentiles(latencies),
+        'syscalls_per_tick':         {'read': statistics.fmean(reads), 'write': statistics.fmean(writes)},
+        'alloc_peak_bytes_per_tick': statistics.median(peaks),
+        'alloc_net_bytes_per_tick':  statistics.fmean(nets),
+    }
+
+
+def run_scenario(scenario: Dict[str, str], args) -> Dict:
+    roots = topology.SYSFS_ROOT, topology.DEV_ROOT
+    with tempfile.TemporaryDirectory(dir=args.root) as root:
+        sysfs, temp_inputs = build_tree(Path(root), args.chips, args.sensors, args.pwms, args.drives)
+        topology.SYSFS_ROOT, topology.DEV_ROOT = sysfs.sysfs_root, sysfs.dev_root
+        try:
+            config = build_config(scenario, args.chips, args.sensors, args.pwms)
+            result = {'startup_ms': measure_startup(sysfs, config, args.startup_runs)}
+            result.update(measure_ticks(Path(root), sysfs, temp_inputs, config, scenario, args))
+            # controllers hand their fans back when collected, which has to happen while the tree is still there.
+            gc.collect()
+            fresh_topology(sysfs)
+        finally:
+            topology.SYSFS_ROOT, topology.DEV_ROOT = roots
+            reset_topology()
+    return result
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=Path(__file__).parent, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(baseline: Dict, results: Dict, threshold: float):
+    """
+    Prints how every metric moved against the baseline, marking changes for the worse beyond threshold.
+    """
+    def flatten(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                yield from flatten(f'{prefix}.{key}' if prefix else key, item)
+        else:
+            yield prefix, value
+
+    print(f'against {baseline.get("revision") or "baseline"} ({baseline.get("timestamp", "")})')
+    for name, scenario in results['scenarios'].items():
+        old = dict(flatten('', baseline.get('scenarios', {}).get(name, {})))
+        for metric, value in flatten('', scenario):
+            if metric not in old or not old[metric]:
+                continue
+            change = (value - old[metric]) / abs(old[metric])
+            marker = '  REGRESSION' if change > threshold else ''
+            print(f'{name:<34} {metric:<32} {old[metric]:>12.2f} -> {value:>12.2f} {change:>+8.1%}{marker}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chips', type=int, default=4)
+    parser.add_argument('--sensors', type=int, default=6, help='temperature sensors per chip')
+    parser.add_argument('--pwms', type=int, default=3, help='pwm channels per chip')
+    parser.add_argument('--drives', type=int, default=8, help='drives, every other one nvme')
+    parser.add_argument('--ticks', type=int, default=500)
+    parser.add_argument('--alloc-ticks', type=int, default=100)
+    parser.add_argument('--startup-runs', type=int, default=5)
+    parser.add_argument('--sampler-workers', type=int, default=4)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='run only these, can be repeated')
+    parser.add_argument('--root', default='/dev/shm' if os.path.isdir('/dev/shm') else None, help='where the tree is generated')
+    parser.add_argument('--output', help='write the results as JSON here instead of stdout')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as a regression')
+    args = parser.parse_args(argv)
+
+    results = {
+        'benchmark':  'controlloop',
+        'revision':   git_revision(),
+        'timestamp':  time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python':     platform.python_version(),
+        'platform':   platform.platform(),
+        'parameters': {key: getattr(args, key) for key in ('chips', 'sensors', 'pwms', 'drives', 'ticks', 'alloc_ticks', 'startup_runs')},
+        'scenarios':  {},
+    }
+    for name in args.scenario or SCENARIOS:
+        results['scenarios'][name] = run_scenario(SCENARIOS[name], args)
+        print(f'{name}: {results["scenarios"][name]["tick_us"]["p50"]:.1f} µs/tick p50', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as writer:
+            json.dump(results, writer, indent=2)
+    elif not args.baseline:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as reader:
+            compare(json.load(reader), results, args.threshold)
+
+
+if __name__ == '__main__':
+    main()
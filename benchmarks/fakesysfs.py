@@ -0,0 +1,92 @@
+"""
+Builds a fake sysfs and /dev tree in a directory, laid out like the real ones as far as pyfc looks.
+Used by the benchmarks and the tests alike.
+"""
+import os
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+
+class FakeSysfs:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.sysfs_root = self.root.joinpath('sys')
+        self.dev_root = self.root.joinpath('dev')
+        self.sysfs_root.joinpath('class', 'hwmon').mkdir(parents=True, exist_ok=True)
+        self.dev_root.joinpath('disk', 'by-id').mkdir(parents=True, exist_ok=True)
+        self._next_hwmon = 0
+
+    @staticmethod
+    def _link(link: Path, target: Path):
+        link.parent.mkdir(parents=True, exist_ok=True)
+        if link.is_symlink():
+            link.unlink()
+        link.symlink_to(os.path.relpath(target, link.parent))
+
+    def add_hwmon(self, name: str, device: Path, temps: Optional[Dict[int, int]] = None, labels: Optional[Dict[int, str]] = None,
+                  pwms: Sequence[int] = (), number: Optional[int] = None) -> Path:
+        """
+        Adds hwmon<number> with its name, temp<n>_input (millidegrees), optional labels and pwm<n>/pwm<n>_enable files,
+        attached to the device dir, which is created if missing.
+        :return: the /sys/class/hwmon/hwmon<number> path
+        """
+        if number is None:
+            number = self._next_hwmon
+        self._next_hwmon = max(self._next_hwmon, number + 1)
+
+        device.mkdir(parents=True, exist_ok=True)
+        hwmon_dir = device.joinpath('hwmon', f'hwmon{number}')
+        hwmon_dir.mkdir(parents=True)
+        hwmon_dir.joinpath('name').write_text(f'{name}\n')
+        self._link(hwmon_dir.joinpath('device'), device)
+        for idx, millidegrees in (temps or {}).items():
+            hwmon_dir.joinpath(f'temp{idx}_input').write_text(f'{millidegrees}\n')
+        for idx, label in (labels or {}).items():
+            hwmon_dir.joinpath(f'temp{idx}_label').write_text(f'{label}\n')
+        for idx in pwms:
+            hwmon_dir.joinpath(f'pwm{idx}').write_text('128\n')
+            hwmon_dir.joinpath(f'pwm{idx}_enable').write_text('2\n')
+
+        class_path = self.sysfs_root.joinpath('class', 'hwmon', f'hwmon{number}')
+        self._link(class_path, hwmon_dir)
+        return class_path
+
+    def remove_hwmon(self, number: int):
+        class_path = self.sysfs_root.joinpath('class', 'hwmon', f'hwmon{number}')
+        hwmon_dir = class_path.resolve()
+        class_path.unlink()
+        for entry in hwmon_dir.iterdir():
+            entry.unlink()
+        hwmon_dir.rmdir()
+
+    def add_chip(self, name: str, temps: Dict[int, int], pwms: Sequence[int] = (), labels: Optional[Dict[int, str]] = None, number: Optional[int] = None) -> Path:
+        device = self.sysfs_root.joinpath('devices', 'platform', f'{name}.{number if number is not None else self._next_hwmon}')
+        return self.add_hwmon(name, device, temps, labels, pwms, number)
+
+    def add_ata_disk(self, block_name: str, model: str, millidegrees: int = 35000, host: int = 0) -> Path:
+        scsi_device = self.sysfs_root.joinpath('devices', 'pci0000:00', f'ata{host + 1}', f'host{host}', f'target{host}:0:0', f'{host}:0:0:0')
+        block = scsi_device.joinpath('block', block_name)
+        block.mkdir(parents=True)
+        self._link(self.sysfs_root.joinpath('class', 'block', block_name), block)
+        self.add_hwmon('drivetemp', scsi_device, {1: millidegrees})
+        return self._add_disk_id(f'ata-{model}', block_name)
+
+    def add_nvme_disk(self, controller: int, model: str, millidegrees: int = 40000, labels: Optional[Dict[int, str]] = None) -> Path:
+        controller_dir = self.sysfs_root.joinpath('devices', 'pci0000:00', f'0000:00:{controller + 1:02x}.0', 'nvme', f'nvme{controller}')
+        block_name = f'nvme{controller}n1'
+        block = controller_dir.joinpath(block_name)
+        block.mkdir(parents=True)
+        self._link(self.sysfs_root.joinpath('class', 'nvme', f'nvme{controller}'), controller_dir)
+        self._link(self.sysfs_root.joinpath('class', 'block', block_name), block)
+        self.add_hwmon('nvme', controller_dir, {1: millidegrees}, labels or {1: 'Composite'})
+        return self._add_disk_id(f'nvme-{model}', block_name)
+
+    def _add_disk_id(self, disk_id: str, block_name: str) -> Path:
+        dev_node = self.dev_root.joinpath(block_name)
+        dev_node.touch()
+        by_id = self.dev_root.joinpath('disk', 'by-id', disk_id)
+        self._link(by_id, dev_node)
+        part_node = self.dev_root.joinpath(f'{block_name}1')
+        part_node.touch()
+        self._link(self.dev_root.joinpath('disk', 'by-id', f'{disk_id}-part1'), part_node)
+        return by_id
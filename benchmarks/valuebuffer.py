@@ -0,0 +1,50 @@
+"""
+Microbenchmark of ValueBuffer against the deque based implementation it replaced.
+
+python -m benchmarks.valuebuffer
+"""
+import timeit
+from collections import deque
+
+from pyfc.common import ValueBuffer, mean
+
+
+class DequeValueBuffer:
+    """
+    The previous deque backed ValueBuffer, kept here as the baseline.
+    """
+
+    def __init__(self, name, default_value=0.0, capacity=32):
+        self.name = name
+        self.buffer = deque(maxlen=capacity)
+        self._default_value = default_value
+
+    def update(self, value: float):
+        self.buffer.append(value)
+
+    def mean(self) -> float:
+        try:
+            return mean(self.buffer)
+        except (ValueError, ZeroDivisionError):
+            return self._default_value
+
+
+def tick(buffer, value):
+    buffer.update(value)
+    return buffer.mean()
+
+
+def run(number: int = 100000):
+    print(f'{"entries":>8} {"deque µs/tick":>14} {"array µs/tick":>14} {"speedup":>8}')
+    for capacity in (32, 128, 1024):
+        results = []
+        for cls in (DequeValueBuffer, ValueBuffer):
+            buffer = cls('bench', 35, capacity=capacity)
+            for i in range(capacity):
+                buffer.update(float(i))
+            results.append(min(timeit.repeat(lambda: tick(buffer, 42.0), number=number, repeat=5)) / number * 1e6)
+        print(f'{capacity:>8} {results[0]:>14.3f} {results[1]:>14.3f} {results[0] / results[1]:>7.1f}x')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,107 @@
+"""
+Stretching the tick interval of a controller while its temperatures and speeds hold still,
+and snapping it back as soon as they move.
+"""
+import time
+from configparser import SectionProxy
+from typing import Callable, List, Optional
+
+from .common import ValueBuffer
+from .sampler import unwrap_inputs
+
+
+class AdaptiveInterval:
+    """
+    Decides how long until the next tick of one controller, after each of its ticks.
+
+    While every input changes slower than rate_threshold °C per second and the speed asked of every output
+    moved by no more than speed_tolerance PWM steps since the last tick, the interval grows by growth, up to maximum.
+    Once either moves it snaps back to the controller's regular interval right away,
+    so a controller stretched to maximum reacts within maximum seconds at worst, and at its regular pace from then on.
+
+    The rate of an input is the steeper of its last step and its slope across the last window readings,
+    kept in a ValueBuffer per input from what the input already read, so deciding costs no reads of its own.
+    The last step catches a climb right after a long stretched interval, which the slope across the window would dilute,
+    it also sees sensor noise at the regular interval, which rate_threshold needs to stay clear of.
+    """
+
+    def __init__(self, maximum: float, rate_threshold: float = 1.0, growth: float = 1.5, speed_tolerance: float = 2,
+                 window: int = 5, clock: Callable[[], float] = time.monotonic):
+        self.maximum = maximum
+        self.rate_threshold = rate_threshold
+        self.growth = growth
+        self.speed_tolerance = speed_tolerance
+        self.window = window
+        self.clock = clock
+        self.current: Optional[float] = None
+        self.snaps = 0
+        self.step_rate = 0.0
+        self.times = ValueBuffer('adaptive-times', capacity=window)
+        self._temperatures: List[ValueBuffer] = []
+        self._speeds: List[float] = []
+
+    @classmethod
+    def from_config(cls, device_config: SectionProxy) -> Optional['AdaptiveInterval']:
+        """
+        :return: an adaptive interval if the section enables it, None otherwise.
+        """
+        if not device_config.getboolean('adaptiveInterval', False):
+            return None
+        return cls(
+                device_config.getfloat('adaptiveMaximumInterval', 10.0),
+                device_config.getfloat('adaptiveRateThreshold', 1.0),
+                device_config.getfloat('adaptiveGrowth', 1.5),
+                device_config.getfloat('adaptiveSpeedTolerance', 2.0),
+        )
+
+    def rate(self) -> float:
+        """
+        The steepest change of any input over the last step or across the window, in °C per second.
+        """
+        span = self.times.last() - self.times.first()
+        if span <= 0:
+            return self.step_rate
+        slopes = (abs(temperatures.last() - temperatures.first()) / span for temperatures in self._temperatures)
+        return max(self.step_rate, max(slopes, default=0.0))
+
+    def _track(self, controller) -> bool:
+        """
+        Takes in the readings and speeds of the tick which just ran.
+        :return: True if a speed moved beyond speed_tolerance, or the inputs or outputs changed.
+        """
+        inputs = unwrap_inputs(controller.inputs)
+        if len(inputs) != len(self._temperatures):
+            # e.g. after a config reload, start over rather than compare different sensors.
+            self._temperatures = [ValueBuffer('adaptive-temperature', capacity=self.window) for _ in inputs]
+            self.times.clear()
+        now = self.clock()
+        step = now - self.times.last() if len(self.times) else 0.0
+        self.step_rate = 0.0
+        for input_dev, temperatures in zip(inputs, self._temperatures):
+            reading = input_dev.last_reading()
+            if reading is None:
+                continue
+            if step > 0 and len(temperatures):
+                self.step_rate = max(self.step_rate, abs(reading - temperatures.last()) / step)
+            temperatures.update(reading)
+        self.times.update(now)
+
+        speeds = [output.values.last() for output in controller.outputs]
+        moved = len(speeds) != len(self._speeds) \
+            or any(abs(speed - last) > self.speed_tolerance for speed, last in zip(speeds, self._speeds))
+        self._speeds = speeds
+        return moved
+
+    def update(self, controller, interval: float) -> float:
+        """
+        :param interval: the regular interval of the controller, the shortest one ever used.
+        :return: seconds until the next tick.
+        """
+        moved = self._track(controller)
+        if moved or self.current is None or self.rate() >= self.rate_threshold:
+            if self.current is not None and self.current > interval:
+                self.snaps += 1
+            self.current = interval
+        else:
+            self.current = min(max(self.current, interval) * self.growth, max(self.maximum, interval))
+        return self.current
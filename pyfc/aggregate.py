@@ -0,0 +1,98 @@
+"""
+Combining the temperatures of several inputs into the one a controller acts on.
+"""
+from configparser import SectionProxy
+from typing import Optional, Sequence
+
+MODES = ('mean', 'max', 'weighted')
+
+
+class Aggregate:
+    """
+    Combines one tick's readings, in a single pass over them:
+        mean: the plain average, what every controller did so far.
+        max: the hottest reading, so a zone reacts to its hottest component.
+        weighted: average with per input weights, inputs without a weight count once.
+        pN, e.g. p90: the N-th percentile, interpolated linearly between the closest readings.
+    Raises ValueError on no readings, like mean() does.
+    """
+    __slots__ = ('mode', 'weights', 'percentile')
+
+    def __init__(self, mode: str = 'mean', weights: Optional[Sequence[float]] = None):
+        mode = mode.strip().lower()
+        self.percentile: Optional[float] = None
+        if mode.startswith('p') and mode not in MODES:
+            try:
+                self.percentile = float(mode[1:])
+            except ValueError:
+                raise ValueError(f'Unknown aggregate: "{mode}"') from None
+            if not 0 <= self.percentile <= 100:
+                raise ValueError(f'Percentile must be within 0 and 100: "{mode}"')
+        elif mode not in MODES:
+            raise ValueError(f'Unknown aggregate: "{mode}", use one of {", ".join(MODES)} or pN')
+        if weights is not None and any(weight < 0 for weight in weights):
+            raise ValueError(f'Weights must not be negative: {weights}')
+        self.mode = mode
+        self.weights = tuple(weights) if weights else ()
+
+    @classmethod
+    def from_config(cls, device_config: SectionProxy) -> 'Aggregate':
+        weights = device_config.getlist('aggregateWeights', None)
+        return cls(device_config.get('aggregate', 'mean'), [float(weight) for weight in weights] if weights else None)
+
+    def check(self, count: int):
+        """
+        Rejects weights which don't match the inputs of a controller one to one.
+        Weights go by position over the inputs after every input section is expanded, e.g. into one input per drive.
+        """
+        if self.weights and count and len(self.weights) != count:
+            raise ValueError(f'aggregateWeights gives {len(self.weights)} weights for {count} inputs, '
+                             f'there must be one per input in order: {list(self.weights)}')
+
+    def unweighted(self) -> 'Aggregate':
+        """
+        The same aggregate for readings the weights don't refer to, e.g. the sensors within one drive.
+        """
+        if not self.weights and self.mode != 'weighted':
+            return self
+        return Aggregate('mean' if self.mode == 'weighted' else self.mode)
+
+    def __call__(self, values: Sequence[float]) -> float:
+        count = len(values)
+        if not count:
+            raise ValueError('sequence must have at least one value.')
+        if count == 1:
+            return float(values[0])
+        if self.mode == 'max':
+            return float(max(values))
+        if self.mode == 'mean':
+            return sum(values) / count
+        if self.mode == 'weighted':
+            weights = self.weights
+            total = 0.0
+            weight_total = 0.0
+            for idx, value in enumerate(values):
+                weight = weights[idx] if idx < len(weights) else 1.0
+                total += weight * value
+                weight_total += weight
+            if not weight_total:
+                raise ValueError('weights of the readings add up to 0.')
+            return total / weight_total
+
+        ordered = sorted(values)
+        rank = self.percentile / 100 * (count - 1)
+        low = int(rank)
+        if low + 1 >= count:
+            return float(ordered[-1])
+        return ordered[low] + (ordered[low + 1] - ordered[low]) * (rank - low)
+
+    def __eq__(self, other):
+        return isinstance(other, Aggregate) and (self.mode, self.weights) == (other.mode, other.weights)
+
+    def __hash__(self):
+        return hash((self.mode, self.weights))
+
+    def __repr__(self):
+        if self.weights:
+            return f'{self.mode} {list(self.weights)}'
+        return self.mode
@@ -1,7 +1,11 @@
 import logging
 from abc import ABCMeta, abstractmethod
-from collections import deque
-from typing import List, Union, Iterable, Sequence
+from array import array
+from configparser import SectionProxy
+from typing import List, Union, Iterable, Sequence, Iterator, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .curve import FanCurve
 
 log = logging.getLogger(__name__)
 
@@ -41,6 +45,18 @@ class InputDevice(metaclass=ABCMeta):
     def get_value(self) -> float:
         raise NotImplementedError
 
+    def smoothed(self) -> Optional[float]:
+        """
+        The smoothed value as of the last read, without reading the device again, None before the first read.
+        """
+        return self.values.mean() if len(self.values) else None
+
+    def last_reading(self) -> Optional[float]:
+        """
+        The raw value of the last read, without reading the device again, None before the first read.
+        """
+        return self.values.last() if len(self.values) else None
+
 
 class OutputDevice(metaclass=ABCMeta):
     """
@@ -50,14 +66,36 @@ class OutputDevice(metaclass=ABCMeta):
     def __init__(self, name):
         self.name = name
         self.values = ValueBuffer(name, 128)
+        # optional pyfc.shaping.OutputShaper applied to the speed before it's written.
+        self.shaper = None
 
     def set_value(self, value: Union[int, float]):
         self.values.update(value)
 
+    def target_speed(self) -> int:
+        """
+        The speed to write: the rounded mean of the requested values, passed through the shaper if there is one.
+        """
+        speed = round(self.values.mean())
+        if self.shaper is not None:
+            speed = self.shaper.shape(speed)
+        return speed
+
+    def committed_speed(self) -> Optional[int]:
+        """
+        The speed the device last took, None if unknown.
+        """
+        return None
+
     @abstractmethod
     def apply(self):
         raise NotImplementedError
 
+    def flush(self):
+        """
+        Writes out whatever apply() held back to batch it with other outputs, called at the end of every tick.
+        """
+
     @abstractmethod
     def enable(self):
         raise NotImplementedError
@@ -105,6 +143,12 @@ class DummyInput(InputDevice):
     def get_value(self):
         return self.temp
 
+    def smoothed(self) -> Optional[float]:
+        return self.temp
+
+    def last_reading(self) -> Optional[float]:
+        return self.temp
+
     def set_value(self, value):
         self.temp = value
 
@@ -117,7 +161,10 @@ class DummyOutput(OutputDevice):
 
     def apply(self):
         if self.enabled:
-            self.speed = round(self.values.mean())
+            self.speed = self.target_speed()
+
+    def committed_speed(self) -> Optional[int]:
+        return self.speed
 
     def enable(self):
         self.enabled = True
@@ -153,16 +200,104 @@ def lerp_range(seq: Iterable[Union[float, int]], input_min, input_max, output_mi
 
 
 class ValueBuffer:
-    def __init__(self, name, default_value=0.0):
+    """
+    Fixed capacity ring buffer of readings backed by an array of doubles.
+    Keeps a running sum and an exponentially weighted moving average up to date on every update,
+    so mean() and ewma() are O(1) no matter the capacity.
+    """
+
+    def __init__(self, name, default_value=0.0, capacity: int = 32, ewma_alpha: float = 0.25):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1.')
         self.name = name
-        self.buffer = deque(maxlen=32)
+        self.capacity = capacity
+        self.ewma_alpha = ewma_alpha
         self._default_value = default_value
+        self._buffer = array('d', bytes(8 * capacity))
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+        self._ewma: Optional[float] = None
 
     def update(self, value: float):
-        self.buffer.append(value)
+        value = float(value)
+        index = self._index
+        if self._count == self.capacity:
+            self._sum -= self._buffer[index]
+        else:
+            self._count += 1
+        self._buffer[index] = value
+        self._sum += value
+
+        index += 1
+        if index == self.capacity:
+            index = 0
+            # re-sum once per lap so floating point drift of the running sum can't accumulate.
+            if self._count == self.capacity:
+                self._sum = sum(self._buffer)
+        self._index = index
+
+        if self._ewma is None:
+            self._ewma = value
+        else:
+            self._ewma += self.ewma_alpha * (value - self._ewma)
+
+    def clear(self):
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+        self._ewma = None
+
+    def _filled(self) -> array:
+        if self._count == self.capacity:
+            return self._buffer
+        return self._buffer[:self._count]
 
     def mean(self) -> float:
-        try:
-            return mean(self.buffer)
-        except (ValueError, ZeroDivisionError):
+        if not self._count:
             return self._default_value
+        return self._sum / self._count
+
+    def last(self) -> float:
+        if not self._count:
+            return self._default_value
+        return self._buffer[self._index - 1]
+
+    def first(self) -> float:
+        """
+        The oldest reading still held.
+        """
+        if not self._count:
+            return self._default_value
+        return self._buffer[self._index if self._count == self.capacity else 0]
+
+    def min(self) -> float:
+        if not self._count:
+            return self._default_value
+        return min(self._filled())
+
+    def max(self) -> float:
+        if not self._count:
+            return self._default_value
+        return max(self._filled())
+
+    def ewma(self) -> float:
+        if self._ewma is None:
+            return self._default_value
+        return self._ewma
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[float]:
+        """
+        Iterates oldest to newest.
+        """
+        if self._count < self.capacity:
+            return iter(self._buffer[:self._count])
+        return iter(self._buffer[self._index:] + self._buffer[:self._index])
+
+
+def generate_passthrough_controller(device_config: SectionProxy, inputs: Iterable[InputDevice], outputs: Iterable[OutputDevice],
+                                    curve: Optional['FanCurve'] = None) -> PassthroughController:
+    return PassthroughController(inputs, outputs)
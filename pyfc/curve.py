@@ -0,0 +1,111 @@
+"""
+Compiled temperature to fan speed curves.
+"""
+import logging
+from array import array
+from configparser import SectionProxy
+from typing import Iterable, List, Sequence, Tuple, Union
+
+from .common import lerp
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+
+def parse_temps(temps: str, minimum_speed: float, maximum_speed: float) -> List[Tuple[float, float]]:
+    """
+    Turns a "temps" spec into (temperature °C, speed %) breakpoints.
+
+    "30, 55 | 50, 80" reads as: minimum speed up to 30°C, 50% at 55°C, maximum speed from 80°C up.
+    Middle points asking for less than the minimum speed are dropped.
+    Temperatures and speeds both have to be non-decreasing, otherwise a ValueError is raised.
+    """
+    # split string and turn it all to numbers.
+    temp_ranges = [[float(item.strip()) for item in temp.split('|')] for temp in temps.split(',')]
+    if len(temp_ranges) < 2 or len(temp_ranges[0]) != 1 or len(temp_ranges[-1]) != 1 or any(len(r) != 2 for r in temp_ranges[1:-1]):
+        raise ValueError(f'Malformed temps spec: "{temps}"')
+
+    points = [(temp_ranges[0][0], float(minimum_speed))]
+    points.extend((temp, speed) for temp, speed in temp_ranges[1:-1] if speed >= minimum_speed)
+    points.append((temp_ranges[-1][0], float(maximum_speed)))
+
+    for (previous_temp, previous_speed), (temp, speed) in zip(points, points[1:]):
+        if temp < previous_temp:
+            raise ValueError(f'Temperatures in temps spec must not decrease, {temp} follows {previous_temp}: "{temps}"')
+        if speed < previous_speed:
+            raise ValueError(f'Speeds in temps spec must not decrease, {speed} follows {previous_speed}: "{temps}"')
+
+    return points
+
+
+class FanCurve:
+    """
+    Lookup table of PWM values (0-255), one entry per resolution °C from 0°C up to a bit past the last breakpoint.
+    Lookups round to the nearest entry and clamp to the first or last entry outside the table.
+    """
+
+    def __init__(self, table: Sequence[int], resolution: float = 1.0):
+        if not table:
+            raise ValueError('A fan curve needs at least one entry.')
+        self.table = array('B', table)
+        self.resolution = resolution
+        self._scale = 1 / resolution
+        self._last = len(self.table) - 1
+
+    @classmethod
+    def from_points(cls, points: Sequence[Tuple[float, float]], resolution: float = 1.0) -> 'FanCurve':
+        top = max(points[-1][0], 100.0) + 1
+        table = []
+        segment = 0
+        for idx in range(int(round(top / resolution)) + 1):
+            temp = idx * resolution
+            while segment < len(points) - 1 and temp >= points[segment + 1][0]:
+                segment += 1
+            if segment == len(points) - 1 or temp < points[0][0]:
+                speed = points[segment][1]
+            else:
+                (start_temp, start_speed), (end_temp, end_speed) = points[segment], points[segment + 1]
+                speed = lerp(temp, start_temp, end_temp, start_speed, end_speed)
+            table.append(int(round(lerp(speed, 0, 100, 0, 255))))
+        return cls(table, resolution)
+
+    @classmethod
+    def from_config(cls, device_data: SectionProxy, resolution: float = None) -> 'FanCurve':
+        if resolution is None:
+            resolution = float(device_data.get('curveResolution', '0.1'))
+        if resolution <= 0:
+            raise ValueError(f'curveResolution must be greater than 0, got {resolution}.')
+        points = parse_temps(device_data.get('temps'), float(device_data.get('minimumSpeed')), float(device_data.get('maximumSpeed')))
+        return cls.from_points(points, resolution)
+
+    def __call__(self, temp: Union[float, int]) -> int:
+        idx = int(temp * self._scale + 0.5)
+        if idx < 0:
+            idx = 0
+        elif idx > self._last:
+            idx = self._last
+        return self.table[idx]
+
+    def evaluate_many(self, temps: Iterable[float]):
+        """
+        Evaluates a batch of temperatures, in a single vectorized lookup for numpy arrays.
+        """
+        if numpy is not None and isinstance(temps, numpy.ndarray):
+            indices = numpy.clip(numpy.floor(temps * self._scale + 0.5), 0, self._last).astype(numpy.intp)
+            return numpy.frombuffer(self.table, dtype=numpy.uint8)[indices]
+        return [self(temp) for temp in temps]
+
+    def __len__(self):
+        return len(self.table)
+
+    def __eq__(self, other):
+        if not isinstance(other, FanCurve):
+            return NotImplemented
+        return self.resolution == other.resolution and self.table == other.table
+
+    def __repr__(self):
+        return f'FanCurve(resolution={self.resolution}, entries={len(self.table)})'
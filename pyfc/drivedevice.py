@@ -1,12 +1,14 @@
-import re
-from abc import ABC
+from abc import ABC, abstractmethod
+from configparser import SectionProxy
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
-from .common import InputDevice, mean, NoSensorsFoundException
+from .aggregate import Aggregate
+from .common import InputDevice, NoSensorsFoundException
 import logging
 
-from .lmsensorsdevice import LMSensorsTempInput, try_and_find_label_for_input
+from .lmsensorsdevice import LMSensorsTempInput
+from .topology import Topology, get_topology
 
 log = logging.getLogger(__name__)
 
@@ -16,28 +18,17 @@ class UnsupportedDeviceTypeException(ValueError):
 
 
 def from_disk_by_id(disk_name: str, sensor_name: str = None):
-    disk_lookup_base = Path('/dev/disk/by-id/')
-    device_lookup_regex = r'^(.*?)-(.*?)(-part\d+)?$'
     devices = []
     mapping = {
         'ata':  ATADrive,
         'nvme': NVMeDrive,
     }
 
-    for device_path in disk_lookup_base.iterdir():
-        matches = re.match(device_lookup_regex, device_path.name)
-        device_type = matches.group(1)
-        device_name = matches.group(2)
-        if device_type not in mapping:
-            continue
-        if disk_name not in device_name:
-            continue
-
-        if matches.group(3) is not None:
-            log.debug('skipping due to having hit partition on device: %s', device_path)
+    for disk_id in get_topology().disks_matching(disk_name):
+        if disk_id.bus not in mapping:
             continue
 
-        device = mapping[device_type](device_path, device_name, sensor_name)
+        device = mapping[disk_id.bus](disk_id.path, disk_id.name, sensor_name)
 
         if device and device not in devices:
             devices.append(device)
@@ -57,6 +48,19 @@ class DriveDevice(InputDevice, ABC):
         self.sensor_name = sensor_name
 
         self.sensors: List[InputDevice] = []
+        # how the sensors of the drive, e.g. the composite and per die ones of an nvme drive, combine into one.
+        self.aggregate = Aggregate()
+
+    @classmethod
+    def from_sensors(cls, device_path: Path, device_name: str, sensors: List[InputDevice], sensor_name: str = None) -> 'DriveDevice':
+        """
+        Builds the drive around already known sensors, skipping hwmon discovery.
+        """
+        device = cls.__new__(cls)
+        DriveDevice.__init__(device, device_path, device_name, sensor_name)
+        device.sensors = list(sensors)
+        device._validate()
+        return device
 
     def __eq__(self, other):
         if not isinstance(other, DriveDevice):
@@ -70,67 +74,80 @@ class DriveDevice(InputDevice, ABC):
         return str(self.device_path)
 
     def get_value(self) -> float:
-        return mean((s.get_value() for s in self.sensors))
+        return self.aggregate([s.get_value() for s in self.sensors])
+
+    def smoothed(self) -> Optional[float]:
+        values = [value for value in (s.smoothed() for s in self.sensors) if value is not None]
+        return self.aggregate(values) if values else None
+
+    def last_reading(self) -> Optional[float]:
+        values = [value for value in (s.last_reading() for s in self.sensors) if value is not None]
+        return self.aggregate(values) if values else None
+
+    @abstractmethod
+    def find_hwmon_sensors(self):
+        """
+        Adds the sensors of the block device at real_path to sensors.
+        """
+
+    def rebind(self, topology: Topology) -> bool:
+        """
+        Follows the disk id to the block device it points at now, e.g. after a hot-swap, and finds that one's sensors,
+        otherwise just rebinds the sensors of the same block device.
+        :return: True if any sensor changed.
+        """
+        real_path = self.device_path.resolve()
+        if real_path == self.real_path or not real_path.exists():
+            return any([sensor.rebind(topology) for sensor in self.sensors if hasattr(sensor, 'rebind')])
+
+        previous_path, previous_sensors = self.real_path, self.sensors
+        self.real_path, self.sensors = real_path, []
+        self.find_hwmon_sensors()
+        if not self.sensors:
+            log.warning('No sensors found yet for %s at %s', self.device_path, real_path)
+            self.real_path, self.sensors = previous_path, previous_sensors
+            return False
+        log.info('Drive %s moved from %s to %s', self.device_path, previous_path, real_path)
+        return True
 
     def _validate(self):
         if not self.sensors:
             raise NoSensorsFoundException(f'No sensors found for device: "{self.real_path}"')
 
     def _match_sensor_path(self, path: Path):
-        sensor = LMSensorsTempInput(path)
+        sensor = LMSensorsTempInput.shared(path)
         if self.sensor_name and sensor.name == self.sensor_name:
             yield sensor
         else:
             yield sensor
 
 
-_hwmon_paths = {}
-
-
-def _match_hwmon_by_device(match_path: Path):
-    if not _hwmon_paths:
-        hwmon_path = Path(f'/sys/class/hwmon/')
-        for hwmon_dir in hwmon_path.iterdir():
-            _hwmon_paths[hwmon_dir.joinpath('device').resolve(True)] = hwmon_dir
-
-    for path, hwmon_dir in _hwmon_paths.items():
-        potential_match = set(match_path.parts).symmetric_difference(path.parts)
-        if len(potential_match) < 3:
-            return hwmon_dir
-
-    raise ValueError('No match found for device "%s"', match_path)
-
-
-def _handle_hwmon_dir(hwmon_path: Path, hwmon_device_name: str):
-    sensor_paths = []
-    sensor_name_path = hwmon_path.joinpath('name')
-    if sensor_name_path.exists() and sensor_name_path.read_text('utf-8') == f'{hwmon_device_name}\n':
-        for full_sensor_path in hwmon_path.iterdir():
-            if full_sensor_path.name.startswith('temp') and full_sensor_path.name.endswith('input'):
-                log.debug('Matched path: %s', full_sensor_path)
-                sensor_paths.append(full_sensor_path)
-    return sensor_paths
+def _match_hwmon_by_device(match_path: Path) -> Path:
+    hwmon_dir = get_topology().hwmon_for_device(match_path)
+    if hwmon_dir is None:
+        raise ValueError(f'No match found for device "{match_path}"')
+    return hwmon_dir.path
 
 
 def find_hwmon_directly(device_path: Path, hwmon_device_name: str):
-    sensor_paths = []
-    for device_directory in device_path.iterdir():
-        # if <device_path>/hwmon*/name == <sensor_name> then return list of <device_path>/hwmon*/temp*_input
-        if device_directory.name.startswith('hwmon') and device_directory.name != 'hwmon':
-            sensor_paths.extend(_handle_hwmon_dir(device_directory, hwmon_device_name))
-        # if <device_path>/hwmon/hwmon*/name == <sensor_name> then return list of <device_path>/hwmon*/temp*_input
-        elif device_directory.name == 'hwmon':
-            for hwmon_subdir in device_directory.iterdir():
-                if hwmon_subdir.name.startswith('hwmon'):
-                    sensor_paths.extend(_handle_hwmon_dir(hwmon_subdir, hwmon_device_name))
-
-    return sensor_paths
+    """
+    temp*_input of the <hwmon_device_name> hwmon dir registered right on the device, e.g. an nvme controller.
+    """
+    hwmon_dir = get_topology().by_device_name.get((device_path.resolve(), hwmon_device_name))
+    if hwmon_dir is None:
+        return []
+    return list(hwmon_dir.temp_inputs)
 
 
 def find_hwmon_from_device(device_path: Path, hwmon_device_name: str):
-    true_path = device_path.resolve()
-    hwmon_path = _match_hwmon_by_device(true_path)
-    return _handle_hwmon_dir(hwmon_path, hwmon_device_name)
+    """
+    temp*_input of the <hwmon_device_name> hwmon dir registered on the device or one of its closest parents,
+    e.g. the scsi device of a block device for drivetemp.
+    """
+    hwmon_dir = get_topology().hwmon_for_device(device_path, hwmon_device_name)
+    if hwmon_dir is None:
+        return []
+    return list(hwmon_dir.temp_inputs)
 
 
 class ATADrive(DriveDevice):
@@ -140,7 +157,7 @@ class ATADrive(DriveDevice):
         self._validate()
 
     def find_hwmon_sensors(self):
-        device_path = Path(f'/sys/class/block/{self.real_path.name}')
+        device_path = get_topology().sysfs_root.joinpath('class', 'block', self.real_path.name)
 
         for sensor_path in find_hwmon_directly(device_path, 'drivetemp'):
             self.sensors.extend(self._match_sensor_path(sensor_path))
@@ -160,10 +177,10 @@ class NVMeDrive(DriveDevice):
 
     def find_hwmon_sensors(self):
         # from nvme0n1 and similar to just nvme0
-        nvme_path = Path(f'/sys/class/nvme/{self.real_path.name[:-2]}')
+        nvme_path = get_topology().sysfs_root.joinpath('class', 'nvme', self.real_path.name[:-2])
 
         def _match_sensor_path(path: Path):
-            sensor = LMSensorsTempInput(path)
+            sensor = LMSensorsTempInput.shared(path)
             if self.sensor_name and sensor.name == self.sensor_name:
                 yield sensor
             else:
@@ -175,3 +192,17 @@ class NVMeDrive(DriveDevice):
         if not self.sensors:
             for sensor_path in find_hwmon_from_device(nvme_path, 'nvme'):
                 self.sensors.extend(_match_sensor_path(sensor_path))
+
+
+def generate_drive_input(input_config: SectionProxy) -> List[DriveDevice]:
+    specific_devices = input_config.getlist('diskIDs')
+    aggregate = Aggregate.from_config(input_config).unweighted()
+    devices = []
+    for device_id in specific_devices:
+        devices.extend(from_disk_by_id(device_id, input_config.getlist('diskSensors', None)))
+
+    # drop drives matched by more than one id, keeping the order of diskIDs, which weights refer to.
+    devices = list(dict.fromkeys(devices))
+    for device in devices:
+        device.aggregate = aggregate
+    return devices
@@ -0,0 +1,114 @@
+"""
+Registry of input, output and controller drivers, each imported only once a config section asks for it.
+"""
+import importlib
+import logging
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+log = logging.getLogger(__name__)
+
+INPUTS = 'inputs'
+OUTPUTS = 'outputs'
+CONTROLLERS = 'controllers'
+
+
+def load(target: str) -> Callable:
+    """
+    Imports "package.module:attribute" and returns the attribute.
+    """
+    module_name, _, attribute = target.partition(':')
+    loaded = importlib.import_module(module_name)
+    for part in attribute.split('.'):
+        loaded = getattr(loaded, part)
+    return loaded
+
+
+class DriverRegistry:
+    """
+    Maps the inputType, outputType and controllerType names used in the config to their factories.
+    Factories are kept as "module:attribute" strings and only imported on first use,
+    so e.g. requests and pyserial are never loaded unless influx or serial outputs are configured.
+
+    Input and output factories take the device section and return an iterable of devices,
+    controller factories take the device section, inputs, outputs and an optional precompiled FanCurve.
+
+    Other packages can add drivers through the "pyfc.inputs", "pyfc.outputs" and "pyfc.controllers" entry point groups,
+    the entry point name being the type name used in the config, e.g.
+        [project.entry-points."pyfc.outputs"]
+        mqtt = "pyfc_mqtt:generate_mqtt_output"
+    """
+
+    def __init__(self, builtin: Dict[str, Dict[str, str]]):
+        self._targets: Dict[str, Dict[str, Union[str, Callable]]] = {kind: dict(targets) for kind, targets in builtin.items()}
+        self._loaded: Dict[Tuple[str, str], Callable] = {}
+
+    def register(self, kind: str, name: str, target: Union[str, Callable]):
+        """
+        Adds or replaces a driver, target being either the factory itself or a "module:attribute" string.
+        """
+        self._targets.setdefault(kind, {})[name] = target
+        self._loaded.pop((kind, name), None)
+
+    def names(self, kind: str) -> List[str]:
+        names = set(self._targets.get(kind, {}))
+        names.update(ep.name for ep in self._entry_points(kind))
+        return sorted(names)
+
+    def get(self, kind: str, name: str) -> Callable:
+        """
+        The factory for a type name, importing its module on first use.
+        Raises KeyError for unknown names and ImportError if the driver or its dependencies can't be imported.
+        """
+        key = (kind, name)
+        if key in self._loaded:
+            return self._loaded[key]
+
+        target = self._targets.get(kind, {}).get(name)
+        if target is None:
+            target = self._from_entry_points(kind, name)
+        if target is None:
+            raise KeyError(f'No {kind} driver named "{name}", known are: {", ".join(self.names(kind))}')
+
+        factory = load(target) if isinstance(target, str) else target
+        log.debug('Loaded %s driver %s: %s', kind, name, target)
+        self._loaded[key] = factory
+        return factory
+
+    @staticmethod
+    def _entry_points(kind: str):
+        # importlib.metadata alone costs more import time than all the builtin drivers, so it's only imported when needed.
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return []
+        group = f'pyfc.{kind}'
+        found = entry_points()
+        if hasattr(found, 'select'):
+            return list(found.select(group=group))
+        return list(found.get(group, ()))
+
+    def _from_entry_points(self, kind: str, name: str) -> Optional[str]:
+        for entry_point in self._entry_points(kind):
+            if entry_point.name == name:
+                self._targets.setdefault(kind, {})[name] = entry_point.value
+                return entry_point.value
+        return None
+
+
+drivers = DriverRegistry({
+    INPUTS:      {
+        'componentTemp': 'pyfc.lmsensorsdevice:generate_component_temp_input',
+        'hddtemp':       'pyfc.hddtemp:generate_hddtemp_input',
+        'driveDevice':   'pyfc.drivedevice:generate_drive_input',
+    },
+    OUTPUTS:     {
+        'fanPWM': 'pyfc.lmsensorsdevice:generate_pwm_output',
+        'serial': 'pyfc.serialoutput:generate_serial_output',
+        'influx': 'pyfc.influxoutput:generate_influx_output',
+    },
+    CONTROLLERS: {
+        'temperature': 'pyfc.temperaturecontroller:generate_temperature_controller',
+        'passthrough': 'pyfc.common:generate_passthrough_controller',
+        'pid':         'pyfc.pidcontroller:generate_pid_controller',
+    },
+})
@@ -1,22 +1,72 @@
 """
 Module containing the FanController class
 """
+import asyncio
 import os
 import time
 import sys
 import logging
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
 
+from .adaptive import AdaptiveInterval
+from .hotplug import Reconciler
+from .instrumentation import Instrumentation
+from .prometheus import PrometheusExporter
+from .reload import Reloader
+from .sampler import ConcurrentSampler, unwrap_inputs, wrap_inputs
+from .scheduler import TickGate, TickStats, run_periodic
+from .sharedstate import SharedStatePublisher
+from .trace import TraceRecorder
+from .sensorregistry import registry
 from .temperaturecontroller import TemperatureController
 
 
 class FanController:
-    def __init__(self, pid_file: Path, interval: float, devices: Dict[str, TemperatureController]):
+    def __init__(self, pid_file: Path, interval: float, devices: Dict[str, TemperatureController],
+                 intervals: Optional[Dict[str, float]] = None, scheduler: str = 'sync',
+                 sampler: Optional[ConcurrentSampler] = None, reconciler: Optional[Reconciler] = None,
+                 instrumentation: Optional[Instrumentation] = None, exporter: Optional[PrometheusExporter] = None,
+                 reloader: Optional[Reloader] = None, recorder: Optional[TraceRecorder] = None,
+                 shared_state: Optional[SharedStatePublisher] = None, adaptive: Optional[Dict[str, AdaptiveInterval]] = None):
+        """
+        :param interval: tick interval for the synchronous loop and the default for devices missing from intervals.
+        :param intervals: per device tick intervals, only used by the asyncio scheduler.
+        :param scheduler: 'sync' runs every device in lockstep, 'asyncio' runs each device on its own interval.
+        :param sampler: if set, inputs are read concurrently by the sampler before the devices run.
+        :param reconciler: if set, polled for hotplug changes every tick, or every interval with the asyncio scheduler.
+        :param instrumentation: if set, every tick, controller run, input read and output write gets measured once started.
+        :param exporter: if set, its metrics get updated every tick, or every interval with the asyncio scheduler.
+        :param reloader: if set, reloads the config between ticks once requested, e.g. on SIGHUP.
+        :param recorder: if set, records the readings and speeds of every tick, or every interval with the asyncio scheduler.
+        :param shared_state: if set, publishes temperatures, speeds and loop figures every tick, or every interval with the asyncio scheduler.
+        :param adaptive: per device intervals which stretch while the device is stable, its regular interval being the shortest.
+         The sync scheduler ticks at the shortest interval any device asks for.
+        """
         self.pid_file = pid_file
         self.interval = interval
         self.devices = devices
+        self.intervals = intervals or {}
+        self.scheduler = scheduler
+        self.stats: Dict[str, TickStats] = {}
+        self.sampler = sampler
+        self.reconciler = reconciler
+        self.instrumentation = instrumentation
+        self.exporter = exporter
+        self.reloader = reloader
+        self.recorder = recorder
+        self.shared_state = shared_state
+        self.adaptive = adaptive if adaptive is not None else {}
+        if sampler is not None:
+            for device in devices.values():
+                device.inputs = wrap_inputs(device.inputs, sampler)
         self.runnable = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._device_tasks: Dict[str, asyncio.Task] = {}
+        self._failure: Optional[BaseException] = None
+        # with the asyncio scheduler, keeps device ticks and services out of the way of a config reload.
+        self._gate = TickGate()
 
     def create_pid(self):
         """
@@ -51,35 +101,232 @@ class FanController:
             logging.exception(msg, self.pid_file)
             sys.exit(msg.format(self.pid_file))
 
+    def poll_reload(self) -> bool:
+        """
+        Applies a requested config reload, and brings everything keeping track of the devices up to date.
+        :return: True if devices changed.
+        """
+        if self.reloader is None or not self.reloader.requested:
+            return False
+        # nothing may tick meanwhile, e.g. a trace or state file bind() replaces, or an output the reload disables.
+        with self._gate.exclusive():
+            if not self.reloader.poll(self):
+                return False
+            if self.instrumentation is not None:
+                self.instrumentation.instrument(self)
+            if self.exporter is not None:
+                self.exporter.bind(self)
+            if self.recorder is not None:
+                self.recorder.bind(self)
+            if self.shared_state is not None:
+                self.shared_state.bind(self)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._sync_device_tasks)
+        return True
+
+    def tick(self):
+        """
+        One lockstep pass over all devices.
+        """
+        self.poll_reload()
+        if self.reconciler is not None:
+            self.reconciler.poll()
+        registry.begin_tick()
+        if self.sampler is not None:
+            self.sampler.sample(i for device in self.devices.values() for i in unwrap_inputs(device.inputs))
+        for device in self.devices.values():
+            device.run()
+        outputs = set()
+        for c in self.devices.values():
+            outputs.update(c.apply_candidates())
+
+        for o in outputs:
+            o.apply()
+        for o in outputs:
+            o.flush()
+
+    def tick_device(self, device: Optional[TemperatureController]):
+        if device is None:
+            # removed by a reload, its task is about to be cancelled.
+            return
+        registry.begin_tick()
+        if self.sampler is not None:
+            self.sampler.sample(unwrap_inputs(device.inputs))
+        device.run()
+        outputs = device.apply_candidates()
+        for o in outputs:
+            o.apply()
+        for o in outputs:
+            o.flush()
+
+    def next_interval(self, name: str) -> float:
+        """
+        Seconds until the next tick of a device, its adaptive interval if it has one.
+        """
+        interval = self.intervals.get(name, self.interval)
+        adaptive = self.adaptive.get(name)
+        device = self.devices.get(name)
+        if adaptive is None or device is None:
+            return interval
+        return adaptive.update(device, interval)
+
+    def _next_sync_interval(self) -> float:
+        if not self.adaptive:
+            return self.interval
+        intervals = [adaptive.update(self.devices[name], self.interval) for name, adaptive in list(self.adaptive.items()) if name in self.devices]
+        # devices without an adaptive interval always need the regular one.
+        if len(intervals) < len(self.devices):
+            return self.interval
+        return min(intervals, default=self.interval)
+
     def start(self):
         """
         The glorious main loop of the program.
         """
         logging.debug(self.devices)
 
+        if self.instrumentation is not None:
+            self.instrumentation.instrument(self)
+
         for device in self.devices.values():
             device.enable()
 
-        while self.runnable:
-            try:
-                for device in self.devices.values():
-                    device.run()
-                outputs = set()
-                for c in self.devices.values():
-                    outputs.update(c.apply_candidates())
+        if self.exporter is not None:
+            self.exporter.start(self)
+
+        if self.recorder is not None:
+            self.recorder.start(self)
+
+        if self.shared_state is not None:
+            self.shared_state.start(self)
+
+        if self.scheduler == 'asyncio':
+            self._start_async()
+        else:
+            self._start_sync()
+
+        if self.shared_state is not None:
+            self.shared_state.stop()
+
+        if self.recorder is not None:
+            self.recorder.stop()
+
+        if self.exporter is not None:
+            self.exporter.stop()
 
-                for o in outputs:
-                    o.apply()
+        for device in self.devices.values():
+            device.disable()
+
+        if self.sampler is not None:
+            self.sampler.shutdown()
 
-                time.sleep(self.interval)
+        if self.reconciler is not None:
+            self.reconciler.close()
+
+    def _start_sync(self):
+        stats = self.stats['tick'] = TickStats('tick', self.interval)
+        while self.runnable:
+            try:
+                started = time.monotonic()
+                self.tick()
+                duration = time.monotonic() - started
+                stats.record_tick(0.0, duration, started)
+                if duration > self.interval:
+                    stats.record_overrun(int(duration // self.interval))
+                if self.exporter is not None:
+                    self.exporter.update()
+                if self.recorder is not None:
+                    self.recorder.record()
+                if self.shared_state is not None:
+                    self.shared_state.publish()
+                time.sleep(self._next_sync_interval())
             except KeyboardInterrupt:
                 self.runnable = False
             except Exception as e:
                 logging.exception('Caught exception, bailing.')
                 self.runnable = False
 
-        for device in self.devices.values():
-            device.disable()
+    def _start_async(self):
+        try:
+            asyncio.run(self._run_async())
+        except KeyboardInterrupt:
+            self.runnable = False
+        except Exception as e:
+            logging.exception('Caught exception, bailing.')
+            self.runnable = False
+        finally:
+            for stats in self.stats.values():
+                logging.info('scheduler stats: %s', stats)
+
+    async def _run_async(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if not self.runnable:
+            self._stop.set()
+
+        self._failure = None
+        self._sync_device_tasks()
+        services = {}
+        if self.reconciler is not None:
+            services['hotplug'] = self._gate.gated(self.reconciler.poll)
+        if self.exporter is not None:
+            services['metrics'] = self._gate.gated(self.exporter.update)
+        if self.recorder is not None:
+            services['trace'] = self._gate.gated(self.recorder.record)
+        if self.shared_state is not None:
+            services['state'] = self._gate.gated(self.shared_state.publish)
+        if self.reloader is not None:
+            services['reload'] = self.poll_reload
+        tasks = []
+        for name, service in services.items():
+            self.stats[name] = TickStats(name, self.interval)
+            tasks.append(self._create_task(run_periodic(service, self.stats[name], self._stop)))
+
+        try:
+            await self._stop.wait()
+            if self._failure is not None:
+                raise self._failure
+        finally:
+            self._stop.set()
+            for task in tasks + list(self._device_tasks.values()):
+                task.cancel()
+            self._device_tasks.clear()
+            self._loop = None
+
+    def _create_task(self, coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Task):
+        # a tick which raised ends the whole loop, like it does with the sync scheduler.
+        if not task.cancelled() and task.exception() is not None and self._failure is None:
+            self._failure = task.exception()
+            self._stop.set()
+
+    def _sync_device_tasks(self):
+        """
+        Runs every device on its own task, starting tasks for devices a reload added and cancelling those of removed ones.
+        Tasks look their device up by name on every tick, so a device a reload replaced is picked up right away.
+        """
+        for name in list(self._device_tasks):
+            if name not in self.devices:
+                self._device_tasks.pop(name).cancel()
+                self.stats.pop(name, None)
+        for name in self.devices:
+            if name not in self._device_tasks:
+                self.stats[name] = TickStats(name, self.intervals.get(name, self.interval))
+                self._device_tasks[name] = self._create_task(
+                        run_periodic(self._gate.gated(lambda n=name: self.tick_device(self.devices.get(n))), self.stats[name], self._stop,
+                                     lambda n=name: self.next_interval(n)))
+
+    def stop(self):
+        """
+        Ask the main loop to finish, safe to call from other threads and signal handlers.
+        """
+        self.runnable = False
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
 
     def run(self):
         self.runnable = True
@@ -1,47 +1,153 @@
 import logging
 import socket
+import threading
+from configparser import SectionProxy
 
-from typing import Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from .common import InputDevice, mean
+from .aggregate import Aggregate
+from .common import InputDevice
+from .sensorregistry import registry
 from .tempcontainers import TemperatureGroup
 
 log = logging.getLogger(__name__)
 
 
-class HDDTemp(InputDevice):
-    _temps: Dict[str, TemperatureGroup] = {}
+def parse_hddtemp(data: bytes) -> Iterator[Tuple[str, str, float]]:
+    """
+    Parses the daemon's "|dev|model|temp|unit||dev|model|temp|unit|" stream in one pass.
+    Drives reporting no temperature (NA, SLP, UNK, ...) are skipped.
+    :return: (device, model, temperature in °C) for every drive.
+    """
+    fields = data.split(b'|')
+    # every record is 4 fields, followed by the empty field between "||".
+    for idx in range(1, len(fields) - 3, 5):
+        device, model, temperature, unit = fields[idx:idx + 4]
+        try:
+            value = float(temperature)
+        except ValueError:
+            continue
+        if unit == b'F':
+            value = (value - 32) / 1.8
+        yield device.decode('utf-8', 'replace'), model.decode('utf-8', 'replace'), value
 
+
+class HDDTempClient:
+    """
+    One connection target per hddtemp daemon, shared by every HDDTemp input pointed at it,
+    so the daemon gets asked at most once per tick regardless of how many inputs filter its drives.
+    Readings are kept per device, e.g. /dev/sda, so identical drives each keep their own history,
+    with the model of every device alongside to filter by.
+    """
+    _clients: Dict[Tuple[str, int], 'HDDTempClient'] = {}
+    _clients_lock = threading.Lock()
+
+    @classmethod
+    def for_daemon(cls, host: str, port: int, time_read_sec: float = 1) -> 'HDDTempClient':
+        with cls._clients_lock:
+            if (host, port) not in cls._clients:
+                cls._clients[(host, port)] = cls(host, port, time_read_sec)
+            return cls._clients[(host, port)]
+
+    def __init__(self, host: str, port: int, time_read_sec: float = 1, timeout: float = 2.0, max_size: int = 1 << 20):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_size = max_size
+        self.available = False
+        self.fetches = 0
+        self.temps = TemperatureGroup(f'{host}_{port}', time_read_sec)
+        self.models: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def read_socket(self) -> bytes:
+        """
+        Reads the daemon's whole report, it closes the connection once everything is sent.
+        """
+        chunks = []
+        size = 0
+        with socket.create_connection((self.host, self.port), self.timeout) as a_socket:
+            while size < self.max_size:
+                chunk = a_socket.recv(4096)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+        return b''.join(chunks)
+
+    def try_read(self) -> bytes:
+        """
+         tries reading twice, if failing second time marks the whole thing as unavailable.
+        """
+        try:
+            data = self.read_socket()
+        except socket.error:
+            log.debug('Socket connection died, retrying')
+            try:
+                data = self.read_socket()
+            except socket.error:
+                self.available = False
+                log.exception('Socket definitely dead, no data from %s:%s', self.host, self.port)
+                return b''
+
+        self.available = True
+        return data
+
+    def refresh(self):
+        with self._lock:
+            if not self.temps.updatable():
+                return
+            self.fetches += 1
+            for device, model, temperature in parse_hddtemp(self.try_read()):
+                self.models[device] = model
+                self.temps.update(device, temperature)
+            self.temps.mark_read()
+
+
+class HDDTemp(InputDevice):
     """
     Class to access hddtemp data, through the daemon hddtemp uses.
     Requires that you actually run the hddtemp daemon
     on the localhost with the default port.
     """
 
-    def __init__(self, host='127.0.0.1', port=7634, devices=None, time_read_sec: int = 1):
+    def __init__(self, host='127.0.0.1', port=7634, devices=None, time_read_sec: int = 1, aggregate: Optional[Aggregate] = None):
         self.devices = devices if devices else [None]
+        self.aggregate = aggregate or Aggregate()
 
         self.host = host
         self.port = port
 
-        self.available = False
-        self._time_read_sec = time_read_sec
+        self.client = HDDTempClient.for_daemon(host, port, time_read_sec)
         super().__init__(self.group_name)
 
+    @property
+    def available(self) -> bool:
+        return self.client.available
+
     @property
     def temps(self) -> TemperatureGroup:
-        if self.group_name not in self._temps:
-            self._temps[self.group_name] = TemperatureGroup(self.group_name, self._time_read_sec)
-        return self._temps[self.group_name]
+        return self.client.temps
 
     @property
     def group_name(self):
         return f'{self.host}_{self.port}'
 
+    def drives(self) -> List[str]:
+        """
+        The devices of the daemon's report matching the configured models or devices, every one of them if none are configured.
+        """
+        if self.devices == [None]:
+            return list(self.temps.data)
+        return [device for device, model in list(self.client.models.items()) if model in self.devices or device in self.devices]
+
     def get_mean_temp(self) -> float:
+        """
+        The smoothed temperatures of the configured drives, or of every drive the daemon reports, combined by aggregate.
+        """
         try:
-            return mean((self.temps.mean(device) for device in self.devices))
-        except ZeroDivisionError:
+            return self.aggregate([self.temps.mean(device) for device in self.drives()])
+        except (ValueError, ZeroDivisionError):
             return 35.0
 
     def get_value(self):
@@ -51,61 +157,22 @@ class HDDTemp(InputDevice):
         If the daemon itself returns proper data that is.
         If data cannot be read, assume the temperature is around 35°C.
         """
-        if self.temps.updatable():
-            self.read_data()
+        self.client.refresh()
 
         return round(self.get_mean_temp(), None)
 
-    def read_socket(self):
-        """
-        reads 4096 bytes worth of socket info.
-        :return:
-        :type :return: str
-        """
-        a_socket = socket.socket()
-        a_socket.connect((self.host, self.port))
-        data = a_socket.recv(4096)
-        a_socket.close()
-        return data
-
-    def read_data(self):
-        data = self.try_read()
+    def smoothed(self) -> Optional[float]:
+        return self.get_mean_temp() if self.available else None
 
-        hddtemp_string = data.decode('utf-8')
+    def last_reading(self) -> Optional[float]:
+        values = [self.temps.data[device].last() for device in self.drives() if device in self.temps.data]
+        return self.aggregate(values) if values and self.available else None
 
-        for temp in hddtemp_string.split('||'):
-            try:
-                if temp[0] == '|':
-                    temp = temp[1:]
-
-                splitted = temp.split('|')
-                device_name = splitted[1]
-                temperature = float(temp.split('|')[2])
-                self.temps.update(device_name, temperature)
-            except (IndexError, ValueError):
-                continue
-            except:
-                """
-                TODO: figure out what exception can the above actually throw... partially did...
-                """
-                log.exception('something broke.')
-                continue
-
-    def try_read(self):
-        """
-         tries reading twice, if failing second time marks the whole thing as unavailable.
-        :return:
-        :type :return: bytes
-        """
-        try:
-            data = self.read_socket()
-        except socket.error:
-            log.debug('Socket connection died, retrying')
-            try:
-                data = self.read_socket()
-            except socket.error:
-                data = ''
-                self.available = False
-                log.exception('Socket definitely dead. Stopping access attempts')
 
-        return data
+def generate_hddtemp_input(input_config: SectionProxy) -> Iterable[HDDTemp]:
+    specific_devices = input_config.getlist('hddtempDevices', None)
+    host = input_config.get('hddtempHost', 'localhost')
+    port = int(input_config.get('hddtempPort', '7634'))
+    aggregate = Aggregate.from_config(input_config).unweighted()
+    key = ('hddtemp', host, port, tuple(specific_devices) if specific_devices else None, aggregate)
+    yield registry.get(key, lambda: HDDTemp(host, port, specific_devices, aggregate=aggregate))
@@ -0,0 +1,174 @@
+"""
+Hotplug reconciliation, rebinds inputs and outputs whose hwmon dir or disk went away and came back.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import threading
+import time
+from itertools import chain
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from .common import Controller
+from .sampler import unwrap_inputs
+from .topology import SYSFS_ROOT, DEV_ROOT, Topology, reset_topology
+
+log = logging.getLogger(__name__)
+
+IN_ATTRIB = 0x004
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+
+_WATCH_MASK = IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+
+class Inotify:
+    """
+    Minimal non-blocking inotify through libc, only telling whether anything happened in the watched dirs since the last check.
+    """
+
+    def __init__(self, paths: Iterable[Path]):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.watches = 0
+        for path in paths:
+            if libc.inotify_add_watch(self.fd, os.fsencode(str(path)), _WATCH_MASK) < 0:
+                error = ctypes.get_errno()
+                log.info('Not watching %s: %s', path, os.strerror(error))
+            else:
+                self.watches += 1
+
+    def pending(self) -> bool:
+        """
+        Drains all queued events, True if there were any.
+        """
+        had_events = False
+        while self.fd >= 0:
+            try:
+                if not os.read(self.fd, 4096):
+                    break
+            except BlockingIOError:
+                break
+            had_events = True
+        return had_events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __del__(self):
+        self.close()
+
+
+def scan_signature(hwmon_root: Path, disk_root: Path) -> Tuple:
+    """
+    The entries of the hwmon class dir and /dev/disk/by-id with their link targets,
+    cheap enough for every rescan: one listdir per dir and one readlink per entry, no file reads.
+    """
+    entries = []
+    for directory in (hwmon_root, disk_root):
+        try:
+            names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            try:
+                entries.append((str(directory), name, os.readlink(os.path.join(directory, name))))
+            except OSError:
+                entries.append((str(directory), name, None))
+    return tuple(entries)
+
+
+class Reconciler:
+    """
+    Watches /sys/class/hwmon and /dev/disk/by-id for hwmon dirs and disks coming and going,
+    through inotify where it works and a cheap rescan every rescan_interval seconds regardless,
+    sysfs for one does not send inotify events for devices the kernel adds.
+    When anything changed, the topology gets rescanned and every input and output with a rebind() method
+    gets the chance to point itself at its device again, healthy ones stay as they are.
+    """
+
+    def __init__(self, devices: Dict[str, Controller], rescan_interval: float = 30.0, sysfs_root: Path = None,
+                 dev_root: Path = None, use_inotify: bool = True, clock: Callable[[], float] = time.monotonic):
+        self.devices = devices
+        self.rescan_interval = rescan_interval
+        self.sysfs_root = Path(sysfs_root or SYSFS_ROOT)
+        self.dev_root = Path(dev_root or DEV_ROOT)
+        self.clock = clock
+        self.reconciles = 0
+        self.rebinds = 0
+        self._lock = threading.Lock()
+        self._signature = scan_signature(self.hwmon_root, self.disk_root)
+        self._next_rescan = clock() + rescan_interval
+
+        self.inotify: Optional[Inotify] = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify((self.hwmon_root, self.disk_root))
+            except (OSError, AttributeError):
+                log.info('inotify is not available, rescanning for hotplug every %s seconds', rescan_interval)
+
+    @property
+    def hwmon_root(self) -> Path:
+        return self.sysfs_root.joinpath('class', 'hwmon')
+
+    @property
+    def disk_root(self) -> Path:
+        return self.dev_root.joinpath('disk', 'by-id')
+
+    def poll(self) -> bool:
+        """
+        Checks for hotplug events, rescans if there were any or the rescan interval is up, and reconciles on changes.
+        Meant to be called once per tick.
+        :return: True if the devices were reconciled.
+        """
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            now = self.clock()
+            notified = self.inotify is not None and self.inotify.pending()
+            if not notified and now < self._next_rescan:
+                return False
+            self._next_rescan = now + self.rescan_interval
+
+            signature = scan_signature(self.hwmon_root, self.disk_root)
+            if signature == self._signature:
+                return False
+            self._signature = signature
+            self.reconcile()
+            return True
+        finally:
+            self._lock.release()
+
+    def reconcile(self) -> int:
+        """
+        Rescans the topology and rebinds whatever inputs and outputs moved.
+        :return: number of inputs and outputs which got rebound.
+        """
+        topology = Topology(self.sysfs_root, self.dev_root)
+        reset_topology(topology)
+
+        rebound = 0
+        # a config reload may add or remove devices meanwhile.
+        for name, device in list(self.devices.items()):
+            for item in chain(unwrap_inputs(device.inputs), device.outputs):
+                rebind = getattr(item, 'rebind', None)
+                if rebind is not None and rebind(topology):
+                    log.info('Rebound %r of device %s', item, name)
+                    rebound += 1
+        self.reconciles += 1
+        self.rebinds += rebound
+        return rebound
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
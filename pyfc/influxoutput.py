@@ -1,26 +1,239 @@
+import atexit
+import gzip
 import logging
 import re
+import threading
 import time
-from typing import Dict, Tuple, List
+from collections import deque
+from configparser import SectionProxy
+from pathlib import Path
+from typing import Deque, Dict, Iterable, Tuple, List, Optional
 
 from functools import partial
 
-from requests import Session
+from requests import Session, RequestException
 
 from pyfc.common import OutputDevice
+from pyfc.spool import LineSpool
 
 log = logging.getLogger(__name__)
 
 
+class InfluxBatcher:
+    """
+    Ships lines to an influx server from a background thread, so the control loop never waits on the network.
+    Lines queue up in a bounded queue, which drops the oldest lines once full and counts them.
+    A batch is sent once batch_lines lines are queued or the oldest queued line is max_age seconds old,
+    whichever comes first. Bodies are gzipped and failed posts are retried with exponential backoff.
+    With a spool, batches which still fail are written to disk instead of dropped, and replayed in large batches,
+    paced to replay_rate bytes per second, once the server accepts writes again.
+    One batcher is shared by every output pointed at the same server.
+    """
+    _batchers: Dict[tuple, 'InfluxBatcher'] = {}
+    _batchers_lock = threading.Lock()
+
+    @classmethod
+    def for_server(cls, url: str, auth: Optional[Tuple[str, str]], spool_options: Optional[dict] = None, **kwargs) -> 'InfluxBatcher':
+        """
+        The batcher of the server, created with the options of the first output pointed at it.
+        :param spool_options: arguments of the LineSpool of a new batcher, it is only opened if the batcher gets created.
+        """
+        options = dict(kwargs, spool_options=spool_options)
+        with cls._batchers_lock:
+            batcher = cls._batchers.get((url, auth))
+            if batcher is None:
+                if spool_options:
+                    kwargs['spool'] = LineSpool(**spool_options)
+                batcher = cls._batchers[(url, auth)] = cls(url, auth, **kwargs)
+                batcher.options = options
+            elif options != batcher.options:
+                log.warning('Outputs sharing the influx server %s need the same batch and spool options, '
+                            'using %s rather than %s', url, batcher.options, options)
+            return batcher
+
+    @classmethod
+    def drain(cls):
+        """
+        Gives stopped batchers up to their timeout to send what was left in their queues, when the process exits.
+        """
+        with cls._batchers_lock:
+            batchers = list(cls._batchers.values())
+        deadline = time.monotonic() + max((batcher.timeout for batcher in batchers), default=0.0)
+        for batcher in batchers:
+            thread = batcher._thread
+            if thread is not None and batcher._stopping.is_set():
+                thread.join(max(0.0, deadline - time.monotonic()))
+
+    def __init__(self, url: str, auth: Optional[Tuple[str, str]], batch_lines: int = 500, max_age: float = 10.0,
+                 queue_lines: int = 10000, timeout: float = 5.0, retries: int = 3, backoff: float = 0.5,
+                 spool: Optional[LineSpool] = None, replay_lines: int = 5000, replay_rate: float = 256 * 1024):
+        self.url = url
+        self.session = Session()
+        self.session.auth = auth
+        self.batch_lines = batch_lines
+        self.max_age = max_age
+        self.queue_lines = queue_lines
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.spool = spool
+        self.replay_lines = replay_lines
+        self.replay_rate = replay_rate
+        self.options: dict = {}
+
+        self.sent_lines = 0
+        self.spooled_lines = 0
+        self.replayed_lines = 0
+        # optimistic, so whatever is left in the spool from a previous run gets a replay attempt right away.
+        self.reachable = True
+        self._replay_after = 0.0
+        self.failed_batches = 0
+        self.dropped_lines = 0
+
+        self._queue: Deque[Tuple[float, str]] = deque()
+        self._condition = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._users = 0
+
+    def put(self, line: str):
+        with self._condition:
+            if len(self._queue) >= self.queue_lines:
+                self._queue.popleft()
+                self.dropped_lines += 1
+            self._queue.append((time.monotonic(), line))
+            # the first line starts the age timer, a full batch is due right away.
+            if len(self._queue) == 1 or len(self._queue) >= self.batch_lines:
+                self._condition.notify()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def start(self):
+        with self._condition:
+            self._users += 1
+            # a thread still sending what was left after a stop just carries on.
+            self._stopping.clear()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'pyfc-influx-{self.url}', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 0.0):
+        """
+        Stops the shipping thread once the last output using it is disabled.
+        The thread sends what is left in the queue on its own, this waits for it at most timeout seconds,
+        so disabling an output, e.g. on a reload, doesn't hold up the ticks. drain() waits for it at exit.
+        """
+        with self._condition:
+            self._users = max(0, self._users - 1)
+            if self._users or self._thread is None:
+                return
+            thread = self._thread
+            self._stopping.set()
+            self._condition.notify()
+        if timeout > 0:
+            thread.join(timeout)
+
+    def _replay_due(self) -> bool:
+        return bool(self.spool) and self.reachable and time.monotonic() >= self._replay_after
+
+    def _take_batch(self) -> Optional[List[str]]:
+        """
+        Waits until a batch is due and takes it off the queue.
+        An empty batch means it is time to replay part of the spool, None that the thread is done.
+        """
+        with self._condition:
+            while not self._stopping.is_set():
+                if len(self._queue) >= self.batch_lines or self._replay_due():
+                    break
+                timeout = None
+                if self._queue:
+                    timeout = self.max_age - (time.monotonic() - self._queue[0][0])
+                    if timeout <= 0:
+                        break
+                if self.spool and self.reachable:
+                    replay_in = self._replay_after - time.monotonic()
+                    timeout = replay_in if timeout is None else min(timeout, replay_in)
+                self._condition.wait(timeout)
+            if self._stopping.is_set() and not self._queue:
+                # decided under the lock, so start() either sees the thread gone or cancels the stop in time.
+                self._thread = None
+                return None
+            count = min(len(self._queue), self.batch_lines)
+            return [self._queue.popleft()[1] for _ in range(count)]
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            if batch:
+                self.ship(batch)
+            if self._replay_due() and not self._stopping.is_set():
+                self.replay()
+
+    def replay(self):
+        """
+        Sends one batch of the oldest spooled lines, then holds off the next one long enough to stay within replay_rate.
+        """
+        lines, token = self.spool.peek(self.replay_lines)
+        if not lines:
+            if token:
+                self.spool.commit(token)
+            return
+        body = gzip.compress('\n'.join(lines).encode('utf-8'))
+        try:
+            self.post(body)
+        except RequestException:
+            log.debug('Replaying spool to %s failed, waiting for the server to come back.', self.url, exc_info=True)
+            self.reachable = False
+            return
+        self.spool.commit(token)
+        self.replayed_lines += len(lines)
+        self._replay_after = time.monotonic() + sum(len(line) + 1 for line in lines) / self.replay_rate
+        log.debug('replayed %d spooled lines to %s', len(lines), self.url)
+
+    def post(self, body: bytes):
+        response = self.session.post(self.url, data=body, headers={'Content-Encoding': 'gzip'}, timeout=self.timeout)
+        response.raise_for_status()
+
+    def ship(self, batch: List[str]) -> bool:
+        body = gzip.compress('\n'.join(batch).encode('utf-8'))
+        # while the server is known to be down, don't spend time on retries when the batch can go to the spool.
+        retries = self.retries if self.reachable or self.spool is None else 0
+        for attempt in range(retries + 1):
+            try:
+                self.post(body)
+                self.sent_lines += len(batch)
+                self.reachable = True
+                log.debug('shipped %d lines to %s', len(batch), self.url)
+                return True
+            except RequestException:
+                log.debug('Failed sending %d lines to %s, attempt %d', len(batch), self.url, attempt + 1, exc_info=True)
+                if attempt < retries and self._stopping.wait(self.backoff * 2 ** attempt):
+                    # shutting down, don't hold up the exit with more retries.
+                    break
+
+        self.failed_batches += 1
+        self.reachable = False
+        if self.spool is not None:
+            self.spool.append(batch)
+            self.spooled_lines += len(batch)
+            log.debug('Spooled %d lines, could not send them to %s', len(batch), self.url)
+        else:
+            log.warning('Dropping %d lines, could not send them to %s', len(batch), self.url)
+        return False
+
+
 class InfluxLineOutput(OutputDevice):
-    _linebuffer: Dict[tuple, List[str]] = {}
 
-    def __init__(self, influx_server_url: str, auth_data: Tuple[str, str], measurement_group: str, measurement_name: str, tags: Dict[str, str]):
+    def __init__(self, influx_server_url: str, auth_data: Tuple[str, str], measurement_group: str, measurement_name: str, tags: Dict[str, str],
+                 **batcher_options):
         super().__init__(measurement_name)
 
         self.url = influx_server_url
-        self.session = Session()
-        self.session.auth = auth_data
+        self.batcher = InfluxBatcher.for_server(influx_server_url, auth_data, **batcher_options)
+        self.enabled = False
 
         str_template = '{measurement_group},{tags} {measurement_name}={measured_value} {timestamp}'
         self.template_func = partial(
@@ -28,21 +241,6 @@ class InfluxLineOutput(OutputDevice):
                 measurement_group=measurement_group,
                 tags=','.join((f'{k}={v}' for k, v in tags.items())),
         )
-        self._id = (self.url, self.session.auth, measurement_group, ((k, v) for k, v in tags), self.name)
-
-    @property
-    def linebuffer(self):
-        if self._id not in self._linebuffer:
-            log.debug('Didnt find linebuffer, creating a new one.', extra={'id': self._id})
-            self._linebuffer[self._id] = []
-
-        return self._linebuffer[self._id]
-
-    def _flush(self):
-        if self.linebuffer:
-            log.debug('flushing line buffer, lines: %d', len(self.linebuffer))
-            self.session.post(self.url, data='\n'.join(self.linebuffer))
-            self.linebuffer.clear()
 
     @property
     def measurement_name(self):
@@ -50,12 +248,55 @@ class InfluxLineOutput(OutputDevice):
         return re.sub(reg, '_', self.name)
 
     def apply(self):
-        self.linebuffer.append(self.template_func(timestamp=time.time_ns(), measured_value=self.values.mean(), measurement_name=self.measurement_name))
-        if len(self.linebuffer) >= 32:
-            self._flush()
+        self.batcher.put(self.template_func(timestamp=time.time_ns(), measured_value=self.values.mean(), measurement_name=self.measurement_name))
 
     def enable(self):
-        pass
+        if not self.enabled:
+            self.enabled = True
+            self.batcher.start()
 
     def disable(self):
-        self._flush()
+        if self.enabled:
+            self.enabled = False
+            self.batcher.stop()
+
+
+def generate_influx_output(device_config: SectionProxy) -> Iterable[InfluxLineOutput]:
+    auth = (device_config.get('influxServerUser', None), device_config.get('influxServerPassword', None))
+    if not (auth[0] and auth[1]):
+        auth = None
+
+    tag_keys = device_config.getlist('influxTagKeys', None)
+    tag_values = device_config.getlist('influxTagValues', None)
+    if tag_keys and tag_values:
+        tags = dict(zip(tag_keys, tag_values))
+    else:
+        tags = {}
+
+    batcher_options = {
+        'batch_lines': device_config.getint('influxBatchLines', 500),
+        'max_age':     device_config.getfloat('influxFlushSeconds', 10.0),
+        'queue_lines': device_config.getint('influxQueueLines', 10000),
+        'timeout':     device_config.getfloat('influxTimeout', 5.0),
+        'retries':     device_config.getint('influxRetries', 3),
+    }
+    if device_config.get('influxSpoolPath', None):
+        batcher_options['spool_options'] = {
+            'directory':     Path(device_config.get('influxSpoolPath')),
+            'segment_bytes': device_config.getint('influxSpoolSegmentBytes', 4 << 20),
+            'max_bytes':     device_config.getint('influxSpoolMaxBytes', 256 << 20),
+        }
+        batcher_options['replay_lines'] = device_config.getint('influxReplayLines', 5000)
+        batcher_options['replay_rate'] = device_config.getfloat('influxReplayBytesPerSecond', 256 * 1024)
+
+    yield InfluxLineOutput(
+            device_config.get('influxServerURL'),
+            auth,
+            device_config.get('influxGroup'),
+            device_config.get('influxMeasurementName'),
+            tags,
+            **batcher_options
+    )
+
+
+atexit.register(InfluxBatcher.drain)
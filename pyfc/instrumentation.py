@@ -0,0 +1,281 @@
+"""
+Opt-in latency histograms and error counters for the hot path of every tick.
+
+When enabled, the run of every controller, get_value of every input and apply of every output
+get wrapped on the instance, so nothing is measured, nor costs anything, unless instrumentation is switched on.
+The collected stats are written as JSON on SIGUSR1, and this module doubles as the command to ask for and show them:
+
+python -m pyfc.instrumentation --pid-file /var/run/pyFC.pid --stats-file /run/pyfc/stats.json
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .sampler import unwrap_inputs
+
+log = logging.getLogger(__name__)
+
+# upper bounds in seconds, from 10µs to 2.5s, anything slower lands in the overflow bucket.
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """
+    Fixed bucket histogram, a value goes into the first bucket whose upper bound is at least the value.
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = array('Q', bytes(8 * (len(self.bounds) + 1)))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-th value, the largest value seen for the overflow bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[idx], self.max) if idx < len(self.bounds) else self.max
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'bounds': list(self.bounds),
+            'counts': list(self.counts),
+            'count':  self.count,
+            'sum':    self.total,
+            'max':    self.max,
+        }
+
+
+class OperationStats:
+    """
+    Latency, errors and timeouts of one operation, e.g. get_value of one input, and the devices using it.
+    """
+    __slots__ = ('kind', 'name', 'type', 'devices', 'latency', 'errors', 'timeouts', 'source')
+
+    def __init__(self, kind: str, name: str, source: object, device: str, bounds: Sequence[float]):
+        self.kind = kind
+        self.name = name
+        self.type = type(source).__name__
+        self.devices = [device]
+        self.latency = Histogram(bounds)
+        self.errors = 0
+        self.timeouts = 0
+        self.source = source
+
+    def as_dict(self) -> dict:
+        return {
+            'kind':     self.kind,
+            'name':     self.name,
+            'type':     self.type,
+            'devices':  self.devices,
+            'errors':   self.errors,
+            'timeouts': self.timeouts,
+            'latency':  self.latency.as_dict(),
+        }
+
+
+class Instrumentation:
+    """
+    Wraps the tick, controller, input and output methods of a FanController on the instances and keeps their stats.
+    An input or output shared by several controllers is measured once, listing all of their names.
+    Errors are exceptions raised, plus calls after which the device reports itself as failing,
+    timeouts come from the concurrent sampler if there is one.
+    """
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS, clock: Callable[[], float] = time.perf_counter):
+        self.bounds = bounds
+        self.clock = clock
+        self.operations: Dict[Tuple[int, str], OperationStats] = {}
+        self.started = time.time()
+        self.sampler = None
+
+    def _wrap(self, source: object, method: str, kind: str, device: str, name: str):
+        key = (id(source), method)
+        if key in self.operations:
+            if device not in self.operations[key].devices:
+                self.operations[key].devices.append(device)
+            return
+
+        stats = OperationStats(kind, name, source, device, self.bounds)
+        original = getattr(source, method)
+        record = stats.latency.record
+        clock = self.clock
+
+        def instrumented(*args, **kwargs):
+            start = clock()
+            try:
+                result = original(*args, **kwargs)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                record(clock() - start)
+            if getattr(source, 'failing', False):
+                stats.errors += 1
+            return result
+
+        setattr(source, method, instrumented)
+        self.operations[key] = stats
+
+    def instrument(self, fan_controller):
+        """
+        Wraps everything one tick of fan_controller goes through, safe to call again after devices got added.
+        """
+        self._wrap(fan_controller, 'tick', 'tick', '*', 'tick')
+        self._wrap(fan_controller, 'tick_device', 'tick', '*', 'tick_device')
+        for device_name, device in fan_controller.devices.items():
+            self._wrap(device, 'run', 'run', device_name, type(device).__name__)
+            for input_dev in unwrap_inputs(device.inputs):
+                self._wrap(input_dev, 'get_value', 'input', device_name, repr(input_dev))
+            for output in device.outputs:
+                self._wrap(output, 'apply', 'output', device_name, str(getattr(output, 'output_file', output.name)))
+        self.sampler = fan_controller.sampler
+
+    def uninstrument(self):
+        for (_, method), stats in self.operations.items():
+            try:
+                delattr(stats.source, method)
+            except AttributeError:
+                pass
+        self.operations.clear()
+
+    def snapshot(self) -> dict:
+        if self.sampler is not None:
+            for stats in self.operations.values():
+                if stats.kind == 'input':
+                    stats.timeouts = self.sampler.timeouts.get(stats.source, 0)
+        return {
+            'pid':        os.getpid(),
+            'started':    self.started,
+            'time':       time.time(),
+            'operations': [stats.as_dict() for stats in self.operations.values()],
+        }
+
+    def dump(self, path: Path):
+        path = Path(path)
+        tmp_path = path.with_name(path.name + '.tmp')
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'w') as writer:
+                json.dump(self.snapshot(), writer)
+            os.replace(tmp_path, path)
+            log.info('Instrumentation stats written to %s', path)
+        except OSError:
+            log.exception('Could not write instrumentation stats to %s', path)
+
+    def dump_on_signal(self, path: Path, signum: int = signal.SIGUSR1):
+        signal.signal(signum, lambda received, frame: self.dump(path))
+
+
+def _histogram_quantile(latency: dict, q: float) -> float:
+    histogram = Histogram(latency['bounds'])
+    histogram.counts = array('Q', latency['counts'])
+    histogram.count = latency['count']
+    histogram.max = latency['max']
+    return histogram.quantile(q)
+
+
+def format_stats(stats: dict, device: Optional[str] = None) -> List[str]:
+    """
+    One line per operation, the most time consuming first, times in milliseconds.
+    """
+    operations = [o for o in stats['operations'] if device is None or device in o['devices'] or '*' in o['devices']]
+    operations.sort(key=lambda o: o['latency']['sum'], reverse=True)
+    lines = [f'{"kind":<7} {"devices":<16} {"name":<40} {"calls":>9} {"errors":>7} {"timeouts":>8} '
+             f'{"mean":>8} {"p50":>8} {"p99":>8} {"max":>8} {"total s":>9}']
+    for operation in operations:
+        latency = operation['latency']
+        mean = latency['sum'] / latency['count'] if latency['count'] else 0.0
+        lines.append(f'{operation["kind"]:<7} {",".join(operation["devices"])[:16]:<16} {operation["name"][-40:]:<40} '
+                     f'{latency["count"]:>9} {operation["errors"]:>7} {operation["timeouts"]:>8} '
+                     f'{mean * 1000:>8.3f} {_histogram_quantile(latency, 0.5) * 1000:>8.3f} '
+                     f'{_histogram_quantile(latency, 0.99) * 1000:>8.3f} {latency["max"] * 1000:>8.3f} {latency["sum"]:>9.3f}')
+    return lines
+
+
+def signal_and_wait(pid: int, signum: int, path: Path, timeout: float = 2.0) -> bool:
+    """
+    Signals the daemon and waits for it to (re)write path in response.
+    """
+    try:
+        before = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        before = None
+    os.kill(pid, signum)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if path.stat().st_mtime_ns != before:
+                return True
+        except FileNotFoundError:
+            pass
+        time.sleep(0.02)
+    return False
+
+
+def request_dump(pid: int, stats_file: Path, timeout: float = 2.0) -> bool:
+    """
+    Signals the daemon to write its stats and waits for the file to change.
+    """
+    return signal_and_wait(pid, signal.SIGUSR1, stats_file, timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Show the tick instrumentation stats of a running pyfc.')
+    parser.add_argument('--pid-file', default='/var/run/pyFC.pid', help='signal this process for fresh stats')
+    parser.add_argument('--stats-file', default='/run/pyfc/stats.json')
+    parser.add_argument('--no-signal', action='store_true', help='just show what the stats file has')
+    parser.add_argument('--device', help='only operations of this device')
+    parser.add_argument('--json', action='store_true', help='print the raw stats')
+    args = parser.parse_args(argv)
+
+    stats_file = Path(args.stats_file)
+    if not args.no_signal:
+        pid = int(Path(args.pid_file).read_text().strip())
+        if not request_dump(pid, stats_file):
+            print(f'{stats_file} did not change, is instrumentation enabled for pid {pid}?', file=sys.stderr)
+            return 1
+
+    with stats_file.open() as reader:
+        stats = json.load(reader)
+    if args.json:
+        json.dump(stats, sys.stdout, indent=2)
+        print()
+    else:
+        print(f'pid {stats["pid"]}, up {stats["time"] - stats["started"]:.0f}s')
+        print('\n'.join(format_stats(stats, args.device)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,34 @@
+import errno
 import logging
+import os
+import threading
+import time
+from configparser import SectionProxy
 from pathlib import Path
-from typing import List
+from typing import Iterable, List, Optional
 
 from .common import InputDevice, OutputDevice, lerp, ValueBuffer
+from .sensorregistry import registry
+from .topology import Topology, get_topology
 
 log = logging.getLogger(__name__)
 
 
 def try_and_find_label_for_input(path: Path):
-    label_path = path.parent.joinpath(path.name.replace('_input', '_label'))
+    return get_topology().label(path)
 
-    return label_path.read_text('utf-8').replace('\n', '') if label_path.exists() else path.name
+
+def chip_name_of(real_path: Path) -> Optional[str]:
+    """
+    Name of the hwmon chip a resolved hwmon file belongs to, telling chips on the same device apart on a rebind.
+    """
+    try:
+        return real_path.parent.joinpath('name').read_text().strip()
+    except OSError:
+        return None
+
+
+_STALE_ERRNOS = (errno.ENODEV, errno.ESTALE, errno.EBADF, errno.ENXIO)
 
 
 class LMSensorsDevice:
@@ -23,16 +41,8 @@ class LMSensorsDevice:
 
     @classmethod
     def path_from_device_name(cls, device_name: str) -> List[Path]:
-        device_path = Path('/sys/class/hwmon/')
-        matching_paths = []
-        for device_dir in device_path.iterdir():
-            potential_device_path = device_dir.joinpath('name')
-            with potential_device_path.open('r') as potential_file:
-                matches = potential_file.read().startswith(device_name)
-            log.debug('in dir %s, potential device path: %s, matches: %s', device_dir, potential_device_path, matches)
-
-            if matches:
-                matching_paths.append(device_dir)
+        matching_paths = [hwmon_dir.path for hwmon_dir in get_topology().hwmon_named(device_name)]
+        log.debug('hwmon dirs matching device name %s: %s', device_name, matching_paths)
 
         if matching_paths:
             return matching_paths
@@ -49,29 +59,124 @@ class LMSensorsTempInput(InputDevice, LMSensorsDevice):
     """
 
     @classmethod
-    def from_path(cls, sensor_name: str, device_name: str) -> List['LMSensorsTempInput']:
-        return [cls(path.joinpath(device_name)) for path in cls.path_from_device_name(sensor_name)]
+    def from_path(cls, sensor_name: str, device_name: str, persistent: bool = True) -> List['LMSensorsTempInput']:
+        return [cls.shared(path.joinpath(device_name), persistent) for path in cls.path_from_device_name(sensor_name)]
 
-    def __init__(self, sensor_path: Path):
+    @classmethod
+    def shared(cls, sensor_path: Path, persistent: bool = True, label: Optional[str] = None) -> 'LMSensorsTempInput':
+        """
+        Get the one input instance for the sensor file, so it is read once per tick however many controllers use it.
+        The settings of whichever section asked for the sensor first win.
+        """
+        sensor = registry.get(('lmsensors', sensor_path.resolve()), lambda: cls(sensor_path, persistent, label))
+        if sensor.persistent != persistent:
+            log.warning('Sensor %s is shared with persistentReads = %s, ignoring persistentReads = %s for it',
+                        sensor.path, sensor.persistent, persistent)
+        return sensor
+
+    def __init__(self, sensor_path: Path, persistent: bool = True, label: Optional[str] = None):
         """
         :param sensor_path: path to lm-sensors file
+        :param persistent: keep the sensor file open between reads and re-read it with pread.
+        :param label: name of the sensor, looked up from its temp*_label file if not given.
         """
         self.path = sensor_path
-        super().__init__(try_and_find_label_for_input(sensor_path))
+        self.real_path = sensor_path.resolve()
+        self.chip = chip_name_of(self.real_path)
+        super().__init__(label if label is not None else try_and_find_label_for_input(sensor_path))
         self.temp = ValueBuffer(self.name, 35)
+        self.persistent = persistent
+        self.failing = False
+        self.read_errors = 0
+        self._fd: Optional[int] = None
+        self._buffer = bytearray(16)
+        self._read_epoch = 0
+        # devices ticking on their own threads share the input, checking the epoch and reading has to be one step.
+        self._lock = threading.Lock()
 
-    def get_value(self) -> float:
-        try:
-            with self.path.open('r') as reader:
-                value = reader.read()
-                floatable = '{}.{}'.format(value[:-4], value[-4:])
-                self.temp.update(float(floatable))
-        except IOError:
-            log.exception('Could not read file: {}', self.path)
+    def _open(self) -> int:
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+        return self._fd
+
+    def close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def _read_persistent(self) -> float:
+        """
+        Re-read the already open sensor file from offset 0, sysfs regenerates the value on every read at offset 0.
+        A stale descriptor, e.g. after a driver reload, gets reopened once.
+        """
         try:
+            length = os.preadv(self._open(), [self._buffer], 0)
+        except OSError as e:
+            if e.errno not in _STALE_ERRNOS:
+                raise
+            self.close()
+            length = os.preadv(self._open(), [self._buffer], 0)
+        # int() takes the bytes directly and ignores the trailing newline, values are in millidegrees.
+        return int(self._buffer[:length]) / 1000
+
+    def _read_once(self) -> float:
+        with self.path.open('r') as reader:
+            value = reader.read()
+            floatable = '{}.{}'.format(value[:-4], value[-4:])
+            return float(floatable)
+
+    def get_value(self) -> float:
+        with self._lock:
+            if registry.is_current(self._read_epoch):
+                return self.temp.mean()
+            self._read_epoch = registry.epoch
+            try:
+                if self.persistent:
+                    self.temp.update(self._read_persistent())
+                else:
+                    self.temp.update(self._read_once())
+                self.failing = False
+            except (IOError, ValueError):
+                self.read_errors += 1
+                # a sensor which went away fails every tick until it is rebound, only log the first failure in full.
+                if not self.failing:
+                    log.exception('Could not read file: %s', self.path)
+                else:
+                    log.debug('Could not read file: %s', self.path)
+                self.failing = True
             return self.temp.mean()
-        except ZeroDivisionError:
-            return 35.0
+
+    def smoothed(self) -> Optional[float]:
+        return self.temp.mean() if len(self.temp) else None
+
+    def last_reading(self) -> Optional[float]:
+        return self.temp.last() if len(self.temp) else None
+
+    def rebind(self, topology: Topology) -> bool:
+        """
+        Points the input at the same sensor of the same device, if its hwmon dir got renumbered or came back.
+        :return: True if the input now reads a different file.
+        """
+        if self.real_path.exists() and self.path.resolve() == self.real_path:
+            return False
+        path = topology.relocate(self.real_path, self.chip)
+        if path is None:
+            log.warning('Sensor %s (%s) is still missing', self.name, self.path)
+            return False
+        log.info('Sensor %s moved from %s to %s', self.name, self.path, path)
+        with self._lock:
+            self.close()
+            previous_path = self.real_path
+            self.path = path
+            self.real_path = path.resolve()
+        registry.rekey(('lmsensors', previous_path), ('lmsensors', self.real_path), self)
+        return True
+
+    def __del__(self):
+        self.close()
 
     def __repr__(self):
         return self.name
@@ -85,15 +190,31 @@ class LMSensorsOutput(OutputDevice, LMSensorsDevice):
     """
 
     @classmethod
-    def from_path(cls, sensor_name: str, device_name: str, enable_file: str) -> List['LMSensorsOutput']:
-        return [cls(path, device_name, enable_file) for path in cls.path_from_device_name(sensor_name)]
+    def from_path(cls, sensor_name: str, device_name: str, enable_file: str, refresh_interval: Optional[float] = None) -> List['LMSensorsOutput']:
+        return [cls(path, device_name, enable_file, refresh_interval) for path in cls.path_from_device_name(sensor_name)]
 
-    def __init__(self, sensor_path: Path, device_name: str, enable_file: str):
+    def __init__(self, sensor_path: Path, device_name: str, enable_file: str, refresh_interval: Optional[float] = None):
+        """
+        :param refresh_interval: seconds after which an unchanged speed gets written again anyway,
+        in case the firmware overrode it. None means unchanged speeds are never rewritten.
+        """
         super().__init__(device_name)
+        # the hotplug reconciler may rebind the output while a device tick writes it.
+        self._lock = threading.RLock()
         self.output_file = sensor_path.joinpath(device_name)
         self.enable_file = sensor_path.joinpath(enable_file)
+        self.real_path = self.output_file.resolve()
+        self.chip = chip_name_of(self.real_path)
         self.old_value = '2'  # default to '2' as old value, this means "automatic fan speed control enabled"
         self.enabled = False
+        self.refresh_interval = refresh_interval
+        self.committed: Optional[int] = None
+        self.committed_at = 0.0
+        self.writes = 0
+        self.writes_skipped = 0
+        self.write_errors = 0
+        self.failing = False
+        self._fd: Optional[int] = None
 
     def get_old_value(self):
         """
@@ -111,42 +232,137 @@ class LMSensorsOutput(OutputDevice, LMSensorsDevice):
         """
         writes '1' to the enabler file.
         """
-        self.get_old_value()
-        log.debug('writing to enabler: %s', self.enable_file)
-        try:
-            with self.enable_file.open('w') as writer:
-                writer.write('1')
-            self.enabled = True
-        except (IOError, PermissionError):
-            log.exception('Error writing to enabling file: %s', self.enable_file)
-            self.enabled = False
+        with self._lock:
+            self.get_old_value()
+            log.debug('writing to enabler: %s', self.enable_file)
+            try:
+                with self.enable_file.open('w') as writer:
+                    writer.write('1')
+                self.enabled = True
+                # switching to manual mode does not keep whatever the firmware had, always write the first speed.
+                self.committed = None
+            except (IOError, PermissionError):
+                log.exception('Error writing to enabling file: %s', self.enable_file)
+                self.enabled = False
+
+    def _write(self, speed: int):
+        """
+        Write the speed through the kept open pwm file, reopening once if the descriptor went stale.
+        """
+        data = str(speed).encode('ascii')
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.output_file, os.O_WRONLY | os.O_CLOEXEC)
+            try:
+                os.pwrite(self._fd, data, 0)
+            except OSError as e:
+                if e.errno not in _STALE_ERRNOS:
+                    raise
+                self.close()
+                self._fd = os.open(self.output_file, os.O_WRONLY | os.O_CLOEXEC)
+                os.pwrite(self._fd, data, 0)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                try:
+                    os.close(self._fd)
+                except OSError:
+                    pass
+                self._fd = None
 
     def apply(self):
-        if not self.enabled:
-            return
+        with self._lock:
+            if not self.enabled:
+                return
 
-        speed = round(self.values.mean())
-        try:
-            log.debug('Speed for device: %s set to %s', self.output_file, int(lerp(speed, 0, 255, 0, 100)))
-            with self.output_file.open('a') as writer:
-                writer.write(str(speed))
-        except (IOError, PermissionError):
-            log.exception('Error writing speed to device: %s', self.output_file)
+            speed = self.target_speed()
+            now = time.monotonic()
+            if speed == self.committed and (self.refresh_interval is None or now - self.committed_at < self.refresh_interval):
+                self.writes_skipped += 1
+                return
+
+            try:
+                log.debug('Speed for device: %s set to %s', self.output_file, int(lerp(speed, 0, 255, 0, 100)))
+                self._write(speed)
+                self.committed = speed
+                self.committed_at = now
+                self.writes += 1
+                self.failing = False
+            except (IOError, PermissionError):
+                self.committed = None
+                self.write_errors += 1
+                if not self.failing:
+                    log.exception('Error writing speed to device: %s', self.output_file)
+                else:
+                    log.debug('Error writing speed to device: %s', self.output_file)
+                self.failing = True
+
+    def committed_speed(self) -> Optional[int]:
+        return self.committed
+
+    def rebind(self, topology: Topology) -> bool:
+        """
+        Points the output at the same pwm of the same device, if its hwmon dir got renumbered or came back.
+        An enabled output switches the new pwm to manual control right away.
+        :return: True if the output now writes a different file.
+        """
+        if self.real_path.exists() and self.output_file.resolve() == self.real_path:
+            return False
+        path = topology.relocate(self.real_path, self.chip)
+        if path is None:
+            log.warning('Output %s is still missing', self.output_file)
+            return False
+        log.info('Output %s moved to %s', self.output_file, path)
+        with self._lock:
+            was_enabled = self.enabled
+            self.close()
+            self.output_file = path
+            self.enable_file = path.parent.joinpath(self.enable_file.name)
+            self.real_path = path.resolve()
+            self.committed = None
+            if was_enabled:
+                self.enable()
+        return True
 
     def disable(self):
         """
-        disable the device.
+        disable the device, handing the fan back to whatever controlled it before, if this output ever took it over.
         """
-        try:
-            with self.enable_file.open('w') as writer:
-                writer.write(self.old_value)
-        except (IOError, PermissionError):
-            log.exception('Error writing to enabling file: %s', self.enable_file)
-        finally:
-            self.enabled = False
+        with self._lock:
+            self.close()
+            self.committed = None
+            if not self.enabled:
+                # e.g. an output dropped after a failed warm build, or a duplicate of an already enabled output
+                # found while reloading the config, it must not touch a fan it never took over.
+                return
+            try:
+                with self.enable_file.open('w') as writer:
+                    writer.write(self.old_value)
+            except (IOError, PermissionError):
+                log.exception('Error writing to enabling file: %s', self.enable_file)
+            finally:
+                self.enabled = False
 
     def __del__(self):
         """
         Always disable when exiting!
         """
         self.disable()
+
+
+def generate_component_temp_input(input_config: SectionProxy) -> Iterable[LMSensorsTempInput]:
+    specific_devices = input_config.getlist('temperatureMonitorDeviceName')
+    persistent = input_config.getboolean('persistentReads', True)
+    for idx, path in enumerate(input_config.getlist('temperatureMonitor')):
+        yield from LMSensorsTempInput.from_path(specific_devices[idx], path, persistent)
+
+
+def generate_pwm_output(device_config: SectionProxy) -> Iterable[LMSensorsOutput]:
+    output_device = device_config.get('outputDeviceName')
+    specific_device_outputs = device_config.getlist('device')
+    specific_device_output_enablers = device_config.getlist('outputEnabler')
+    refresh_interval = device_config.getfloat('pwmRefreshInterval', None)
+
+    for idx, path in enumerate(specific_device_outputs):
+        yield from LMSensorsOutput.from_path(output_device, path, specific_device_output_enablers[idx], refresh_interval)
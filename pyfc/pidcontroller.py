@@ -0,0 +1,130 @@
+import logging
+import time
+from configparser import SectionProxy
+from typing import Callable, Iterable, Optional
+
+from .aggregate import Aggregate
+from .common import InputDevice, OutputDevice, Controller, ValueBuffer, lerp
+from .curve import FanCurve
+
+log = logging.getLogger(__name__)
+
+
+class PIDController(Controller):
+    """
+    Holds the temperature of its inputs at a target by driving the fan speed with a PID loop.
+
+    Gains work in fan speed % per °C (kp), % per °C second (ki) and % per °C/s (kd).
+    The derivative acts on the measured temperature rather than the error, and is smoothed with the EWMA
+    of a ValueBuffer of temperature slopes, so sensor noise doesn't end up on the fans.
+    The integrator only accumulates while the output is not saturated, or while the error drives it back
+    out of saturation, and every term is scaled by the measured time between ticks,
+    so late or irregular ticks don't change the loop's behaviour.
+    """
+
+    def __init__(self, input_devices: Iterable[InputDevice], output_devices: Iterable[OutputDevice], target: float,
+                 kp: float = 5.0, ki: float = 0.15, kd: float = 30.0, minimum_speed: float = 20, maximum_speed: float = 100,
+                 derivative_smoothing: float = 0.05, max_dt: float = 10.0, clock: Callable[[], float] = time.monotonic,
+                 aggregate: Optional[Aggregate] = None):
+        """
+        :param target: temperature to hold, in °C
+        :param derivative_smoothing: EWMA factor for the temperature slope, lower is smoother.
+        :param max_dt: longest time between ticks taken into account, so a long stall doesn't dump a huge step into the integrator.
+        :param clock: monotonic time source in seconds.
+        :param aggregate: how the temperatures of the inputs combine into the one held at target, the mean if not given.
+        """
+        self.inputs = [d for d in input_devices if d]
+        self.outputs = [d for d in output_devices if d]
+        self.target = target
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.minimum_speed = minimum_speed
+        self.maximum_speed = maximum_speed
+        self.max_dt = max_dt
+        self.clock = clock
+        self.aggregate = aggregate or Aggregate()
+        self.aggregate.check(len(self.inputs))
+
+        self.slopes = ValueBuffer('pid-slope', 0.0, ewma_alpha=derivative_smoothing)
+        # start from the minimum speed, so the loop takes over without a jump at the target temperature.
+        self.integral = float(minimum_speed)
+        self.output = float(minimum_speed)
+        self._last_temp: Optional[float] = None
+        self._last_time: Optional[float] = None
+
+    def update(self, temp: float) -> float:
+        """
+        Advances the loop with a new temperature reading.
+        :return: fan speed in %
+        """
+        now = self.clock()
+        dt = 0.0
+        if self._last_time is not None:
+            dt = min(max(now - self._last_time, 0.0), self.max_dt)
+            if dt > 0:
+                self.slopes.update((temp - self._last_temp) / dt)
+        self._last_time = now
+        self._last_temp = temp
+
+        error = temp - self.target
+        proportional = self.kp * error
+        derivative = self.kd * self.slopes.ewma()
+
+        integral = self.integral + self.ki * error * dt
+        output = proportional + integral + derivative
+        if self.minimum_speed <= output <= self.maximum_speed \
+                or output > self.maximum_speed and error < 0 \
+                or output < self.minimum_speed and error > 0:
+            self.integral = min(max(integral, self.minimum_speed), self.maximum_speed)
+
+        self.output = min(max(proportional + self.integral + derivative, self.minimum_speed), self.maximum_speed)
+        return self.output
+
+    def run(self):
+        try:
+            temp = self.aggregate([input_dev.get_value() for input_dev in self.inputs])
+            speed = round(lerp(self.update(temp), 0, 100, 0, 255))
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('temperature %s°C, target %s°C, speed: %.1f%%', temp, self.target, self.output)
+        except ValueError:
+            speed = 128
+
+        for output_dev in self.outputs:
+            output_dev.set_value(speed)
+
+    def apply_candidates(self):
+        return self.outputs
+
+    def enable(self):
+        for output_dev in self.outputs:
+            output_dev.enable()
+
+    def disable(self):
+        for output_dev in self.outputs:
+            output_dev.disable()
+
+    def valid(self) -> bool:
+        return bool(self.inputs and self.outputs)
+
+    def __del__(self):
+        self.disable()
+
+
+def generate_pid_controller(device_config: SectionProxy, inputs: Iterable[InputDevice], outputs: Iterable[OutputDevice],
+                            curve: Optional[FanCurve] = None) -> PIDController:
+    target = device_config.getfloat('targetTemperature')
+    if target is None:
+        raise ValueError(f'controllerType = pid needs a targetTemperature in [{device_config.name}]')
+    return PIDController(
+            inputs,
+            outputs,
+            target,
+            device_config.getfloat('pidKp', 5.0),
+            device_config.getfloat('pidKi', 0.15),
+            device_config.getfloat('pidKd', 30.0),
+            device_config.getfloat('minimumSpeed'),
+            device_config.getfloat('maximumSpeed'),
+            device_config.getfloat('pidDerivativeSmoothing', 0.05),
+            aggregate=Aggregate.from_config(device_config),
+    )
@@ -0,0 +1,202 @@
+"""
+Cached device plan: the resolved sysfs paths, sensor labels and compiled curves of every configured device,
+so a restart within the same boot and with the same config skips discovery and curve compilation.
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+from configparser import ConfigParser
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from .aggregate import Aggregate
+from .common import Controller, InputDevice, OutputDevice, NoSensorsFoundException
+from .curve import FanCurve
+from .deviceloader import create_device
+from .drivedevice import DriveDevice, ATADrive, NVMeDrive
+from .lmsensorsdevice import LMSensorsTempInput, LMSensorsOutput
+from .sensorregistry import registry
+from .temperaturecontroller import TemperatureController
+from .topology import SYSFS_ROOT
+
+log = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+BOOT_ID_PATH = Path('/proc/sys/kernel/random/boot_id')
+
+_drive_classes = {
+    'ata':  ATADrive,
+    'nvme': NVMeDrive,
+}
+
+
+def read_boot_id(boot_id_path: Path = BOOT_ID_PATH) -> str:
+    try:
+        return boot_id_path.read_text('utf-8').strip()
+    except OSError:
+        return ''
+
+
+def hwmon_names(sysfs_root: Path = None) -> List[List[str]]:
+    """
+    (hwmon dir, chip name) of every hwmon dir, a driver loading or hwmon numbers shuffling changes this.
+    """
+    hwmon_root = Path(sysfs_root or SYSFS_ROOT).joinpath('class', 'hwmon')
+    names = []
+    try:
+        entries = sorted(os.listdir(hwmon_root))
+    except FileNotFoundError:
+        return names
+    for entry in entries:
+        try:
+            names.append([entry, hwmon_root.joinpath(entry, 'name').read_text('utf-8').strip()])
+        except OSError:
+            continue
+    return names
+
+
+def plan_key(config_path: Path, sysfs_root: Path = None, boot_id_path: Path = BOOT_ID_PATH) -> str:
+    digest = hashlib.sha256()
+    digest.update(read_boot_id(boot_id_path).encode())
+    digest.update(b'\0')
+    digest.update(Path(config_path).read_bytes())
+    digest.update(b'\0')
+    digest.update(json.dumps(hwmon_names(sysfs_root)).encode())
+    return digest.hexdigest()
+
+
+def describe_input(device: InputDevice) -> Optional[dict]:
+    if isinstance(device, LMSensorsTempInput):
+        return {'type': 'lmsensors', 'path': str(device.path), 'label': device.name, 'persistent': device.persistent}
+    if isinstance(device, DriveDevice):
+        bus = next((bus for bus, cls in _drive_classes.items() if type(device) is cls), None)
+        sensors = [describe_input(sensor) for sensor in device.sensors]
+        if bus is None or None in sensors:
+            return None
+        return {'type': 'drive', 'bus': bus, 'path': str(device.device_path), 'name': device.device_name,
+                'sensor_name': device.sensor_name, 'sensors': sensors}
+    return None
+
+
+def describe_output(device: OutputDevice) -> Optional[dict]:
+    if isinstance(device, LMSensorsOutput):
+        return {'type': 'pwm', 'path': str(device.output_file.parent), 'file': device.output_file.name,
+                'enabler': device.enable_file.name, 'refresh': device.refresh_interval}
+    return None
+
+
+def describe_group(devices: Iterable, describe) -> Optional[list]:
+    """
+    Descriptions of all devices, or None if any of them can't be described, so the group gets built from config instead.
+    """
+    descriptions = [describe(device) for device in devices]
+    return None if None in descriptions else descriptions
+
+
+def describe_device(device: Controller) -> dict:
+    curve = getattr(device, 'speeds', None) if isinstance(device, TemperatureController) else None
+    return {
+        'inputs':  describe_group(device.inputs, describe_input),
+        'outputs': describe_group(device.outputs, describe_output),
+        'curve':   {'resolution': curve.resolution, 'table': base64.b64encode(curve.table.tobytes()).decode()} if curve else None,
+    }
+
+
+def _planned_paths(description: dict) -> Iterable[str]:
+    for item in description['inputs'] or ():
+        if item['type'] == 'drive':
+            yield item['path']
+            yield from (sensor['path'] for sensor in item['sensors'])
+        else:
+            yield item['path']
+    for item in description['outputs'] or ():
+        yield os.path.join(item['path'], item['file'])
+        yield os.path.join(item['path'], item['enabler'])
+
+
+def validate_plan(plan: dict) -> bool:
+    """
+    Cheap check that every path the plan refers to is still there, one stat per path.
+    """
+    for description in plan['devices'].values():
+        for path in _planned_paths(description):
+            if not os.path.exists(path):
+                log.info('Planned path is gone: %s', path)
+                return False
+    return True
+
+
+def build_input(item: dict) -> InputDevice:
+    if item['type'] == 'drive':
+        return _drive_classes[item['bus']].from_sensors(Path(item['path']), item['name'], [build_input(s) for s in item['sensors']], item['sensor_name'])
+    return LMSensorsTempInput.shared(Path(item['path']), item['persistent'], item['label'])
+
+
+def build_output(item: dict) -> OutputDevice:
+    return LMSensorsOutput(Path(item['path']), item['file'], item['enabler'], item['refresh'])
+
+
+def build_device(name: str, device_config, description: dict) -> Controller:
+    inputs = [build_input(item) for item in description['inputs']] if description['inputs'] is not None else None
+    for input_dev in inputs or ():
+        if isinstance(input_dev, DriveDevice):
+            input_dev.aggregate = Aggregate.from_config(device_config).unweighted()
+    outputs = [build_output(item) for item in description['outputs']] if description['outputs'] is not None else None
+    curve = description['curve']
+    if curve is not None:
+        curve = FanCurve(base64.b64decode(curve['table']), curve['resolution'])
+    return create_device(name, device_config, inputs, outputs, curve)
+
+
+def load_plan(cache_path: Path, key: str) -> Optional[dict]:
+    try:
+        with open(cache_path, 'r') as reader:
+            plan = json.load(reader)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        log.warning('Unreadable device plan: %s', cache_path, exc_info=True)
+        return None
+    if plan.get('version') != PLAN_VERSION or plan.get('key') != key:
+        log.info('Device plan %s is out of date', cache_path)
+        return None
+    return plan
+
+
+def save_plan(cache_path: Path, key: str, devices: Dict[str, Controller]):
+    plan = {'version': PLAN_VERSION, 'key': key, 'devices': {name: describe_device(device) for name, device in devices.items()}}
+    cache_path = Path(cache_path)
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, 'w') as writer:
+            json.dump(plan, writer, separators=(',', ':'))
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        log.warning('Could not save device plan: %s', cache_path, exc_info=True)
+
+
+def create_devices(config: ConfigParser, device_names: Iterable[str], config_path: Path, cache_path: Path,
+                   sysfs_root: Path = None, boot_id_path: Path = BOOT_ID_PATH) -> Dict[str, Controller]:
+    """
+    Builds the devices from the cached plan if it still matches this boot, config and set of hwmon chips,
+    otherwise from config with full discovery, saving a new plan afterwards.
+    """
+    device_names = list(device_names)
+    key = plan_key(config_path, sysfs_root, boot_id_path)
+    plan = load_plan(cache_path, key)
+
+    if plan is not None and set(plan['devices']) == set(device_names) and validate_plan(plan):
+        try:
+            devices = {name: build_device(name, config[name], plan['devices'][name]) for name in device_names}
+            log.info('Devices built from cached plan %s', cache_path)
+            return devices
+        except (OSError, ValueError, KeyError, NoSensorsFoundException):
+            log.warning('Cached device plan is unusable, rebuilding', exc_info=True)
+            registry.clear()
+
+    devices = {name: create_device(name, config[name]) for name in device_names}
+    save_plan(cache_path, key, devices)
+    return devices
@@ -0,0 +1,245 @@
+"""
+Prometheus exporter for temperatures, fan speeds and the health of the control loop,
+served over HTTP, written as a node_exporter textfile, or both.
+
+The exposition is rendered by the control loop once per tick and swapped in as a single immutable snapshot,
+a scrape only sends the last snapshot, so it never reads a sensor nor waits on the loop.
+"""
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .sampler import unwrap_inputs
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value) -> str:
+    if value is None:
+        return 'NaN'
+    if isinstance(value, (bool, int)):
+        return str(int(value))
+    return repr(float(value))
+
+
+def parse_listen(listen: str) -> Tuple[str, int]:
+    """
+    "host:port", "[ipv6]:port" or just "port" for localhost.
+    """
+    host, _, port = listen.rpartition(':')
+    return (host.strip('[]') or '127.0.0.1'), int(port)
+
+
+def _source(device) -> str:
+    for attribute in ('path', 'output_file', 'device_path'):
+        if hasattr(device, attribute):
+            return str(getattr(device, attribute))
+    return repr(device)
+
+
+class Metric:
+    """
+    One metric family, the name and labels of every series are formatted once when bound.
+    """
+    __slots__ = ('name', 'header', 'series')
+
+    def __init__(self, name: str, kind: str, help_text: str):
+        self.name = name
+        self.header = f'# HELP {name} {help_text}\n# TYPE {name} {kind}\n'
+        self.series: List[Tuple[str, Callable[[], object]]] = []
+
+    def add(self, labels: Dict[str, str], getter: Callable[[], object]):
+        formatted = ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+        self.series.append((f'{self.name}{{{formatted}}} ' if formatted else f'{self.name} ', getter))
+
+    def render(self, parts: List[str]):
+        if not self.series:
+            return
+        parts.append(self.header)
+        for prefix, getter in self.series:
+            parts.append(prefix + format_value(getter()) + '\n')
+
+
+class PrometheusExporter:
+    """
+    Exposes every input's smoothed temperature, every output's committed speed, and the period, duration,
+    overruns and read errors of the control loop in the Prometheus text format.
+
+    update() is called by the control loop and renders the whole exposition into snapshot,
+    which the HTTP server hands out as is and which gets written to the textfile at most every textfile_interval seconds.
+    """
+
+    def __init__(self, listen: Optional[Tuple[str, int]] = None, textfile: Optional[Path] = None, textfile_interval: float = 0.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.listen = listen
+        self.textfile = Path(textfile) if textfile is not None else None
+        self.textfile_interval = textfile_interval
+        self.clock = clock
+        self.snapshot = b''
+        self.updates = 0
+        self.address: Optional[Tuple[str, int]] = None
+        self._metrics: List[Metric] = []
+        self._fan_controller = None
+        self._bound_loops = 0
+        self._textfile_written = None
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    def bind(self, fan_controller):
+        """
+        Builds the series for every controller, input, output and loop of fan_controller,
+        call again whenever its devices change.
+        """
+        self._fan_controller = fan_controller
+        sampler = fan_controller.sampler
+        temperature = Metric('pyfc_temperature_celsius', 'gauge', 'Smoothed temperature of an input, as of its last read.')
+        failing = Metric('pyfc_input_failing', 'gauge', 'Whether the last read of an input failed.')
+        read_errors = Metric('pyfc_input_read_errors_total', 'counter', 'Failed reads of an input.')
+        read_timeouts = Metric('pyfc_input_read_timeouts_total', 'counter', 'Reads of an input which timed out in the concurrent sampler.')
+        pwm = Metric('pyfc_output_pwm', 'gauge', 'Speed last committed to an output, 0-255.')
+        writes = Metric('pyfc_output_writes_total', 'counter', 'Speeds written to an output.')
+        writes_skipped = Metric('pyfc_output_writes_skipped_total', 'counter', 'Writes of unchanged speeds skipped for an output.')
+        write_errors = Metric('pyfc_output_write_errors_total', 'counter', 'Failed writes to an output.')
+
+        # a config reload may change the devices from another thread meanwhile.
+        for device_name, device in list(fan_controller.devices.items()):
+            for input_dev in unwrap_inputs(device.inputs):
+                labels = {'controller': device_name, 'input': input_dev.name, 'source': _source(input_dev)}
+                temperature.add(labels, input_dev.smoothed)
+                failing.add(labels, lambda i=input_dev: getattr(i, 'failing', False))
+                read_errors.add(labels, lambda i=input_dev: getattr(i, 'read_errors', 0) + (sampler.errors.get(i, 0) if sampler else 0))
+                if sampler is not None:
+                    read_timeouts.add(labels, lambda i=input_dev: sampler.timeouts.get(i, 0))
+            for output in device.outputs:
+                labels = {'controller': device_name, 'output': output.name, 'source': _source(output)}
+                pwm.add(labels, output.committed_speed)
+                for metric, attribute in ((writes, 'writes'), (writes_skipped, 'writes_skipped'), (write_errors, 'write_errors')):
+                    if hasattr(output, attribute):
+                        metric.add(labels, lambda o=output, a=attribute: getattr(o, a))
+
+        self._metrics = [temperature, failing, read_errors, read_timeouts, pwm, writes, writes_skipped, write_errors]
+        self._metrics.extend(self._loop_metrics(fan_controller.stats))
+        updated = Metric('pyfc_last_update_timestamp_seconds', 'gauge', 'When these metrics were last updated.')
+        updated.add({}, time.time)
+        self._metrics.append(updated)
+        self._bound_loops = len(fan_controller.stats)
+
+    @staticmethod
+    def _loop_metrics(stats: dict) -> List[Metric]:
+        metrics = []
+        for name, kind, attribute, help_text in (
+                ('pyfc_loop_interval_seconds', 'gauge', 'interval', 'Configured interval of a loop.'),
+                ('pyfc_loop_period_seconds', 'gauge', 'last_period', 'Time between the last two ticks of a loop.'),
+                ('pyfc_loop_duration_seconds', 'gauge', 'last_duration', 'How long the last tick of a loop took.'),
+                ('pyfc_loop_jitter_max_seconds', 'gauge', 'jitter_max', 'Latest start of a tick after its deadline.'),
+                ('pyfc_loop_ticks_total', 'counter', 'ticks', 'Ticks of a loop.'),
+                ('pyfc_loop_overruns_total', 'counter', 'overruns', 'Ticks which ran past the deadline of the next one.'),
+                ('pyfc_loop_missed_ticks_total', 'counter', 'missed_ticks', 'Ticks skipped because of overruns.'),
+        ):
+            metric = Metric(name, kind, help_text)
+            for loop_name, tick_stats in list(stats.items()):
+                metric.add({'loop': loop_name}, lambda s=tick_stats, a=attribute: getattr(s, a))
+            metrics.append(metric)
+        return metrics
+
+    def render(self) -> bytes:
+        parts = []
+        for metric in self._metrics:
+            metric.render(parts)
+        return ''.join(parts).encode('utf-8')
+
+    def update(self):
+        """
+        Renders a fresh snapshot, called from the control loop once per tick.
+        """
+        if self._fan_controller is not None and len(self._fan_controller.stats) != self._bound_loops:
+            # the asyncio scheduler only creates the stats of its loops once it runs.
+            self.bind(self._fan_controller)
+        try:
+            self.snapshot = self.render()
+        except Exception:
+            log.exception('Failed rendering metrics, keeping the previous snapshot.')
+            return
+        self.updates += 1
+
+        if self.textfile is not None:
+            now = self.clock()
+            if self._textfile_written is None or now - self._textfile_written >= self.textfile_interval:
+                self._textfile_written = now
+                self.write_textfile()
+
+    def write_textfile(self):
+        # node_exporter may read the file at any time, so it's replaced in one go.
+        tmp_path = self.textfile.with_name(f'.{self.textfile.name}.{os.getpid()}')
+        try:
+            with open(tmp_path, 'wb') as writer:
+                writer.write(self.snapshot)
+            os.replace(tmp_path, self.textfile)
+        except OSError:
+            log.exception('Could not write metrics to %s', self.textfile)
+
+    def serve(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        import socket
+
+        exporter = self
+        family = socket.AF_INET6 if ':' in self.listen[0] else socket.AF_INET
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.partition('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = exporter.snapshot
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug('%s %s', self.address_string(), format % args)
+
+        class MetricsServer(ThreadingHTTPServer):
+            daemon_threads = True
+            address_family = family
+
+        self._server = MetricsServer(self.listen, MetricsHandler)
+        self.address = self._server.server_address[:2]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='pyfc-metrics', daemon=True)
+        self._thread.start()
+        log.info('Serving metrics on http://%s:%s/metrics', *self.address)
+
+    def start(self, fan_controller):
+        self.bind(fan_controller)
+        self.update()
+        if self.listen is not None:
+            try:
+                self.serve()
+            except OSError:
+                log.exception('Could not serve metrics on %s:%s', *self.listen)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            self._thread = None
+        if self.textfile is not None:
+            # the fans are back under firmware control, so the last speeds would just be stale.
+            try:
+                self.textfile.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                log.exception('Could not remove %s', self.textfile)
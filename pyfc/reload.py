@@ -0,0 +1,366 @@
+"""
+Live config reload: on SIGHUP, or when asked with
+
+python -m pyfc.reload --pid-file /var/run/pyFC.pid
+
+the config gets parsed again and diffed section by section against the one running.
+Only what changed gets rebuilt, between two ticks, and inputs and outputs which are still configured are kept as they are,
+with their open files and smoothing history, so no fan goes back to firmware control during a reload.
+"""
+import argparse
+import configparser
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from configparser import ConfigParser, SectionProxy
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from .adaptive import AdaptiveInterval
+from .common import Controller, OutputDevice
+from .curve import FanCurve
+from .deviceloader import create_device, determine_inputs, determine_outputs
+from .drivers import drivers, CONTROLLERS
+from .instrumentation import signal_and_wait
+from .sampler import unwrap_inputs, wrap_inputs
+from .shaping import OutputShaper
+from .temperaturecontroller import TemperatureController
+from .topology import Topology, get_topology, reset_topology
+
+log = logging.getLogger(__name__)
+
+# what a changed key requires, keys are lower case as configparser keeps them.
+CURVE_KEYS = {'temps', 'minimumspeed', 'maximumspeed', 'curveresolution'}
+CONTROLLER_KEYS = {'controllertype', 'targettemperature', 'pidkp', 'pidki', 'pidkd', 'pidderivativesmoothing', 'aggregateweights'}
+SHAPING_KEYS = {'outputdeadband', 'outputhysteresisdown', 'outputslewup', 'outputslewdown'}
+INTERVAL_KEYS = {'interval', 'adaptiveinterval', 'adaptivemaximuminterval', 'adaptiveratethreshold', 'adaptivegrowth', 'adaptivespeedtolerance'}
+INPUT_KEYS = {'inputtype', 'temperaturemonitor', 'temperaturemonitordevicename', 'persistentreads', 'diskids', 'disksensors'}
+INPUT_PREFIXES = ('hddtemp',)
+OUTPUT_KEYS = {'outputtype', 'outputdevicename', 'device', 'outputenabler', 'pwmrefreshinterval'}
+OUTPUT_PREFIXES = ('serial', 'influx')
+# [base] keys a reload can apply, changing any other needs a restart.
+RELOADABLE_BASE_KEYS = {'devices', 'interval'}
+
+
+def read_config(config_path: Path) -> ConfigParser:
+    config = configparser.ConfigParser(converters={'list': lambda x: [i.strip() for i in x.split(',')]})
+    with open(config_path) as reader:
+        config.read_file(reader)
+    return config
+
+
+def device_names(config: ConfigParser) -> List[str]:
+    return [name.strip() for name in config['base']['devices'].split(',') if name.strip()]
+
+
+def key_parts(key: str) -> Set[str]:
+    """
+    Which parts of a device a changed key affects, unknown keys rebuild its inputs and outputs to be on the safe side.
+    """
+    if key in CURVE_KEYS:
+        return {'curve'}
+    if key == 'aggregate':
+        # drives and hddtemp inputs combine their own sensors with it too.
+        return {'controller', 'inputs'}
+    if key in CONTROLLER_KEYS:
+        return {'controller'}
+    if key in SHAPING_KEYS:
+        return {'shaping'}
+    if key in INTERVAL_KEYS:
+        return {'interval'}
+    if key in INPUT_KEYS or key.startswith(INPUT_PREFIXES):
+        return {'inputs'}
+    if key in OUTPUT_KEYS or key.startswith(OUTPUT_PREFIXES):
+        return {'outputs'}
+    return {'inputs', 'outputs'}
+
+
+def snapshot(config: ConfigParser) -> dict:
+    """
+    The resolved values of [base] and of every device section, [DEFAULT] included, to diff against.
+    """
+    return {
+        'base':     dict(config['base']),
+        'devices':  device_names(config),
+        'sections': {name: dict(config[name]) for name in device_names(config) if config.has_section(name)},
+    }
+
+
+class ConfigDiff:
+    """
+    Devices added and removed, the parts of every changed device which need rebuilding, and [base] keys needing a restart.
+    """
+
+    def __init__(self, old: dict, new: dict):
+        self.added = [name for name in new['devices'] if name not in old['sections']]
+        self.removed = [name for name in old['sections'] if name not in new['devices']]
+        self.changed: Dict[str, Set[str]] = {}
+        for name in new['devices']:
+            if name in old['sections'] and name in new['sections']:
+                before, after = old['sections'][name], new['sections'][name]
+                parts = set()
+                for key in before.keys() | after.keys():
+                    if before.get(key) != after.get(key):
+                        parts |= key_parts(key)
+                if parts:
+                    self.changed[name] = parts
+        base_keys = {key for key in old['base'].keys() | new['base'].keys() if old['base'].get(key) != new['base'].get(key)}
+        self.interval = 'interval' in base_keys
+        self.restart = sorted(base_keys - RELOADABLE_BASE_KEYS)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed or self.interval)
+
+    def __repr__(self):
+        return f'added {self.added}, removed {self.removed}, changed {self.changed}, restart needed for {self.restart}'
+
+
+class ReloadError(RuntimeError):
+    pass
+
+
+def output_key(output: OutputDevice) -> tuple:
+    """
+    Identifies the fan behind an output, so an output still configured after a reload is recognised and kept.
+    """
+    return (type(output).__name__, output.name, str(getattr(output, 'real_path', '')),
+            getattr(output, 'device_number', None), getattr(output, 'url', None))
+
+
+def _detach(device: Controller):
+    # controllers disable their outputs once collected, a replaced controller must not take kept outputs along.
+    device.outputs = []
+
+
+class Reloader:
+    """
+    Applies config changes to a running FanController.
+    request() only sets a flag and is safe from signal handlers, the reload itself happens on the next poll(),
+    which the control loop calls between ticks.
+
+    The hwmon and disk topology gets scanned again first.
+    Per changed device section:
+        curve keys only, on a temperature controller: the compiled curve is swapped in place.
+        controller keys: a new controller around the same inputs and outputs.
+        input or output keys: those are looked up again, outputs already driving the same fan are kept.
+        shaping keys: fresh shapers on the device's outputs.
+        interval: the device's tick interval.
+    A section that fails to build keeps running as it was, and is retried on the next reload.
+    Outputs no controller uses anymore are handed back to the firmware.
+    """
+
+    def __init__(self, config_path: Path, config: ConfigParser, status_file: Optional[Path] = None):
+        self.config_path = Path(config_path)
+        self.status_file = Path(status_file) if status_file is not None else None
+        self.applied = snapshot(config)
+        self.requested = False
+        self.reloads = 0
+        self.last_result: Optional[dict] = None
+
+    def request(self):
+        self.requested = True
+
+    def request_on_signal(self, signum: int = signal.SIGHUP):
+        signal.signal(signum, lambda received, frame: self.request())
+
+    def poll(self, fan_controller) -> bool:
+        """
+        Reloads if one was requested.
+        :return: True if the set of devices or any device changed.
+        """
+        if not self.requested:
+            return False
+        self.requested = False
+        return self.reload(fan_controller)
+
+    def reload(self, fan_controller) -> bool:
+        started = time.monotonic()
+        result = {'time': time.time(), 'added': [], 'removed': [], 'changed': {}, 'errors': {}, 'restart': []}
+        try:
+            config = read_config(self.config_path)
+            new = snapshot(config)
+        except (OSError, configparser.Error, KeyError) as e:
+            log.error('Not reloading, could not read %s: %s', self.config_path, e)
+            result['errors']['config'] = str(e)
+            self._finish(result, started)
+            return False
+
+        # chips and disks may have come and gone since the last scan, sections added or changed need to find them.
+        topology = get_topology()
+        reset_topology(Topology(topology.sysfs_root, topology.dev_root))
+
+        diff = ConfigDiff(self.applied, new)
+        log.info('Reloading %s: %r', self.config_path, diff)
+        result['restart'] = diff.restart
+        if diff.restart:
+            log.warning('Changes to [base] %s only apply after a restart', ', '.join(diff.restart))
+
+        pool = {output_key(output): output for device in fan_controller.devices.values() for output in device.outputs}
+        applied_sections = dict(self.applied['sections'])
+
+        for name in diff.removed:
+            device = fan_controller.devices.pop(name, None)
+            if device is not None:
+                _detach(device)
+            fan_controller.intervals.pop(name, None)
+            fan_controller.adaptive.pop(name, None)
+            applied_sections.pop(name, None)
+            result['removed'].append(name)
+
+        for name in diff.added + list(diff.changed):
+            try:
+                if name in diff.added:
+                    self._add_device(fan_controller, name, config[name], pool)
+                    result['added'].append(name)
+                else:
+                    result['changed'][name] = self._change_device(fan_controller, name, config[name], diff.changed[name], pool)
+                applied_sections[name] = new['sections'][name]
+            except (RuntimeError, KeyError, ValueError, ImportError, OSError) as e:
+                log.error('Keeping device %s as it was, reloading it failed: %s', name, e)
+                result['errors'][name] = str(e)
+
+        if diff.interval:
+            fan_controller.interval = config['base'].getfloat('interval', fan_controller.interval)
+        for name in fan_controller.devices:
+            if name in diff.added or name in diff.changed or diff.interval:
+                self._set_interval(fan_controller, name, config[name])
+
+        # whatever no controller drives anymore goes back to the firmware.
+        kept = {id(output) for device in fan_controller.devices.values() for output in device.outputs}
+        for output in pool.values():
+            if id(output) not in kept:
+                log.info('Output %s is not configured anymore, disabling it', output.name)
+                output.disable()
+
+        # a failed section stays as it was applied, so the next reload tries it again.
+        self.applied = {'base': new['base'], 'devices': new['devices'], 'sections': applied_sections}
+        self._finish(result, started)
+        return bool(diff)
+
+    def _finish(self, result: dict, started: float):
+        result['duration'] = time.monotonic() - started
+        self.reloads += 1
+        self.last_result = result
+        log.info('Reload took %.1fms, added %s, removed %s, changed %s, errors %s',
+                 result['duration'] * 1000, result['added'], result['removed'], result['changed'], result['errors'])
+        if self.status_file is not None:
+            tmp_path = self.status_file.with_name(self.status_file.name + '.tmp')
+            try:
+                self.status_file.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path.write_text(json.dumps(result))
+                os.replace(tmp_path, self.status_file)
+            except OSError:
+                log.exception('Could not write reload status to %s', self.status_file)
+
+    @staticmethod
+    def _set_interval(fan_controller, name: str, section: SectionProxy):
+        interval = section.getfloat('interval', fan_controller.interval)
+        fan_controller.intervals[name] = interval
+        if name in fan_controller.stats:
+            fan_controller.stats[name].interval = interval
+        adaptive = AdaptiveInterval.from_config(section)
+        if adaptive is not None:
+            fan_controller.adaptive[name] = adaptive
+        else:
+            fan_controller.adaptive.pop(name, None)
+
+    @staticmethod
+    def _take_over(outputs: List[OutputDevice], pool: Dict[tuple, OutputDevice], shaper_section: Optional[SectionProxy]) -> List[OutputDevice]:
+        """
+        Swaps freshly found outputs for the running ones driving the same fan, fresh ones get a shaper from the section.
+        """
+        taken = []
+        for output in outputs:
+            running = pool.get(output_key(output))
+            if running is None:
+                if shaper_section is not None:
+                    output.shaper = OutputShaper.from_config(shaper_section)
+                taken.append(output)
+            else:
+                taken.append(running)
+        return taken
+
+    @staticmethod
+    def _enable_new(outputs: List[OutputDevice]):
+        # enabling an output again would take manual mode as the mode to restore on exit.
+        for output in outputs:
+            if not getattr(output, 'enabled', False):
+                output.enable()
+
+    def _add_device(self, fan_controller, name: str, section: SectionProxy, pool: Dict[tuple, OutputDevice]):
+        device = create_device(name, section)
+        device.outputs = self._take_over(device.outputs, pool, None)
+        device.inputs = wrap_inputs(device.inputs, fan_controller.sampler)
+        if not device.valid():
+            _detach(device)
+            raise ReloadError(f'device {name} is not valid')
+        self._enable_new(device.outputs)
+        fan_controller.devices[name] = device
+
+    def _change_device(self, fan_controller, name: str, section: SectionProxy, parts: Set[str], pool: Dict[tuple, OutputDevice]) -> List[str]:
+        device = fan_controller.devices[name]
+        inputs = unwrap_inputs(device.inputs)
+        outputs = list(device.outputs)
+
+        if 'inputs' in parts:
+            inputs = list(determine_inputs(section))
+            if not inputs:
+                raise ReloadError(f'no inputs found for {name}')
+        if 'outputs' in parts:
+            outputs = self._take_over(list(determine_outputs(section)), pool, section)
+            if not outputs:
+                raise ReloadError(f'no outputs found for {name}')
+
+        rebuild = bool(parts & {'inputs', 'outputs', 'controller'}) or ('curve' in parts and not isinstance(device, TemperatureController))
+        if rebuild:
+            replacement = drivers.get(CONTROLLERS, section.get('controllerType', 'temperature'))(section, inputs, outputs, None)
+            replacement.inputs = wrap_inputs(replacement.inputs, fan_controller.sampler)
+            if not replacement.valid():
+                _detach(replacement)
+                raise ReloadError(f'device {name} is not valid')
+        elif 'curve' in parts:
+            curve = FanCurve.from_config(section)
+
+        # everything is built, from here on nothing raises and the swap happens in one go.
+        if 'shaping' in parts:
+            for output in outputs:
+                output.shaper = OutputShaper.from_config(section)
+        if rebuild:
+            self._enable_new(replacement.outputs)
+            _detach(device)
+            fan_controller.devices[name] = replacement
+        elif 'curve' in parts:
+            device.speeds = curve
+        return sorted(parts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reload the config of a running pyfc.')
+    parser.add_argument('--pid-file', default='/var/run/pyFC.pid')
+    parser.add_argument('--status-file', default='/run/pyfc/reload.json')
+    parser.add_argument('--timeout', type=float, default=10.0, help='seconds to wait for the reload, it happens between ticks')
+    args = parser.parse_args(argv)
+
+    pid = int(Path(args.pid_file).read_text().strip())
+    status_file = Path(args.status_file)
+    if not signal_and_wait(pid, signal.SIGHUP, status_file, args.timeout):
+        print(f'{status_file} did not change, pid {pid} got SIGHUP but did not report a reload', file=sys.stderr)
+        return 1
+
+    result = json.loads(status_file.read_text())
+    print(f'reloaded in {result["duration"] * 1000:.1f}ms')
+    for key in ('added', 'removed', 'restart'):
+        if result[key]:
+            print(f'{key}: {", ".join(result[key])}')
+    for name, parts in result['changed'].items():
+        print(f'changed: {name} ({", ".join(parts)})')
+    for name, error in result['errors'].items():
+        print(f'error: {name}: {error}', file=sys.stderr)
+    return 1 if result['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
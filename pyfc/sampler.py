@@ -0,0 +1,106 @@
+"""
+Concurrent sampling of input devices with a per-read deadline.
+"""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional
+
+from .common import InputDevice
+
+log = logging.getLogger(__name__)
+
+
+class ConcurrentSampler:
+    """
+    Reads a set of inputs in parallel on a bounded thread pool.
+    A read that misses the deadline is left running in the background and the input keeps its last good value,
+    so a tick costs at most the timeout instead of the sum of all reads.
+    An input with a read still in flight is not read again until that read finishes.
+    """
+
+    def __init__(self, max_workers: int = 4, timeout: float = 0.5, default_value: float = 35.0):
+        self.timeout = timeout
+        self.default_value = default_value
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='pyfc-sampler')
+        self.timeouts: Dict[InputDevice, int] = {}
+        self.errors: Dict[InputDevice, int] = {}
+        self._pending: Dict[InputDevice, Future] = {}
+        self._last_good: Dict[InputDevice, float] = {}
+        # the asyncio scheduler samples from several threads at once.
+        self._lock = threading.Lock()
+
+    def _collect(self, input_dev: InputDevice, future: Future):
+        if self._pending.get(input_dev) is not future:
+            return
+        del self._pending[input_dev]
+        try:
+            self._last_good[input_dev] = future.result()
+        except Exception:
+            self.errors[input_dev] = self.errors.get(input_dev, 0) + 1
+            log.exception('Failed reading input: %s', input_dev.name)
+
+    def sample(self, inputs: Iterable[InputDevice]):
+        futures: Dict[InputDevice, Future] = {}
+        with self._lock:
+            for input_dev in inputs:
+                if input_dev in futures:
+                    continue
+                future = self._pending.get(input_dev)
+                if future is not None and future.done():
+                    # a read which timed out earlier finally finished, take its value and start a fresh one.
+                    self._collect(input_dev, future)
+                    future = None
+                if future is None:
+                    future = self.executor.submit(input_dev.get_value)
+                    self._pending[input_dev] = future
+                futures[input_dev] = future
+
+        wait(futures.values(), self.timeout)
+
+        with self._lock:
+            for input_dev, future in futures.items():
+                if future.done():
+                    self._collect(input_dev, future)
+                else:
+                    self.timeouts[input_dev] = self.timeouts.get(input_dev, 0) + 1
+                    log.debug('Read of input %s timed out, using last good value.', input_dev.name)
+
+    def value(self, input_dev: InputDevice) -> float:
+        return self._last_good.get(input_dev, self.default_value)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class SampledInput(InputDevice):
+    """
+    Stands in for an input inside a controller, returning whatever the sampler last read from it.
+    """
+
+    def __init__(self, source: InputDevice, sampler: ConcurrentSampler):
+        super().__init__(source.name)
+        self.source = source
+        self.sampler = sampler
+
+    def get_value(self) -> float:
+        return self.sampler.value(self.source)
+
+    def smoothed(self) -> Optional[float]:
+        return self.source.smoothed()
+
+    def last_reading(self) -> Optional[float]:
+        return self.source.last_reading()
+
+    def __repr__(self):
+        return repr(self.source)
+
+
+def unwrap_inputs(inputs: Iterable[InputDevice]) -> List[InputDevice]:
+    return [i.source if isinstance(i, SampledInput) else i for i in inputs]
+
+
+def wrap_inputs(inputs: Iterable[InputDevice], sampler: Optional[ConcurrentSampler]) -> List[InputDevice]:
+    if sampler is None:
+        return list(inputs)
+    return [SampledInput(i, sampler) for i in unwrap_inputs(inputs)]
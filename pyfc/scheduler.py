@@ -0,0 +1,154 @@
+"""
+asyncio scheduling of controllers, each at its own tick rate.
+"""
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+
+class TickStats:
+    """
+    Jitter and overrun bookkeeping for one periodically scheduled controller.
+    Jitter is how late a tick started compared to its deadline,
+    an overrun is a tick that ran past the deadline of the next one.
+    """
+
+    def __init__(self, name: str, interval: float):
+        self.name = name
+        self.interval = interval
+        self.ticks = 0
+        self.overruns = 0
+        self.missed_ticks = 0
+        self.jitter_max = 0.0
+        self.jitter_total = 0.0
+        self.last_duration = 0.0
+        self.last_period = 0.0
+        self._last_started: Optional[float] = None
+
+    def record_tick(self, jitter: float, duration: float, started: Optional[float] = None):
+        """
+        :param started: monotonic start time of the tick, to keep track of the period actually achieved.
+        """
+        self.ticks += 1
+        if started is not None:
+            if self._last_started is not None:
+                self.last_period = started - self._last_started
+            self._last_started = started
+        self.jitter_total += jitter
+        if jitter > self.jitter_max:
+            self.jitter_max = jitter
+        self.last_duration = duration
+
+    def record_overrun(self, missed: int):
+        self.overruns += 1
+        self.missed_ticks += missed
+
+    @property
+    def last_started(self) -> Optional[float]:
+        """
+        Monotonic start time of the last tick, if recorded.
+        """
+        return self._last_started
+
+    @property
+    def jitter_mean(self) -> float:
+        return self.jitter_total / self.ticks if self.ticks else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'interval':      self.interval,
+            'ticks':         self.ticks,
+            'overruns':      self.overruns,
+            'missed_ticks':  self.missed_ticks,
+            'jitter_mean':   self.jitter_mean,
+            'jitter_max':    self.jitter_max,
+            'last_duration': self.last_duration,
+            'last_period':   self.last_period,
+        }
+
+    def __repr__(self):
+        return (f'{self.name}: interval {self.interval}s, ticks {self.ticks}, overruns {self.overruns} '
+                f'(missed {self.missed_ticks}), jitter mean {self.jitter_mean * 1000:.2f}ms max {self.jitter_max * 1000:.2f}ms')
+
+
+class TickGate:
+    """
+    Lets any number of ticks run at once, or a single exclusive job, e.g. a config reload, while no tick runs.
+    Ticks and jobs run in worker threads, a tick arriving during a job waits for it to finish.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._running = 0
+        self._exclusive = False
+
+    @contextmanager
+    def tick(self):
+        with self._condition:
+            while self._exclusive:
+                self._condition.wait()
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running -= 1
+                if not self._running:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            while self._exclusive:
+                self._condition.wait()
+            # set right away, so ticks queue up behind the job instead of starving it.
+            self._exclusive = True
+            while self._running:
+                self._condition.wait()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+    def gated(self, tick: Callable[[], None]) -> Callable[[], None]:
+        def run():
+            with self.tick():
+                tick()
+        return run
+
+
+async def run_periodic(tick: Callable[[], None], stats: TickStats, stop: asyncio.Event, interval: Optional[Callable[[], float]] = None):
+    """
+    Runs tick in a worker thread every stats.interval seconds until stop is set.
+    Deadlines are absolute on the loop's monotonic clock, so the period does not drift by however long a tick took.
+    A tick that runs past following deadlines skips them instead of firing a burst to catch up.
+
+    :param interval: optional callable returning the interval to use for the next deadline,
+     otherwise stats.interval is used throughout.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.to_thread(tick)
+        finished = loop.time()
+        stats.record_tick(max(0.0, started - deadline), finished - started, started)
+
+        period = interval() if interval else stats.interval
+        deadline += period
+        if finished > deadline:
+            missed = int((finished - deadline) // period) + 1
+            stats.record_overrun(missed)
+            log.debug('controller %s overran its interval by %.3fs', stats.name, finished - deadline)
+            deadline += missed * period
+
+        try:
+            await asyncio.wait_for(stop.wait(), deadline - loop.time())
+        except asyncio.TimeoutError:
+            pass
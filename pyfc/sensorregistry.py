@@ -0,0 +1,58 @@
+"""
+Process wide registry of physical sensors.
+"""
+import threading
+from typing import Callable, Dict, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class SensorRegistry:
+    """
+    Hands out one shared input per physical sensor, keyed by e.g. the resolved sysfs path,
+    so every controller referencing the same sensor also shares its smoothing buffer.
+    Also keeps the tick epoch, inputs compare it against the epoch of their last read
+    to read the hardware at most once per tick.
+    """
+
+    def __init__(self):
+        self._sensors: Dict[Hashable, object] = {}
+        self._lock = threading.Lock()
+        self.epoch = 0
+
+    def get(self, key: Hashable, factory: Callable[[], T]) -> T:
+        with self._lock:
+            if key not in self._sensors:
+                self._sensors[key] = factory()
+            return self._sensors[key]
+
+    def rekey(self, old_key: Hashable, new_key: Hashable, sensor: object):
+        """
+        Moves a sensor which now reads another file, e.g. after a rebind, so asking for its new path finds it.
+        A sensor already registered under the new key keeps it.
+        """
+        with self._lock:
+            if self._sensors.get(old_key) is sensor:
+                del self._sensors[old_key]
+            self._sensors.setdefault(new_key, sensor)
+
+    def begin_tick(self):
+        self.epoch += 1
+
+    def is_current(self, read_epoch: int) -> bool:
+        """
+        True if something was already read during the current tick.
+        Epoch 0 means nobody is ticking, e.g. a standalone script, so reads are never cached then.
+        """
+        return self.epoch != 0 and read_epoch == self.epoch
+
+    def __len__(self):
+        return len(self._sensors)
+
+    def clear(self):
+        with self._lock:
+            self._sensors.clear()
+        self.epoch = 0
+
+
+registry = SensorRegistry()
@@ -1,82 +1,249 @@
 import logging
+import threading
+from configparser import SectionProxy
+from functools import reduce
+from typing import Dict, Iterable, Optional, Set
+
 from serial import Serial, SerialException
 from serial.tools import list_ports
 
-from .common import OutputDevice, mean
+from .common import OutputDevice
 
 log = logging.getLogger(__name__)
 
 
-class SerialOutput(OutputDevice):
+def checksum(payload: bytes) -> int:
+    return reduce(lambda a, b: a ^ b, payload, 0)
+
+
+def frame(speeds: Dict[str, int]) -> bytes:
     """
-    Class for communicating with my Atmega 8-16 based PWM fan controller,
-    Serial, 9600 baud.
+    Frames all channel speeds as <channel:speed,channel:speed*CS\\n where CS is the hex XOR of the bytes between < and *.
     """
+    payload = ','.join(f'{channel}:{speed}' for channel, speed in sorted(speeds.items())).encode('ascii')
+    return b'<%s*%02X\n' % (payload, checksum(payload))
 
-    def __init__(self, device_number: str, serial_baud: int = 9600):
-        super().__init__(f'serial-{device_number}')
+
+def find_serial_port() -> Optional[str]:
+    """
+    First ttyUSB device present, for configs which don't name a port.
+    """
+    try:
+        return next(list_ports.grep('ttyUSB[0-9]'))[0]
+    except StopIteration:
+        return None
+
+
+class SerialLink:
+    """
+    One open serial port shared by all channels of a fan controller board.
+    Submitted speeds are sent in a single write once every registered channel has submitted its speed,
+    at the end of the tick, or when a channel submits again before its last speed was sent,
+    so channels ticking at different intervals don't wait for each other.
+    Nothing is sent at all if no channel changed since the last write the board took.
+
+    Protocols:
+        legacy: "<channel>/<speed>/" per changed channel, unacknowledged.
+        framed: one frame per tick, see frame(), which the board acknowledges with "ACK <CS>\\n".
+                A frame without the right acknowledgement is sent again, up to retries times.
+    """
+    _links: Dict[str, 'SerialLink'] = {}
+    _links_lock = threading.Lock()
+
+    @classmethod
+    def for_port(cls, port: str, **kwargs) -> 'SerialLink':
+        with cls._links_lock:
+            if port not in cls._links:
+                cls._links[port] = cls(port, **kwargs)
+            return cls._links[port]
+
+    def __init__(self, port: str, baudrate: int = 9600, protocol: str = 'legacy', ack_timeout: float = 0.2, retries: int = 1):
+        if protocol not in ('legacy', 'framed'):
+            raise ValueError(f'Unknown serial protocol: "{protocol}"')
         self.serial = Serial()
-        self.serial.baudrate = serial_baud
-        self.serial_available = False
-        self.device_number = device_number
+        self.serial.port = port
+        self.serial.baudrate = baudrate
+        self.serial.timeout = ack_timeout
+        self.protocol = protocol
+        self.retries = retries
 
-        try:
-            """
-            Check ttyUSB devices 0 through 9, and get the first one present.
-            TODO: stuff this into the config file. Its a stupid way.
-            """
-            self.serial.port = next(list_ports.grep('ttyUSB[0-9]'))[0]
-        except SerialException:
-            self.serial_available = False
+        self.channels: Set[str] = set()
+        self.pending: Dict[str, int] = {}
+        self.committed: Dict[str, int] = {}
+        self._submitted: Set[str] = set()
+        self._lock = threading.Lock()
 
-    def apply(self):
+        self.frames = 0
+        self.acks = 0
+        self.naks = 0
+        self.skipped = 0
+
+    @property
+    def port(self) -> str:
+        return self.serial.port
+
+    @property
+    def available(self) -> bool:
+        return self.serial.is_open
+
+    def register(self, channel: str) -> bool:
         """
-        Open serial interface, convert to byte, write data, close serial interface.
-        Pray to satan nothing blows up.
-        :param speed: speed to set
-        :type speed: int
+        :return: False if the port could not be opened, the channel isn't registered then.
         """
-        speed = round(self.values.mean())
-        if self.serial_available:
-            try:
+        with self._lock:
+            if not self.serial.is_open:
+                self._open()
+            if not self.serial.is_open:
+                return False
+            self.channels.add(channel)
+            return True
+
+    def unregister(self, channel: str):
+        with self._lock:
+            if channel not in self.channels:
+                return
+            self.channels.discard(channel)
+            self.pending.pop(channel, None)
+            self.committed.pop(channel, None)
+            self._submitted.discard(channel)
+            if not self.channels:
+                self._close()
+
+    def _open(self):
+        try:
+            if not self.serial.is_open:
                 self.serial.open()
-                self.serial.write(bytes(''.join([str(self.device_number), '/', str(speed), '/']), 'utf-8'))
-                self.serial.close()
-                log.debug(
-                        'Speed for device: {}/{} set to {}',
-                        self.serial.port,
-                        self.device_number,
-                        str(speed)
-                )
-            except SerialException:
-                self.serial_available = False
-        else:
-            log.debug('Written speed would be: {}', speed)
+                log.debug('Opened serial port: %s', self.port)
+        except SerialException:
+            log.exception('Failed opening serial port: %s', self.port)
 
-    def enable(self):
-        """
-        attempt to open a serial interface.
-        """
+    def _close(self):
         try:
-            self.serial.open()
-            self.serial_available = True
             self.serial.close()
-            log.debug('Enabled serial communication on port: {}', self.serial.port)
+            log.debug('Closed serial port: %s', self.port)
         except SerialException:
-            self.serial_available = False
-            log.exception('Failed enabling serial port: {}', self.serial.port)
+            log.exception('Failed closing serial port: %s', self.port)
 
-    def disable(self):
+    def submit(self, channel: str, speed: int):
+        with self._lock:
+            resubmitted = channel in self._submitted
+            self.pending[channel] = speed
+            self._submitted.add(channel)
+            if resubmitted or self._submitted >= self.channels:
+                self._flush()
+
+    def flush(self):
         """
-        Attempt to close the serial interface
+        Sends the speeds submitted since the last write, if any.
         """
+        with self._lock:
+            if self._submitted:
+                self._flush()
+
+    def _flush(self):
+        self._submitted.clear()
+        if self.pending == self.committed:
+            self.skipped += 1
+            return
+        if not self.serial.is_open:
+            self._open()
+            if not self.serial.is_open:
+                return
+
         try:
-            self.serial.close()
-            self.serial_available = False
-            log.debug('Disabled serial port: {}', self.serial.port)
+            if self.protocol == 'framed':
+                sent = self._send_frame()
+            else:
+                sent = self._send_legacy()
         except SerialException:
-            self.serial_available = False
-            log.exception('Failed disabling serial port: {}', self.serial.port)
+            log.exception('Failed writing to serial port: %s', self.port)
+            self._close()
+            sent = False
+
+        if sent:
+            self.committed = dict(self.pending)
+
+    def _send_legacy(self) -> bool:
+        changed = {c: s for c, s in self.pending.items() if self.committed.get(c) != s}
+        self.serial.write(''.join(f'{channel}/{speed}/' for channel, speed in sorted(changed.items())).encode('ascii'))
+        self.frames += 1
+        log.debug('Speeds for %s set to %s', self.port, changed)
+        return True
+
+    def _send_frame(self) -> bool:
+        data = frame(self.pending)
+        expected = b'ACK %s' % data[-3:-1]
+        for attempt in range(self.retries + 1):
+            self.serial.reset_input_buffer()
+            self.serial.write(data)
+            self.frames += 1
+            reply = self.serial.readline().strip()
+            if reply == expected:
+                self.acks += 1
+                log.debug('Speeds for %s set to %s', self.port, self.pending)
+                return True
+            self.naks += 1
+            log.debug('Frame %r to %s not acknowledged, got %r, attempt %d', data, self.port, reply, attempt + 1)
+        log.warning('Serial board on %s did not acknowledge speeds %s', self.port, self.pending)
+        return False
+
+
+class SerialOutput(OutputDevice):
+    """
+    Class for communicating with my Atmega 8-16 based PWM fan controller,
+    Serial, 9600 baud.
+    One output per fan channel, the channels of one board share a SerialLink.
+    """
+
+    def __init__(self, device_number: str, serial_baud: int = 9600, port: Optional[str] = None, protocol: str = 'legacy', ack_timeout: float = 0.2):
+        super().__init__(f'serial-{device_number}')
+        self.device_number = str(device_number)
+        self.enabled = False
+
+        port = port or find_serial_port()
+        self.link = SerialLink.for_port(port, baudrate=serial_baud, protocol=protocol, ack_timeout=ack_timeout) if port else None
+        if self.link is None:
+            log.warning('No serial port found for %s', self.name)
+
+    @property
+    def serial_available(self) -> bool:
+        return self.link is not None and self.link.available
+
+    def apply(self):
+        """
+        Hand the speed to the link, which writes once all channels of the board have theirs, or at the end of the tick.
+        """
+        speed = self.target_speed()
+        if self.enabled and self.link is not None:
+            self.link.submit(self.device_number, speed)
+        else:
+            log.debug('Written speed would be: %s', speed)
+
+    def flush(self):
+        if self.enabled and self.link is not None:
+            self.link.flush()
+
+    def committed_speed(self) -> Optional[int]:
+        return self.link.committed.get(self.device_number) if self.link is not None else None
+
+    def enable(self):
+        if self.link is not None and not self.enabled:
+            self.enabled = self.link.register(self.device_number)
+
+    def disable(self):
+        if self.link is not None:
+            self.link.unregister(self.device_number)
+        self.enabled = False
 
     def __del__(self):
         self.disable()
+
+
+def generate_serial_output(device_config: SectionProxy) -> Iterable[SerialOutput]:
+    yield SerialOutput(
+            device_config.getint('device'),
+            device_config.getint('serialBaud', 9600),
+            device_config.get('serialPort', None),
+            device_config.get('serialProtocol', 'legacy'),
+            device_config.getfloat('serialAckTimeout', 0.2),
+    )
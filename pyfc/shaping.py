@@ -0,0 +1,75 @@
+"""
+Shaping of fan speeds between what a controller asks for and what gets written to the hardware.
+"""
+import time
+from configparser import SectionProxy
+from typing import Callable, Optional
+
+
+class OutputShaper:
+    """
+    Applied to the requested PWM value (0-255) of an output on every apply:
+        deadband: changes of less than this many PWM steps are ignored.
+        hysteresis_down: extra steps a decrease has to exceed on top of the deadband,
+            so fans speed up on the first sign of heat but only slow down once it's clearly gone.
+        slew_up / slew_down: most PWM steps per second the speed may rise or fall, None for no limit.
+    writes_avoided counts the applies which kept the previous value although the request differed from it.
+    """
+
+    def __init__(self, deadband: float = 0, hysteresis_down: float = 0, slew_up: Optional[float] = None, slew_down: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.deadband = deadband
+        self.hysteresis_down = hysteresis_down
+        self.slew_up = slew_up
+        self.slew_down = slew_down
+        self.clock = clock
+        self.writes_avoided = 0
+        self._position: Optional[float] = None
+        self._last_time = 0.0
+
+    @classmethod
+    def from_config(cls, device_config: SectionProxy) -> Optional['OutputShaper']:
+        """
+        :return: a shaper if the section configures any shaping, None otherwise.
+        """
+        options = {
+            'deadband':        device_config.getfloat('outputDeadband', 0),
+            'hysteresis_down': device_config.getfloat('outputHysteresisDown', 0),
+            'slew_up':         device_config.getfloat('outputSlewUp', None),
+            'slew_down':       device_config.getfloat('outputSlewDown', None),
+        }
+        if not any(options.values()):
+            return None
+        return cls(**options)
+
+    def shape(self, requested: int) -> int:
+        now = self.clock()
+        if self._position is None:
+            self._position = float(requested)
+            self._last_time = now
+            return requested
+
+        current = round(self._position)
+        delta = requested - self._position
+        threshold = self.deadband if delta >= 0 else self.deadband + self.hysteresis_down
+        if abs(delta) < threshold or abs(requested - current) < 1:
+            if requested != current:
+                self.writes_avoided += 1
+            self._last_time = now
+            return current
+
+        dt = now - self._last_time
+        self._last_time = now
+        if delta > 0 and self.slew_up is not None:
+            delta = min(delta, self.slew_up * dt)
+        elif delta < 0 and self.slew_down is not None:
+            delta = max(delta, -self.slew_down * dt)
+        self._position += delta
+
+        shaped = round(self._position)
+        if shaped == current and requested != current:
+            self.writes_avoided += 1
+        return shaped
+
+    def reset(self):
+        self._position = None
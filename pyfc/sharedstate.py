@@ -0,0 +1,370 @@
+"""
+Publishing the latest state of the control loop into a memory mapped file, for local dashboards and health checks,
+so they never read a sensor themselves.
+
+The file has a fixed layout: a header, a JSON description of the slots and one double per slot.
+A slot is the smoothed temperature of an input, the speed committed to an output, or a figure of one loop.
+Updates are guarded by a seqlock: the writer makes the sequence odd, stores every slot and makes it even again,
+a reader copies the slots and retries if the sequence was odd or changed meanwhile,
+so a read is a few loads from the mapping and no syscall at all.
+
+When the devices change the file is replaced by one with the new layout and the old one is marked as replaced,
+readers then map the new one on their next read.
+
+python -m pyfc.sharedstate --path /run/pyfc/state
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .prometheus import _source
+from .sampler import unwrap_inputs
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PATH = Path('/run/pyfc/state')
+MAGIC = b'PYFCSTA\0'
+VERSION = 1
+# magic, version, flags, slots and length of the JSON description, followed by the 8 byte words below.
+HEADER = struct.Struct('<8sHHII')
+# offsets of the 8 byte words of the header, in words.
+SEQUENCE = 3
+STATE = 4
+UPDATED = 5
+MONOTONIC = 6
+PID = 7
+HEADER_SIZE = 64
+
+LIVE = 0
+REPLACED = 1
+STOPPED = 2
+
+BIG_ENDIAN = 1
+NATIVE_FLAGS = BIG_ENDIAN if sys.byteorder == 'big' else 0
+NAN = float('nan')
+LOOP_FIELDS = (('started', 'last_started'), ('period', 'last_period'), ('duration', 'last_duration'),
+               ('ticks', 'ticks'), ('overruns', 'overruns'))
+
+
+def values_offset(description_length: int) -> int:
+    return -(-(HEADER_SIZE + description_length) // 8) * 8
+
+
+class Snapshot:
+    """
+    A consistent copy of the shared state.
+    """
+    __slots__ = ('slots', 'values', 'sequence', 'updated', 'monotonic', 'pid', 'live')
+
+    def __init__(self, slots: List[dict], values: List[float], sequence: int, updated: float, monotonic: float, pid: int, live: bool):
+        self.slots = slots
+        self.values = values
+        self.sequence = sequence
+        self.updated = updated
+        self.monotonic = monotonic
+        self.pid = pid
+        self.live = live
+
+    def _of_kind(self, kind: str) -> List[dict]:
+        return [dict(slot, value=None if value != value else value)
+                for slot, value in zip(self.slots, self.values) if slot['kind'] == kind]
+
+    def temperatures(self) -> List[dict]:
+        return self._of_kind('temperature')
+
+    def speeds(self) -> List[dict]:
+        return self._of_kind('pwm')
+
+    def loops(self) -> Dict[str, dict]:
+        loops = {}
+        for slot, value in zip(self.slots, self.values):
+            if slot['kind'] == 'loop':
+                loops.setdefault(slot['loop'], {})[slot['field']] = value
+        return loops
+
+    def age(self) -> float:
+        """
+        Seconds since the last update, on the monotonic clock the writer uses as well.
+        """
+        return time.monotonic() - self.monotonic
+
+    def as_dict(self) -> dict:
+        return {
+            'pid': self.pid,
+            'live': self.live,
+            'sequence': self.sequence,
+            'updated': self.updated,
+            'temperatures': self.temperatures(),
+            'speeds': self.speeds(),
+            'loops': self.loops(),
+        }
+
+
+class _Mapping:
+    """
+    The header words, values and slot description of one mapped state file.
+    """
+
+    def __init__(self, mapped: mmap.mmap, slots: int, description_length: int):
+        self.mmap = mapped
+        view = memoryview(mapped)
+        self.words = view[:HEADER_SIZE].cast('Q')
+        self.header = view[:HEADER_SIZE].cast('d')
+        offset = values_offset(description_length)
+        self.values = view[offset:offset + 8 * slots].cast('d')
+        view.release()
+
+    def close(self):
+        self.words.release()
+        self.header.release()
+        self.values.release()
+        self.mmap.close()
+
+
+class SharedStatePublisher:
+    """
+    Publishes every input's smoothed temperature, every output's committed speed and the figures of every loop to path,
+    called from the control loop once per tick, nothing in it reads or writes a device.
+    """
+
+    def __init__(self, path: Path = DEFAULT_PATH, clock: Callable[[], float] = time.monotonic):
+        self.path = Path(path)
+        self.clock = clock
+        self.updates = 0
+        self._mapping: Optional[_Mapping] = None
+        self._description: Optional[dict] = None
+        self._getters: List[Callable[[], Optional[float]]] = []
+        self._fan_controller = None
+        self._bound_loops = 0
+
+    def bind(self, fan_controller):
+        """
+        Takes the slots from the controllers and loops of fan_controller, call again whenever its devices change.
+        Inputs and outputs shared by controllers get one slot, listing all of them.
+        """
+        self._fan_controller = fan_controller
+        slots = []
+        getters = []
+        seen = {}
+        for device_name, device in list(fan_controller.devices.items()):
+            for kind, devices, getter in (('temperature', unwrap_inputs(device.inputs), 'smoothed'),
+                                          ('pwm', device.outputs, 'committed_speed')):
+                for dev in devices:
+                    if id(dev) not in seen:
+                        seen[id(dev)] = len(slots)
+                        slots.append({'kind': kind, 'name': dev.name, 'source': _source(dev), 'controllers': []})
+                        getters.append(getattr(dev, getter))
+                    slots[seen[id(dev)]]['controllers'].append(device_name)
+        for loop_name, stats in list(fan_controller.stats.items()):
+            for field, attribute in LOOP_FIELDS:
+                slots.append({'kind': 'loop', 'loop': loop_name, 'field': field})
+                getters.append(lambda s=stats, a=attribute: getattr(s, a))
+        self._bound_loops = len(fan_controller.stats)
+
+        description = {'slots': slots}
+        self._getters = getters
+        if description != self._description or self._mapping is None:
+            self._description = description
+            self._create()
+
+    def _create(self):
+        """
+        Writes a file with the new layout next to path and moves it over path, then tells readers of the old one to remap.
+        """
+        encoded = json.dumps(self._description).encode('utf-8')
+        slots = len(self._getters)
+        size = values_offset(len(encoded)) + 8 * slots
+        tmp_path = self.path.with_name(f'.{self.path.name}.{os.getpid()}')
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+            try:
+                os.ftruncate(fd, size)
+                mapped = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        except OSError:
+            log.exception('Could not create shared state %s', self.path)
+            self._retire(STOPPED)
+            return
+
+        HEADER.pack_into(mapped, 0, MAGIC, VERSION, NATIVE_FLAGS, slots, len(encoded))
+        mapped[HEADER_SIZE:HEADER_SIZE + len(encoded)] = encoded
+        mapping = _Mapping(mapped, slots, len(encoded))
+        mapping.words[PID] = os.getpid()
+        for idx in range(slots):
+            mapping.values[idx] = NAN
+        try:
+            os.replace(tmp_path, self.path)
+        except OSError:
+            log.exception('Could not move shared state into place at %s', self.path)
+            mapping.close()
+            self._retire(STOPPED)
+            return
+        self._retire(REPLACED)
+        self._mapping = mapping
+        log.debug('Publishing %s values to %s', slots, self.path)
+
+    def _retire(self, state: int):
+        if self._mapping is not None:
+            self._mapping.words[STATE] = state
+            self._mapping.close()
+            self._mapping = None
+
+    def publish(self):
+        """
+        Stores the current values, called from the control loop once per tick.
+        """
+        if self._fan_controller is not None and len(self._fan_controller.stats) != self._bound_loops:
+            # the asyncio scheduler only creates the stats of its loops once it runs.
+            self.bind(self._fan_controller)
+        mapping = self._mapping
+        if mapping is None:
+            return
+        values = mapping.values
+        words = mapping.words
+        words[SEQUENCE] += 1
+        try:
+            for idx, getter in enumerate(self._getters):
+                value = getter()
+                values[idx] = NAN if value is None else value
+            mapping.header[UPDATED] = time.time()
+            mapping.header[MONOTONIC] = self.clock()
+        finally:
+            words[SEQUENCE] += 1
+        self.updates += 1
+
+    def start(self, fan_controller):
+        self.bind(fan_controller)
+        self.publish()
+
+    def stop(self):
+        # the fans are back under firmware control, readers still mapping the file see it stopped.
+        self._retire(STOPPED)
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            log.exception('Could not remove %s', self.path)
+
+
+class SharedStateReader:
+    """
+    Maps the shared state of a running pyfc, snapshot() costs no syscall unless the file was replaced.
+    Raises FileNotFoundError if pyfc doesn't publish to path.
+    """
+
+    def __init__(self, path: Path = DEFAULT_PATH):
+        self.path = Path(path)
+        self.slots: List[dict] = []
+        self._mapping: Optional[_Mapping] = None
+        self._open()
+
+    def _open(self):
+        with self.path.open('rb') as reader:
+            mapped = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, slots, description_length = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or version != VERSION or flags & BIG_ENDIAN != NATIVE_FLAGS:
+            mapped.close()
+            raise ValueError(f'{self.path} is not a version {VERSION} pyfc shared state')
+        self.slots = json.loads(bytes(mapped[HEADER_SIZE:HEADER_SIZE + description_length]))['slots']
+        self.close()
+        self._mapping = _Mapping(mapped, slots, description_length)
+
+    def snapshot(self, timeout: float = 1.0) -> Snapshot:
+        """
+        :param timeout: seconds to keep trying for a consistent copy before giving up with a RuntimeError.
+        An update takes microseconds, but the writer may get descheduled in the middle of one,
+        so a reader catching it mid update yields the CPU before trying again.
+        """
+        if self._mapping.words[STATE] != LIVE:
+            try:
+                self._open()
+            except (OSError, ValueError):
+                # pyfc stopped, or is just restarting, keep showing the last state it published.
+                pass
+        mapping = self._mapping
+        words = mapping.words
+        deadline = None
+        while True:
+            sequence = words[SEQUENCE]
+            if not sequence & 1:
+                values = mapping.values.tolist()
+                updated = mapping.header[UPDATED]
+                monotonic = mapping.header[MONOTONIC]
+                if words[SEQUENCE] == sequence:
+                    return Snapshot(self.slots, values, sequence, updated, monotonic, words[PID], words[STATE] == LIVE)
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + timeout
+            elif now >= deadline:
+                raise RuntimeError(f'No consistent read of {self.path} within {timeout}s')
+            time.sleep(0)
+
+    def close(self):
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _format(value: Optional[float], unit: str, fmt: str = '.1f') -> str:
+    return '-' if value is None else f'{value:{fmt}}{unit}'
+
+
+def format_snapshot(snapshot: Snapshot) -> List[str]:
+    lines = [f'pid {snapshot.pid}, {"updated" if snapshot.live else "stopped"} {snapshot.age():.1f}s ago']
+    for slot in snapshot.temperatures():
+        lines.append(f'  {slot["name"]:<16} {_format(slot["value"], "°C"):>8}  {", ".join(slot["controllers"])}')
+    for slot in snapshot.speeds():
+        value = slot['value']
+        percent = None if value is None else value / 255 * 100
+        lines.append(f'  {slot["name"]:<16} {_format(percent, "%"):>8}  {", ".join(slot["controllers"])}')
+    for name, loop in snapshot.loops().items():
+        lines.append(f'  loop {name}: {loop["ticks"]:.0f} ticks, period {loop["period"] * 1000:.1f}ms, '
+                     f'duration {loop["duration"] * 1000:.2f}ms, {loop["overruns"]:.0f} overruns')
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Show the temperatures, fan speeds and loops a running pyfc published.')
+    parser.add_argument('--path', type=Path, default=DEFAULT_PATH)
+    parser.add_argument('--json', action='store_true', help='print the snapshot as JSON')
+    parser.add_argument('--watch', type=float, metavar='SECONDS', help='keep showing a fresh snapshot every SECONDS')
+    args = parser.parse_args(argv)
+
+    try:
+        reader = SharedStateReader(args.path)
+    except FileNotFoundError:
+        print(f'{args.path} does not exist, is pyfc running with sharedState set?', file=sys.stderr)
+        return 1
+    with reader:
+        while True:
+            snapshot = reader.snapshot()
+            if args.json:
+                print(json.dumps(snapshot.as_dict()))
+            else:
+                print('\n'.join(format_snapshot(snapshot)))
+            if args.watch is None:
+                return 0
+            try:
+                time.sleep(args.watch)
+            except KeyboardInterrupt:
+                return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Append-only on-disk spool of text lines.
+"""
+import logging
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class LineSpool:
+    """
+    Keeps lines on disk in numbered segment files, oldest first, capped in total size.
+    Writers only ever append to the newest segment, readers consume the oldest segment from an offset
+    and a fully consumed segment gets deleted. Once over the size cap, the oldest segments are thrown away.
+    The read offset is kept next to the segments, so a restart doesn't replay lines a second time.
+    """
+    suffix = '.lines'
+    offset_file = 'read_offset'
+
+    def __init__(self, directory: Path, segment_bytes: int = 4 << 20, max_bytes: int = 256 << 20):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.dropped_bytes = 0
+
+        self._segments: List[Path] = sorted(self.directory.glob(f'*{self.suffix}'))
+        self._sizes = {segment: segment.stat().st_size for segment in self._segments}
+        self._read_offset = self._load_offset()
+
+    def _load_offset(self) -> int:
+        try:
+            segment_name, offset = self.directory.joinpath(self.offset_file).read_text('utf-8').split()
+        except (OSError, ValueError):
+            return 0
+        if self._segments and self._segments[0].name == segment_name:
+            return min(int(offset), self._sizes[self._segments[0]])
+        return 0
+
+    def _store_offset(self):
+        offset_path = self.directory.joinpath(self.offset_file)
+        temp_path = offset_path.with_suffix('.tmp')
+        segment_name = self._segments[0].name if self._segments else ''
+        temp_path.write_text(f'{segment_name} {self._read_offset}\n', 'utf-8')
+        temp_path.replace(offset_path)
+
+    @property
+    def size(self) -> int:
+        return sum(self._sizes.values()) - self._read_offset
+
+    def __bool__(self):
+        return self.size > 0
+
+    def _new_segment(self) -> Path:
+        sequence = int(self._segments[-1].stem) + 1 if self._segments else 0
+        segment = self.directory.joinpath(f'{sequence:012d}{self.suffix}')
+        self._segments.append(segment)
+        self._sizes[segment] = 0
+        return segment
+
+    def append(self, lines: List[str]):
+        if not lines:
+            return
+        data = ''.join(f'{line}\n' for line in lines).encode('utf-8')
+        if not self._segments or self._sizes[self._segments[-1]] >= self.segment_bytes:
+            self._new_segment()
+        segment = self._segments[-1]
+        with segment.open('ab') as writer:
+            writer.write(data)
+        self._sizes[segment] += len(data)
+        self._enforce_cap()
+
+    def _enforce_cap(self):
+        while len(self._segments) > 1 and self.size > self.max_bytes:
+            oldest = self._segments[0]
+            self.dropped_bytes += self._sizes[oldest] - self._read_offset
+            log.warning('Spool over %d bytes, dropping segment %s', self.max_bytes, oldest)
+            self._remove_oldest()
+
+    def _remove_oldest(self):
+        oldest = self._segments.pop(0)
+        del self._sizes[oldest]
+        self._read_offset = 0
+        oldest.unlink(missing_ok=True)
+
+    def peek(self, max_lines: int) -> Tuple[List[str], Optional[Tuple[Path, int]]]:
+        """
+        Reads up to max_lines of the oldest lines without consuming them.
+        :return: the lines and a token to hand to commit() once they are dealt with.
+        """
+        if not self:
+            return [], None
+        segment = self._segments[0]
+        lines = []
+        offset = self._read_offset
+        with segment.open('rb') as reader:
+            reader.seek(offset)
+            while len(lines) < max_lines:
+                line = reader.readline()
+                if not line.endswith(b'\n'):
+                    # a torn write from a crash, or the end of the segment.
+                    break
+                lines.append(line[:-1].decode('utf-8'))
+                offset += len(line)
+        if not lines:
+            # nothing usable left in this segment, let commit() throw it away.
+            offset = self._sizes[segment]
+        return lines, (segment, offset)
+
+    def commit(self, token: Tuple[Path, int]):
+        segment, offset = token
+        if not self._segments or self._segments[0] != segment:
+            # the segment got dropped by the size cap in the meantime.
+            return
+        self._read_offset = offset
+        if offset >= self._sizes[segment]:
+            self._remove_oldest()
+        self._store_offset()
@@ -1,19 +1,23 @@
+import time
 from typing import Dict
 
 from .common import mean, ValueBuffer
-
-from datetime import datetime, timezone, timedelta
+from .sensorregistry import registry
 
 
 class TemperatureGroup:
     def __init__(self, name, time_read_sec=1):
         self.name = name
         self.data: Dict[str, ValueBuffer] = {}
-        self.last_update = datetime.now(tz=timezone.utc) - timedelta(seconds=10)
-        self.time_read = timedelta(seconds=time_read_sec)
+        self.time_read = time_read_sec
+        self.last_update = time.monotonic() - 10 - time_read_sec
+        self.read_epoch = 0
 
     def updatable(self):
-        if datetime.now(timezone.utc) - self.last_update > self.time_read:
+        if registry.is_current(self.read_epoch):
+            return False
+
+        if time.monotonic() - self.last_update > self.time_read:
             return True
 
         return False
@@ -23,7 +27,11 @@ class TemperatureGroup:
             self.data[name] = ValueBuffer(name, 35)
 
         self.data[name].update(device)
-        self.last_update = datetime.now(timezone.utc)
+        self.mark_read()
+
+    def mark_read(self):
+        self.last_update = time.monotonic()
+        self.read_epoch = registry.epoch
 
     def mean(self, device) -> float:
         try:
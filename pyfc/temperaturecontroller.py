@@ -1,7 +1,10 @@
 import logging
-from typing import List, Union, Iterable
+from configparser import SectionProxy
+from typing import List, Optional, Union, Iterable
 
-from .common import InputDevice, OutputDevice, Controller, lerp, mean
+from .aggregate import Aggregate
+from .common import InputDevice, OutputDevice, Controller, lerp
+from .curve import FanCurve
 
 log = logging.getLogger(__name__)
 
@@ -11,28 +14,25 @@ class TemperatureController(Controller):
         raw temperature controller
     """
 
-    def __init__(self, input_devices: Iterable[InputDevice], output_devices: Iterable[OutputDevice], speeds: List[int]):
+    def __init__(self, input_devices: Iterable[InputDevice], output_devices: Iterable[OutputDevice], speeds: Union[FanCurve, List[int]],
+                 aggregate: Optional[Aggregate] = None):
         """
         :param input_devices: Input device from which we take the temperature.
         :param output_devices: Output device to which we set the speed
-        :param speeds: tuple of speeds to which we set it.
+        :param speeds: compiled fan curve, or a list of speeds per whole degree, to which we set it.
+        :param aggregate: how the temperatures of the inputs combine into one, the mean if not given.
         """
         self.inputs = [d for d in input_devices if d]
         self.outputs = [d for d in output_devices if d]
-        self.speeds = speeds
+        self.speeds = speeds if speeds is None or isinstance(speeds, FanCurve) else FanCurve(speeds)
+        self.aggregate = aggregate or Aggregate()
+        self.aggregate.check(len(self.inputs))
 
     def get_speed(self, temp: Union[float, int]):
-        temp = int(temp)
-        try:
-            speed = self.speeds[temp]
-        except IndexError:
-            if temp >= len(self.speeds):
-                speed = self.speeds[-1]
-            else:
-                speed = self.speeds[0]
-        finally:
+        speed = self.speeds(temp)
+        if log.isEnabledFor(logging.DEBUG):
             log.debug('temperature %s°C, speed: %s%%', temp, int(lerp(speed, 0, 255, 0, 100)))
-            return speed
+        return speed
 
     def run(self):
         """
@@ -40,7 +40,7 @@ class TemperatureController(Controller):
             If reported temperature is 0, take previous temp
         """
         try:
-            temp = mean([input_dev.get_value() for input_dev in self.inputs])
+            temp = self.aggregate([input_dev.get_value() for input_dev in self.inputs])
             speed = self.get_speed(temp)
         except ValueError:
             speed = 128
@@ -64,3 +64,10 @@ class TemperatureController(Controller):
 
     def __del__(self):
         self.disable()
+
+
+def generate_temperature_controller(device_config: SectionProxy, inputs: Iterable[InputDevice], outputs: Iterable[OutputDevice],
+                                    curve: Optional[FanCurve] = None) -> TemperatureController:
+    if curve is None and 'temps' in device_config:
+        curve = FanCurve.from_config(device_config)
+    return TemperatureController(inputs, outputs, curve, Aggregate.from_config(device_config))
@@ -0,0 +1,187 @@
+"""
+One-shot index of the hwmon and disk topology of the machine.
+"""
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+SYSFS_ROOT = Path(os.environ.get('PYFC_SYSFS_ROOT', '/sys'))
+DEV_ROOT = Path(os.environ.get('PYFC_DEV_ROOT', '/dev'))
+
+_disk_id_regex = re.compile(r'^(.*?)-(.*?)(-part\d+)?$')
+
+
+class HwmonDir(NamedTuple):
+    path: Path
+    name: str
+    device: Optional[Path]
+    temp_inputs: List[Path]
+
+
+class DiskID(NamedTuple):
+    path: Path
+    bus: str
+    name: str
+    partition: bool
+
+
+class Topology:
+    """
+    Scans /sys/class/hwmon and /dev/disk/by-id once, reading every chip name, device link and sensor label up front,
+    so discovery lookups afterwards don't touch the filesystem at all:
+        chip name -> hwmon dirs
+        resolved device dir (block device, nvme controller, ...) -> its hwmon dirs, a device may have several chips
+        resolved device dir and chip name -> hwmon dir
+        temp*_input -> label
+        disk id -> /dev/disk/by-id entry
+    """
+
+    def __init__(self, sysfs_root: Path = None, dev_root: Path = None):
+        self.sysfs_root = Path(sysfs_root or SYSFS_ROOT)
+        self.dev_root = Path(dev_root or DEV_ROOT)
+
+        self.hwmon_dirs: List[HwmonDir] = []
+        self.by_name: Dict[str, List[HwmonDir]] = {}
+        self.by_device: Dict[Path, List[HwmonDir]] = {}
+        self.by_device_name: Dict[Tuple[Path, str], HwmonDir] = {}
+        self.labels: Dict[Path, str] = {}
+        self.disk_ids: List[DiskID] = []
+        self._name_queries: Dict[str, List[HwmonDir]] = {}
+        self._disk_queries: Dict[str, List[DiskID]] = {}
+
+        self._scan_hwmon()
+        self._scan_disks()
+
+    @property
+    def hwmon_root(self) -> Path:
+        return self.sysfs_root.joinpath('class', 'hwmon')
+
+    def _scan_hwmon(self):
+        try:
+            hwmon_dirs = sorted(self.hwmon_root.iterdir())
+        except FileNotFoundError:
+            log.warning('No hwmon class directory at %s', self.hwmon_root)
+            return
+
+        for hwmon_path in hwmon_dirs:
+            try:
+                name = hwmon_path.joinpath('name').read_text('utf-8').strip()
+            except OSError:
+                continue
+            device_link = hwmon_path.joinpath('device')
+            device = device_link.resolve() if device_link.exists() else None
+
+            temp_inputs = []
+            for entry in sorted(os.listdir(hwmon_path)):
+                if entry.startswith('temp') and entry.endswith('_input'):
+                    temp_input = hwmon_path.joinpath(entry)
+                    temp_inputs.append(temp_input)
+                    label_path = hwmon_path.joinpath(entry.replace('_input', '_label'))
+                    try:
+                        self.labels[temp_input] = label_path.read_text('utf-8').replace('\n', '')
+                    except OSError:
+                        self.labels[temp_input] = entry
+
+            hwmon_dir = HwmonDir(hwmon_path, name, device, temp_inputs)
+            self.hwmon_dirs.append(hwmon_dir)
+            self.by_name.setdefault(name, []).append(hwmon_dir)
+            if device is not None:
+                self.by_device.setdefault(device, []).append(hwmon_dir)
+                self.by_device_name.setdefault((device, name), hwmon_dir)
+
+    def _scan_disks(self):
+        disk_lookup_base = self.dev_root.joinpath('disk', 'by-id')
+        try:
+            entries = sorted(disk_lookup_base.iterdir())
+        except FileNotFoundError:
+            return
+        for device_path in entries:
+            matches = _disk_id_regex.match(device_path.name)
+            if matches is None:
+                continue
+            self.disk_ids.append(DiskID(device_path, matches.group(1), matches.group(2), matches.group(3) is not None))
+
+    def hwmon_named(self, device_name: str) -> List[HwmonDir]:
+        """
+        hwmon dirs whose chip name starts with device_name, e.g. "nvme" matches every nvme drive.
+        """
+        if device_name not in self._name_queries:
+            self._name_queries[device_name] = [d for d in self.hwmon_dirs if d.name.startswith(device_name)]
+        return self._name_queries[device_name]
+
+    def hwmon_for_device(self, device_path: Path, name: Optional[str] = None) -> Optional[HwmonDir]:
+        """
+        The hwmon dir registered for a device, or for one of its two closest ancestors,
+        e.g. the scsi device above /sys/class/block/sda which drivetemp attaches to.
+        :param name: chip name of the hwmon dir, the first one registered on the device if not given.
+        """
+        real_path = device_path.resolve()
+        for candidate in (real_path, real_path.parent, real_path.parent.parent):
+            if name is not None:
+                if (candidate, name) in self.by_device_name:
+                    return self.by_device_name[(candidate, name)]
+            elif candidate in self.by_device:
+                return self.by_device[candidate][0]
+        return None
+
+    def relocate(self, real_path: Path, name: Optional[str] = None) -> Optional[Path]:
+        """
+        Where a file of a hwmon dir, known by its resolved path from before, lives now,
+        e.g. after a driver reload or device reset renumbered hwmon3 to hwmon5.
+        Matches on the device the hwmon dir is registered on and the chip name, None if no such chip has the file now.
+        Without a name, the first chip of the device having the file.
+        """
+        device = real_path.parent.parent.parent
+        if name is not None:
+            hwmon_dir = self.by_device_name.get((device, name))
+            candidates = [hwmon_dir] if hwmon_dir is not None else []
+        else:
+            candidates = self.by_device.get(device, [])
+        for hwmon_dir in candidates:
+            path = hwmon_dir.path.joinpath(real_path.name)
+            if path.exists():
+                return path
+        return None
+
+    def label(self, input_path: Path) -> str:
+        if input_path in self.labels:
+            return self.labels[input_path]
+        label_path = input_path.parent.joinpath(input_path.name.replace('_input', '_label'))
+        return label_path.read_text('utf-8').replace('\n', '') if label_path.exists() else input_path.name
+
+    def disks_matching(self, disk_name: str) -> List[DiskID]:
+        """
+        Whole disk (not partition) ids containing disk_name.
+        """
+        if disk_name not in self._disk_queries:
+            self._disk_queries[disk_name] = [d for d in self.disk_ids if not d.partition and disk_name in d.name]
+        return self._disk_queries[disk_name]
+
+
+_topology: Optional[Topology] = None
+_topology_lock = threading.Lock()
+
+
+def get_topology() -> Topology:
+    """
+    The process wide topology, scanned on first use.
+    """
+    global _topology
+    with _topology_lock:
+        if _topology is None:
+            _topology = Topology()
+        return _topology
+
+
+def reset_topology(topology: Optional[Topology] = None):
+    """
+    Drops the process wide topology so the next lookup rescans, or replaces it with the given one.
+    """
+    global _topology
+    with _topology_lock:
+        _topology = topology
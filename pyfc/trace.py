@@ -0,0 +1,562 @@
+"""
+Recording what the control loop read and wrote, and replaying recordings through other configs faster than real time.
+
+A trace file holds one record per tick: when it ran, the raw reading of every input and the speed committed to every output.
+It is laid out by column, one fixed size array per channel preallocated for capacity records and memory mapped,
+so appending a record is a few stores into the mapping, and a replay reads every channel as one contiguous array.
+The header and a JSON description of the channels come first, the record count is updated last,
+so a file being written can be read at any time, up to its last complete record.
+
+python -m pyfc.trace info /var/lib/pyfc/trace/*.pyfctrace
+python -m pyfc.trace replay --config candidate.ini /var/lib/pyfc/trace/*.pyfctrace
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from configparser import ConfigParser
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .common import Controller, InputDevice, OutputDevice, ValueBuffer, lerp
+from .drivers import drivers, CONTROLLERS
+from .prometheus import _source
+from .reload import read_config
+from .sampler import unwrap_inputs
+from .shaping import OutputShaper
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'PYFCTRC\0'
+VERSION = 1
+SUFFIX = '.pyfctrace'
+# magic, version, flags, channels, capacity, length of the JSON description, records written, created at.
+HEADER = struct.Struct('<8sHHIIIQd')
+COUNT = struct.Struct('<Q')
+COUNT_OFFSET = 24
+# columns are stored in the byte order of the machine recording them.
+BIG_ENDIAN = 1
+NATIVE_FLAGS = BIG_ENDIAN if sys.byteorder == 'big' else 0
+NAN = float('nan')
+
+
+def layout(channels: int, capacity: int, description_length: int) -> Tuple[int, List[int], int]:
+    """
+    :return: offset of the time column, offsets of the channel columns and size of a trace file.
+    """
+    times = -(-(HEADER.size + description_length) // 8) * 8
+    columns = [times + 8 * capacity + 4 * capacity * idx for idx in range(channels)]
+    return times, columns, times + 8 * capacity + 4 * capacity * channels
+
+
+class TraceWriter:
+    """
+    One trace file, created sparse at its full size and filled one record at a time.
+    Times are stored as doubles, readings and speeds as floats, NaN where there was none.
+    """
+
+    def __init__(self, path: Path, description: dict, capacity: int, created: float):
+        self.path = Path(path)
+        self.capacity = capacity
+        self.count = 0
+        encoded = json.dumps(description).encode('utf-8')
+        channels = len(description['channels'])
+        times, columns, size = layout(channels, capacity, len(encoded))
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, NATIVE_FLAGS, channels, capacity, len(encoded), 0, created)
+        self._mmap[HEADER.size:HEADER.size + len(encoded)] = encoded
+        view = memoryview(self._mmap)
+        self._times = view[times:times + 8 * capacity].cast('d')
+        self._columns = [view[offset:offset + 4 * capacity].cast('f') for offset in columns]
+        view.release()
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    def append(self, timestamp: float, values: Sequence[Optional[float]]) -> bool:
+        """
+        :return: False if the file is full and nothing was written.
+        """
+        count = self.count
+        if count >= self.capacity:
+            return False
+        self._times[count] = timestamp
+        for column, value in zip(self._columns, values):
+            column[count] = NAN if value is None else value
+        self.count = count + 1
+        COUNT.pack_into(self._mmap, COUNT_OFFSET, self.count)
+        return True
+
+    def close(self):
+        if self._mmap is None:
+            return
+        for column in self._columns:
+            column.release()
+        self._times.release()
+        self._columns = []
+        self._mmap.flush()
+        self._mmap.close()
+        self._mmap = None
+
+
+class TraceReader:
+    """
+    Read only mapping of a trace file, times and columns are memoryviews of the records written so far.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self.path.open('rb') as reader:
+            self._mmap = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, channels, capacity, description_length, count, self.created = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f'{self.path} is not a version {VERSION} trace file')
+        if flags & BIG_ENDIAN != NATIVE_FLAGS:
+            self._mmap.close()
+            raise ValueError(f'{self.path} was recorded with a different byte order')
+
+        description = json.loads(bytes(self._mmap[HEADER.size:HEADER.size + description_length]))
+        self.channels: List[dict] = description['channels']
+        self.controllers: Dict[str, dict] = description['controllers']
+        self.capacity = capacity
+        self.count = min(count, capacity)
+        times, columns, _ = layout(channels, capacity, description_length)
+        view = memoryview(self._mmap)
+        self.times = view[times:times + 8 * capacity].cast('d')[:self.count]
+        self._columns = [view[offset:offset + 4 * capacity].cast('f')[:self.count] for offset in columns]
+        view.release()
+
+    def column(self, channel: int) -> memoryview:
+        return self._columns[channel]
+
+    @property
+    def duration(self) -> float:
+        return self.times[-1] - self.times[0] if self.count else 0.0
+
+    def close(self):
+        if self._mmap is None:
+            return
+        for column in self._columns:
+            column.release()
+        self.times.release()
+        self._columns = []
+        self._mmap.close()
+        self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TraceRecorder:
+    """
+    Appends a record to the current trace file in directory after every tick,
+    starting a new file once it holds capacity records or the devices change, e.g. on a config reload.
+    Only the newest keep_files files are kept, all of them if 0.
+    """
+
+    def __init__(self, directory: Path, capacity: int = 86400, keep_files: int = 0, clock: Callable[[], float] = time.time):
+        self.directory = Path(directory)
+        self.capacity = capacity
+        self.keep_files = keep_files
+        self.clock = clock
+        self.records = 0
+        self.writer: Optional[TraceWriter] = None
+        self._description: Optional[dict] = None
+        self._getters: List[Callable[[], Optional[float]]] = []
+        self._sequence = 0
+        self._failed = False
+
+    def bind(self, fan_controller):
+        """
+        Takes the channels from the inputs and outputs of every controller, call again whenever its devices change.
+        Inputs and outputs shared by controllers are recorded once.
+        """
+        channels = []
+        getters = []
+        controllers = {}
+        seen = {}
+        for device_name, device in list(fan_controller.devices.items()):
+            spec = controllers[device_name] = {'inputs': [], 'outputs': []}
+            for kind, devices, getter in (('input', unwrap_inputs(device.inputs), 'last_reading'),
+                                          ('output', device.outputs, 'committed_speed')):
+                for dev in devices:
+                    if id(dev) not in seen:
+                        seen[id(dev)] = len(channels)
+                        channels.append({'kind': kind, 'name': dev.name, 'source': _source(dev)})
+                        getters.append(getattr(dev, getter))
+                    spec[f'{kind}s'].append(seen[id(dev)])
+
+        description = {'channels': channels, 'controllers': controllers}
+        self._getters = getters
+        if description != self._description:
+            self._description = description
+            self.close()
+
+    def start(self, fan_controller):
+        self.bind(fan_controller)
+
+    def record(self):
+        """
+        Appends the readings and speeds of the tick which just ran, called from the control loop.
+        """
+        if self._failed:
+            return
+        if self.writer is None or self.writer.full:
+            self.close()
+            if not self._open():
+                return
+        self.writer.append(self.clock(), [getter() for getter in self._getters])
+        self.records += 1
+
+    def _open(self) -> bool:
+        now = self.clock()
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now))
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            while True:
+                self._sequence += 1
+                path = self.directory.joinpath(f'pyfc-{stamp}-{self._sequence:04d}{SUFFIX}')
+                try:
+                    self.writer = TraceWriter(path, self._description, self.capacity, now)
+                    break
+                except FileExistsError:
+                    continue
+        except OSError:
+            log.exception('Could not create a trace file in %s, recording stopped.', self.directory)
+            self._failed = True
+            return False
+        log.info('Recording trace to %s', self.writer.path)
+        self._prune()
+        return True
+
+    def _prune(self):
+        if not self.keep_files:
+            return
+        # file names start with the time they were created, so they sort oldest first.
+        for path in sorted(self.directory.glob(f'*{SUFFIX}'))[:-self.keep_files]:
+            try:
+                path.unlink()
+            except OSError:
+                log.exception('Could not remove old trace %s', path)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def stop(self):
+        self.close()
+
+
+class VirtualClock:
+    """
+    Stands in for time.monotonic while replaying, set to the recorded time of every tick.
+    """
+    __slots__ = ('now',)
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class ReplayInput(InputDevice):
+    """
+    Plays back the raw readings of one input channel, smoothed like LMSensorsTempInput smooths what it reads.
+    A failed read, recorded as NaN, keeps the previous readings, and the input is read once per tick however many controllers use it.
+    """
+
+    def __init__(self, name: str, column: Sequence[float], replay: 'Replay'):
+        super().__init__(name)
+        self.column = column
+        self.replay = replay
+        self.temp = ValueBuffer(name, 35)
+        self._read_index = -1
+
+    def get_value(self) -> float:
+        index = self.replay.index
+        if index != self._read_index:
+            self._read_index = index
+            value = self.column[index]
+            if value == value:
+                self.temp.update(value)
+        return self.temp.mean()
+
+    def smoothed(self) -> Optional[float]:
+        return self.temp.mean() if len(self.temp) else None
+
+    def last_reading(self) -> Optional[float]:
+        return self.temp.last() if len(self.temp) else None
+
+
+class ReplayOutput(OutputDevice):
+    """
+    Takes speeds like LMSensorsOutput does, skipping unchanged ones unless refresh_interval passed, without writing anywhere.
+    """
+
+    def __init__(self, name: str, clock: VirtualClock, refresh_interval: Optional[float] = None):
+        super().__init__(name)
+        self.clock = clock
+        self.refresh_interval = refresh_interval
+        self.enabled = True
+        self.committed: Optional[int] = None
+        self.committed_at = 0.0
+        self.writes = 0
+        self.writes_skipped = 0
+
+    def apply(self):
+        speed = self.target_speed()
+        now = self.clock.now
+        if speed == self.committed and (self.refresh_interval is None or now - self.committed_at < self.refresh_interval):
+            self.writes_skipped += 1
+            return
+        self.committed = speed
+        self.committed_at = now
+        self.writes += 1
+
+    def committed_speed(self) -> Optional[int]:
+        return self.committed
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+
+class SpeedStats:
+    """
+    What an output did over a replay: how often and how far its speed changed, its time weighted mean,
+    and for how long it ran above threshold, all in PWM steps (0-255).
+    """
+    __slots__ = ('threshold', 'changes', 'travel', 'time', 'time_above', 'weighted', 'max', '_last')
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.changes = 0
+        self.travel = 0.0
+        self.time = 0.0
+        self.time_above = 0.0
+        self.weighted = 0.0
+        self.max: Optional[float] = None
+        self._last: Optional[float] = None
+
+    def step(self, speed: Optional[float], held: float):
+        """
+        :param speed: the speed after a tick, None or NaN if unknown.
+        :param held: seconds until the next tick.
+        """
+        if speed is None or speed != speed:
+            return
+        last = self._last
+        if last is not None and speed != last:
+            self.changes += 1
+            self.travel += abs(speed - last)
+        self._last = speed
+        self.time += held
+        self.weighted += speed * held
+        if speed > self.threshold:
+            self.time_above += held
+        if self.max is None or speed > self.max:
+            self.max = speed
+
+    def as_dict(self) -> dict:
+        return {
+            'speed_changes': self.changes,
+            'travel': self.travel,
+            'mean_speed': self.weighted / self.time if self.time else self._last,
+            'max_speed': self.max,
+            'time_above_speed': self.time_above,
+        }
+
+
+class Replay:
+    """
+    Runs the controllers of a candidate config over a recorded trace, one recorded tick after another, without sleeping,
+    with a VirtualClock standing in for time in PID controllers and output shapers.
+
+    Every controller of the trace found in the config is rebuilt around ReplayInputs and ReplayOutputs of its recorded channels,
+    so the candidate may change anything but which sensors and fans a controller uses.
+    The replay is open loop: temperatures stay as recorded, whatever the candidate does to the fans.
+    """
+
+    def __init__(self, trace: TraceReader, config: ConfigParser, speed_threshold: float = 80.0, temperature_threshold: float = 70.0):
+        """
+        :param speed_threshold: fan speed in % the time above gets reported for.
+        :param temperature_threshold: temperature in °C the time above gets reported for, per controller, of its hottest input.
+        """
+        self.trace = trace
+        self.config = config
+        self.speed_threshold = speed_threshold
+        self.temperature_threshold = temperature_threshold
+        self.clock = VirtualClock(trace.times[0] if trace.count else 0.0)
+        self.index = 0
+        self.inputs: Dict[int, ReplayInput] = {}
+        self.outputs: Dict[int, ReplayOutput] = {}
+        self.controllers: Dict[str, Controller] = {}
+        for name, spec in trace.controllers.items():
+            if not config.has_section(name):
+                log.warning('%s is not configured in the candidate, not replaying it', name)
+                continue
+            self.controllers[name] = self._build(name, config[name], spec)
+
+    def _build(self, name: str, section, spec: dict) -> Controller:
+        inputs = []
+        for channel in spec['inputs']:
+            if channel not in self.inputs:
+                self.inputs[channel] = ReplayInput(self.trace.channels[channel]['name'], self.trace.column(channel), self)
+            inputs.append(self.inputs[channel])
+        outputs = []
+        for channel in spec['outputs']:
+            if channel not in self.outputs:
+                output = ReplayOutput(self.trace.channels[channel]['name'], self.clock, section.getfloat('pwmRefreshInterval', None))
+                output.shaper = OutputShaper.from_config(section)
+                if output.shaper is not None:
+                    output.shaper.clock = self.clock
+                self.outputs[channel] = output
+            outputs.append(self.outputs[channel])
+        controller = drivers.get(CONTROLLERS, section.get('controllerType', 'temperature'))(section, inputs, outputs, None)
+        if hasattr(controller, 'clock'):
+            controller.clock = self.clock
+        return controller
+
+    def run(self) -> dict:
+        trace = self.trace
+        times = trace.times
+        count = trace.count
+        threshold = lerp(self.speed_threshold, 0, 100, 0, 255)
+        outputs = list(self.outputs.items())
+        controllers = list(self.controllers.values())
+        candidate = {channel: SpeedStats(threshold) for channel in self.outputs}
+        recorded = {channel: SpeedStats(threshold) for channel in self.outputs}
+        recorded_columns = [(channel, trace.column(channel)) for channel in self.outputs]
+        temperatures = {name: [trace.column(channel) for channel in trace.controllers[name]['inputs']] for name in self.controllers}
+        time_above = dict.fromkeys(self.controllers, 0.0)
+        hottest: Dict[str, Optional[float]] = dict.fromkeys(self.controllers)
+
+        started = time.perf_counter()
+        for index in range(count):
+            self.index = index
+            now = self.clock.now = times[index]
+            held = times[index + 1] - now if index + 1 < count else 0.0
+            for controller in controllers:
+                controller.run()
+            for channel, output in outputs:
+                output.apply()
+                candidate[channel].step(output.committed, held)
+            for channel, column in recorded_columns:
+                recorded[channel].step(column[index], held)
+            for name, columns in temperatures.items():
+                readings = [value for value in (column[index] for column in columns) if value == value]
+                if not readings:
+                    continue
+                temperature = max(readings)
+                if temperature > self.temperature_threshold:
+                    time_above[name] += held
+                if hottest[name] is None or temperature > hottest[name]:
+                    hottest[name] = temperature
+        elapsed = time.perf_counter() - started
+
+        report = {
+            'trace': str(trace.path),
+            'ticks': count,
+            'duration': trace.duration,
+            'elapsed': elapsed,
+            'speed_threshold': self.speed_threshold,
+            'temperature_threshold': self.temperature_threshold,
+            'controllers': {},
+        }
+        for name in self.controllers:
+            report['controllers'][name] = {
+                'time_above_temperature': time_above[name],
+                'max_temperature': hottest[name],
+                'outputs': [{
+                    'name': self.outputs[channel].name,
+                    'source': trace.channels[channel]['source'],
+                    'writes': self.outputs[channel].writes,
+                    'candidate': candidate[channel].as_dict(),
+                    'recorded': recorded[channel].as_dict(),
+                } for channel in trace.controllers[name]['outputs']],
+            }
+        return report
+
+
+def replay(path: Path, config: ConfigParser, speed_threshold: float = 80.0, temperature_threshold: float = 70.0) -> dict:
+    with TraceReader(path) as trace:
+        return Replay(trace, config, speed_threshold, temperature_threshold).run()
+
+
+def _percent(speed: Optional[float]) -> str:
+    return '-' if speed is None else f'{lerp(speed, 0, 255, 0, 100):.1f}%'
+
+
+def format_report(report: dict) -> List[str]:
+    rate = report['ticks'] / report['elapsed'] if report['elapsed'] else 0.0
+    lines = [f'{report["trace"]}: {report["ticks"]} ticks over {report["duration"]:.0f}s, '
+             f'replayed in {report["elapsed"]:.2f}s ({rate:.0f} ticks/s)']
+    for name, controller in report['controllers'].items():
+        hottest = controller['max_temperature']
+        lines.append(f'  {name}: above {report["temperature_threshold"]}°C for {controller["time_above_temperature"]:.0f}s, '
+                     f'hottest {"-" if hottest is None else f"{hottest:.1f}°C"}')
+        for output in controller['outputs']:
+            candidate, recorded = output['candidate'], output['recorded']
+            lines.append(f'    {output["name"]}: {output["writes"]} writes, '
+                         f'{candidate["speed_changes"]} speed changes (recorded {recorded["speed_changes"]}), '
+                         f'travel {candidate["travel"]:.0f} (recorded {recorded["travel"]:.0f}), '
+                         f'above {report["speed_threshold"]}% for {candidate["time_above_speed"]:.0f}s (recorded {recorded["time_above_speed"]:.0f}s), '
+                         f'mean {_percent(candidate["mean_speed"])} (recorded {_percent(recorded["mean_speed"])})')
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect recorded pyfc traces, or replay them through a candidate config.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    info = commands.add_parser('info', help='show what a trace holds')
+    info.add_argument('traces', nargs='+', type=Path)
+    replaying = commands.add_parser('replay', help='run the controllers of a config over traces and report what the fans did')
+    replaying.add_argument('traces', nargs='+', type=Path)
+    replaying.add_argument('--config', required=True, type=Path, help='candidate settings.ini')
+    replaying.add_argument('--speed-threshold', type=float, default=80.0, help='report the time fans ran above this speed in %%')
+    replaying.add_argument('--temperature-threshold', type=float, default=70.0, help='report the time inputs were above this in °C')
+    replaying.add_argument('--json', action='store_true', help='print the raw reports')
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        for path in args.traces:
+            with TraceReader(path) as trace:
+                print(f'{path}: {trace.count} of {trace.capacity} records over {trace.duration:.0f}s, '
+                      f'started {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(trace.created))}')
+                for name, spec in trace.controllers.items():
+                    channels = [trace.channels[channel] for channel in spec['inputs'] + spec['outputs']]
+                    print(f'  {name}: ' + ', '.join(f'{channel["kind"]} {channel["name"]} ({channel["source"]})' for channel in channels))
+        return 0
+
+    config = read_config(args.config)
+    reports = [replay(path, config, args.speed_threshold, args.temperature_threshold) for path in args.traces]
+    if args.json:
+        json.dump(reports, sys.stdout, indent=2)
+        print()
+    else:
+        for report in reports:
+            print('\n'.join(format_report(report)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
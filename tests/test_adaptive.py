@@ -0,0 +1,66 @@
+from pathlib import Path
+from unittest import TestCase
+
+from pyfc.adaptive import AdaptiveInterval
+from pyfc.common import DummyInput, DummyOutput
+from pyfc.fancontroller import FanController
+from pyfc.temperaturecontroller import TemperatureController
+
+
+class TestAdaptiveInterval(TestCase):
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.input = DummyInput()
+        self.input.set_value(40.0)
+        self.output = DummyOutput()
+        self.output.enable()
+        # 100 below 49.5°C, 200 from there on.
+        self.controller = TemperatureController([self.input], [self.output], [100] * 50 + [200] * 60)
+        self.adaptive = AdaptiveInterval(10.0, rate_threshold=0.5, growth=2.0, clock=lambda: self.now)
+
+    def _tick(self, temperature: float) -> float:
+        self.input.set_value(temperature)
+        self.controller.run()
+        interval = self.adaptive.update(self.controller, 1.0)
+        self.now += interval
+        return interval
+
+    def test_stretches_while_stable(self):
+        self.assertEqual([1.0, 2.0, 4.0, 8.0, 10.0, 10.0], [self._tick(40.0) for _ in range(6)])
+        # slow drift, a step of 0.2°C in 10s every tick.
+        self.assertEqual(10.0, self._tick(40.2))
+        self.assertEqual(10.0, self._tick(40.4))
+        self.assertEqual(0, self.adaptive.snaps)
+
+    def test_snaps_back_on_rate(self):
+        for _ in range(6):
+            self._tick(40.0)
+        self.assertEqual(1.0, self._tick(48.0))
+        self.assertEqual(1, self.adaptive.snaps)
+        # still climbing fast, so it stays at the regular interval.
+        self.assertEqual(1.0, self._tick(49.0))
+        self.assertEqual(1, self.adaptive.snaps)
+
+    def test_snaps_back_on_speed(self):
+        for _ in range(6):
+            self._tick(49.4)
+        # a tenth of a degree is no rate to speak of, but crosses into the next speed.
+        self.assertEqual(1.0, self._tick(49.5))
+        self.assertEqual(1, self.adaptive.snaps)
+
+    def test_regular_interval_is_the_minimum(self):
+        self.assertEqual(30.0, self.adaptive.update(self.controller, 30.0))
+        self.assertEqual(30.0, self.adaptive.update(self.controller, 30.0))
+
+    def test_fan_controller(self):
+        other = TemperatureController([DummyInput()], [DummyOutput()], [100] * 110)
+        fan_controller = FanController(Path('unused.pid'), 1.0, {'cpu': self.controller, 'case': other}, {'cpu': 2.0},
+                                       adaptive={'cpu': self.adaptive})
+        fan_controller.tick()
+        self.assertEqual(2.0, fan_controller.next_interval('cpu'))
+        self.assertEqual(4.0, fan_controller.next_interval('cpu'))
+        self.assertEqual(1.0, fan_controller.next_interval('case'))
+        # case always needs the regular interval, so the sync loop can't stretch.
+        self.assertEqual(1.0, fan_controller._next_sync_interval())
+        del fan_controller.devices['case']
+        self.assertEqual(10.0, fan_controller._next_sync_interval())
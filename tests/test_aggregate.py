@@ -0,0 +1,58 @@
+from configparser import ConfigParser
+from unittest import TestCase
+
+from pyfc.aggregate import Aggregate
+from pyfc.common import DummyInput, DummyOutput
+from pyfc.temperaturecontroller import generate_temperature_controller
+
+
+class TestAggregate(TestCase):
+    def test_modes(self):
+        readings = [40.0, 45.0, 70.0, 42.0]
+        self.assertEqual(49.25, Aggregate()(readings))
+        self.assertEqual(70.0, Aggregate('max')(readings))
+        self.assertEqual(70.0, Aggregate('p100')(readings))
+        self.assertEqual(40.0, Aggregate('p0')(readings))
+        self.assertEqual(43.5, Aggregate('p50')(readings))
+        self.assertAlmostEqual(62.5, Aggregate('P90')(readings))
+        self.assertEqual(59.0, Aggregate('weighted', [1, 1, 3, 0])(readings))
+        self.assertEqual((40 + 45 + 70 * 3 + 42) / 6, Aggregate('weighted', [1, 1, 3])(readings))
+        self.assertEqual(45.0, Aggregate('max')([45]))
+
+    def test_invalid(self):
+        for mode in ('median', 'p101', 'pmax'):
+            with self.assertRaises(ValueError, msg=mode):
+                Aggregate(mode)
+        with self.assertRaises(ValueError):
+            Aggregate('weighted', [1, -1])
+        with self.assertRaises(ValueError):
+            Aggregate('max')([])
+        with self.assertRaises(ValueError):
+            Aggregate('weighted', [0, 0])([30, 40])
+        with self.assertRaises(ValueError):
+            Aggregate('weighted', [1, 3]).check(3)
+        Aggregate('weighted', [1, 3]).check(2)
+
+    def test_unweighted(self):
+        self.assertEqual(Aggregate('mean'), Aggregate('weighted', [1, 3]).unweighted())
+        self.assertEqual(Aggregate('max'), Aggregate('max', [1, 3]).unweighted())
+
+    def test_controller_reacts_to_hottest_input(self):
+        config = ConfigParser(converters={'list': lambda x: [i.strip() for i in x.split(',')]})
+        config.read_string('[chipset]\ntemps = 30, 60\nminimumSpeed = 20\nmaximumSpeed = 100\naggregate = max\n')
+        inputs = [DummyInput() for _ in range(3)]
+        for input_dev, temp in zip(inputs, (35, 36, 60)):
+            input_dev.set_value(temp)
+        output = DummyOutput()
+        controller = generate_temperature_controller(config['chipset'], inputs, [output])
+        controller.enable()
+        controller.run()
+        output.apply()
+        self.assertEqual(255, output.speed)
+
+    def test_controller_rejects_weights_per_section(self):
+        config = ConfigParser(converters={'list': lambda x: [i.strip() for i in x.split(',')]})
+        config.read_string('[disks]\ntemps = 30, 60\nminimumSpeed = 20\nmaximumSpeed = 100\naggregate = weighted\naggregateWeights = 1, 3\n')
+        # e.g. a diskIDs pattern which matched three drives.
+        with self.assertRaises(ValueError):
+            generate_temperature_controller(config['disks'], [DummyInput() for _ in range(3)], [DummyOutput()])
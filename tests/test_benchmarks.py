@@ -0,0 +1,22 @@
+import argparse
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from benchmarks.controlloop import SCENARIOS, run_scenario
+from pyfc import topology
+
+
+class TestControlLoopBenchmark(TestCase):
+    def test_scenarios(self):
+        roots = topology.SYSFS_ROOT, topology.DEV_ROOT
+        with TemporaryDirectory() as root:
+            args = argparse.Namespace(chips=2, sensors=2, pwms=2, drives=2, ticks=10, alloc_ticks=5, startup_runs=1,
+                                      sampler_workers=2, root=root)
+            for name, scenario in SCENARIOS.items():
+                result = run_scenario(scenario, args)
+                self.assertGreater(result['inputs'], 0, name)
+                self.assertGreater(result['outputs'], 0, name)
+                self.assertGreater(result['syscalls_per_tick']['read'], 0, name)
+                self.assertGreater(result['syscalls_per_tick']['write'], 0, name)
+                self.assertLessEqual(result['tick_us']['p50'], result['tick_us']['max'], name)
+        self.assertEqual(roots, (topology.SYSFS_ROOT, topology.DEV_ROOT))
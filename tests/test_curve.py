@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from pyfc.curve import FanCurve, parse_temps
+
+
+class TestParseTemps(TestCase):
+    def test_parse(self):
+        self.assertEqual([(30, 20), (55, 50), (80, 100)], parse_temps('30, 55 | 50, 80', 20, 100))
+
+    def test_drops_points_below_minimum_speed(self):
+        self.assertEqual([(30, 20), (50, 40), (60, 100)], parse_temps('30, 40 | 10, 50 | 40, 60', 20, 100))
+
+    def test_rejects_decreasing_temperatures(self):
+        with self.assertRaises(ValueError):
+            parse_temps('30, 55 | 50, 45 | 60, 80', 20, 100)
+
+    def test_rejects_decreasing_speeds(self):
+        with self.assertRaises(ValueError):
+            parse_temps('30, 55 | 60, 60 | 50, 80', 20, 100)
+
+    def test_rejects_malformed(self):
+        with self.assertRaises(ValueError):
+            parse_temps('30', 20, 100)
+
+
+class TestFanCurve(TestCase):
+    def setUp(self) -> None:
+        self.config = {'temps': '30, 55 | 50, 80', 'minimumSpeed': '20', 'maximumSpeed': '100'}
+        self.curve = FanCurve.from_config(self.config, 0.1)
+
+    def test_clamps(self):
+        self.assertEqual(51, self.curve(-20))
+        self.assertEqual(51, self.curve(0))
+        self.assertEqual(51, self.curve(30))
+        self.assertEqual(255, self.curve(80))
+        self.assertEqual(255, self.curve(1000))
+
+    def test_fractional_resolution(self):
+        self.assertEqual(128, self.curve(55))
+        self.assertLess(self.curve(54.5), self.curve(54.8))
+        self.assertEqual(round((51 * 24.5 + 127.5 * 0.5) / 25), self.curve(30.5))
+
+    def test_evaluate_many(self):
+        temps = [10, 42.25, 55, 67.5, 120]
+        self.assertEqual([self.curve(t) for t in temps], list(self.curve.evaluate_many(temps)))
+
+    def test_whole_degree_table(self):
+        curve = FanCurve.from_config(self.config, 1.0)
+        self.assertEqual(self.curve(42), curve(42))
+        self.assertEqual(102, len(curve))
+
+    def test_rejects_resolution_not_positive(self):
+        for resolution in ('0', '-0.5'):
+            with self.assertRaises(ValueError):
+                FanCurve.from_config(dict(self.config, curveResolution=resolution))
+
+    def test_from_list(self):
+        curve = FanCurve([10, 20, 30])
+        self.assertEqual(10, curve(-1))
+        self.assertEqual(20, curve(1.2))
+        self.assertEqual(30, curve(3))
@@ -0,0 +1,63 @@
+import subprocess
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyfc.common import DummyOutput
+from pyfc.drivers import DriverRegistry, drivers, load, INPUTS, OUTPUTS, CONTROLLERS
+
+ENTRY_POINTS = """
+[pyfc.outputs]
+dummy = pyfc_test_driver:generate_dummy_output
+"""
+
+DRIVER = """
+from pyfc.common import DummyOutput
+
+
+def generate_dummy_output(device_config):
+    yield DummyOutput()
+"""
+
+
+class TestDrivers(TestCase):
+    def test_builtin_drivers_resolve(self):
+        for kind in (INPUTS, OUTPUTS, CONTROLLERS):
+            for name in drivers.names(kind):
+                self.assertTrue(callable(drivers.get(kind, name)), name)
+
+    def test_lazy_imports(self):
+        script = ('import sys, pyfc.deviceloader\n'
+                  'from pyfc.drivers import drivers\n'
+                  'drivers.get("outputs", "fanPWM")\n'
+                  'print(sorted(m for m in ("requests", "serial", "pyfc.influxoutput", "pyfc.serialoutput", "pyfc.hddtemp") if m in sys.modules))')
+        result = subprocess.run([sys.executable, '-c', script], cwd=Path(__file__).parent.parent, capture_output=True, text=True, check=True)
+        self.assertEqual('[]', result.stdout.strip())
+
+    def test_unknown_driver(self):
+        with self.assertRaises(KeyError):
+            DriverRegistry({}).get(OUTPUTS, 'nonexistent')
+
+    def test_register(self):
+        registry = DriverRegistry({OUTPUTS: {'dummy': 'pyfc.common:DummyOutput'}})
+        self.assertIs(DummyOutput, registry.get(OUTPUTS, 'dummy'))
+        registry.register(OUTPUTS, 'dummy', load('pyfc.common:DummyInput'))
+        self.assertIs(load('pyfc.common:DummyInput'), registry.get(OUTPUTS, 'dummy'))
+
+    def test_entry_point(self):
+        with TemporaryDirectory() as site_dir:
+            dist_info = Path(site_dir).joinpath('pyfc_test_driver-1.0.dist-info')
+            dist_info.mkdir()
+            dist_info.joinpath('METADATA').write_text('Metadata-Version: 2.1\nName: pyfc-test-driver\nVersion: 1.0\n')
+            dist_info.joinpath('entry_points.txt').write_text(ENTRY_POINTS)
+            Path(site_dir).joinpath('pyfc_test_driver.py').write_text(DRIVER)
+            sys.path.insert(0, site_dir)
+            try:
+                registry = DriverRegistry({})
+                self.assertIn('dummy', registry.names(OUTPUTS))
+                outputs = list(registry.get(OUTPUTS, 'dummy')(None))
+                self.assertIsInstance(outputs[0], DummyOutput)
+            finally:
+                sys.path.remove(site_dir)
+                sys.modules.pop('pyfc_test_driver', None)
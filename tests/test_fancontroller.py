@@ -0,0 +1,109 @@
+import threading
+import time
+from pathlib import Path
+from unittest import TestCase
+
+from pyfc.common import DummyInput, DummyOutput, PassthroughController
+from pyfc.fancontroller import FanController
+from pyfc.scheduler import TickGate
+
+
+class SlowController(PassthroughController):
+    def __init__(self, delay: float):
+        super().__init__([DummyInput()], [DummyOutput()])
+        self.delay = delay
+        self.runs = 0
+
+    def run(self):
+        self.runs += 1
+        time.sleep(self.delay)
+        super().run()
+
+
+class BatchingOutput(DummyOutput):
+    def __init__(self):
+        super().__init__()
+        self.flushes = []
+
+    def flush(self):
+        self.flushes.append(self.speed)
+
+
+class TestFanController(TestCase):
+    def _run_for(self, fan_controller: FanController, seconds: float):
+        fan_controller.runnable = True
+        thread = threading.Thread(target=fan_controller.start)
+        thread.start()
+        time.sleep(seconds)
+        fan_controller.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_sync_tick(self):
+        controller = SlowController(0)
+        fan_controller = FanController(Path('unused.pid'), 1, {'test': controller})
+        fan_controller.tick()
+        self.assertEqual(1, controller.runs)
+
+    def test_outputs_flushed_after_apply(self):
+        controller = PassthroughController([DummyInput()], [BatchingOutput()])
+        controller.enable()
+        fan_controller = FanController(Path('unused.pid'), 1, {'test': controller})
+        fan_controller.tick()
+        fan_controller.tick_device(controller)
+        self.assertEqual([0, 0], controller.outputs[0].flushes)
+
+    def test_asyncio_per_device_interval(self):
+        fast = SlowController(0)
+        slow = SlowController(0)
+        fan_controller = FanController(Path('unused.pid'), 1, {'fast': fast, 'slow': slow}, {'fast': 0.02, 'slow': 0.5}, 'asyncio')
+        self._run_for(fan_controller, 0.3)
+
+        self.assertGreaterEqual(fast.runs, 10)
+        self.assertEqual(1, slow.runs)
+        self.assertEqual(0, fan_controller.stats['fast'].overruns)
+        self.assertFalse(fast.outputs[0].enabled, 'Outputs should be disabled after stopping!')
+
+    def test_asyncio_slow_device_does_not_hold_back_others(self):
+        fast = SlowController(0)
+        slow = SlowController(0.2)
+        fan_controller = FanController(Path('unused.pid'), 1, {'fast': fast, 'slow': slow}, {'fast': 0.02, 'slow': 0.05}, 'asyncio')
+        self._run_for(fan_controller, 0.3)
+
+        self.assertGreaterEqual(fast.runs, 10)
+        self.assertGreaterEqual(fan_controller.stats['slow'].overruns, 1)
+        self.assertGreaterEqual(fan_controller.stats['slow'].missed_ticks, fan_controller.stats['slow'].overruns)
+
+
+class TestTickGate(TestCase):
+    def test_exclusive_waits_for_ticks(self):
+        gate = TickGate()
+        events = []
+        ticking = threading.Event()
+        release = threading.Event()
+
+        def tick():
+            ticking.set()
+            release.wait(5)
+            events.append('tick')
+
+        def job():
+            with gate.exclusive():
+                events.append('job')
+
+        ticker = threading.Thread(target=gate.gated(tick))
+        ticker.start()
+        ticking.wait(5)
+        worker = threading.Thread(target=job)
+        worker.start()
+        time.sleep(0.05)
+        # a tick arriving while the job waits queues up behind it.
+        late = threading.Thread(target=gate.gated(lambda: events.append('late tick')))
+        late.start()
+        time.sleep(0.05)
+        self.assertEqual([], events)
+
+        release.set()
+        for thread in (ticker, worker, late):
+            thread.join(5)
+        self.assertEqual(['tick', 'job', 'late tick'], events)
@@ -0,0 +1,102 @@
+import socket
+import threading
+from unittest import TestCase
+
+from pyfc.aggregate import Aggregate
+from pyfc.hddtemp import HDDTemp, HDDTempClient, parse_hddtemp
+from pyfc.sensorregistry import registry
+
+
+def hddtemp_report(drives: int) -> bytes:
+    models = ('2E256-TL2-500B00', 'CT1000MX500SSD1', 'ST8000VN004-2M2101')
+    records = [f'|/dev/sd{chr(97 + (idx % 26))}{idx // 26 or ""}|{models[idx % 3]}|{30 + idx % 3 * 5}|C|' for idx in range(drives)]
+    return ''.join(records).encode('utf-8')
+
+
+class FakeHDDTempDaemon:
+    """
+    Sends the report in small chunks and closes the connection, like hddtemp does.
+    """
+
+    def __init__(self, report: bytes):
+        self.report = report
+        self.connections = 0
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            with connection:
+                for idx in range(0, len(self.report), 100):
+                    connection.sendall(self.report[idx:idx + 100])
+
+    def close(self):
+        if self.server.fileno() == -1:
+            return
+        # closing alone leaves the socket listening while the thread is blocked in accept.
+        self.server.shutdown(socket.SHUT_RDWR)
+        self.server.close()
+        self.thread.join()
+
+
+class TestParseHDDTemp(TestCase):
+    def test_parse(self):
+        data = b'|/dev/sda|2E256-TL2-500B00|41|C||/dev/sdb|WDC WD8003FFBX|SLP|*||/dev/sdc|CT1000MX500SSD1|86|F|'
+        self.assertEqual([('/dev/sda', '2E256-TL2-500B00', 41.0), ('/dev/sdc', 'CT1000MX500SSD1', 30.0)], list(parse_hddtemp(data)))
+
+    def test_parse_empty(self):
+        self.assertEqual([], list(parse_hddtemp(b'')))
+
+
+class TestHDDTemp(TestCase):
+    def setUp(self) -> None:
+        registry.clear()
+        HDDTempClient._clients.clear()
+        self.daemon = FakeHDDTempDaemon(hddtemp_report(160))
+
+    def tearDown(self) -> None:
+        self.daemon.close()
+        HDDTempClient._clients.clear()
+        registry.clear()
+
+    def test_reads_whole_report(self):
+        self.assertGreater(len(self.daemon.report), 4096)
+        client = HDDTempClient('127.0.0.1', self.daemon.port)
+        self.assertEqual(160, len(list(parse_hddtemp(client.read_socket()))))
+
+    def test_one_fetch_per_tick(self):
+        inputs = [
+            HDDTemp('127.0.0.1', self.daemon.port, ('2E256-TL2-500B00',)),
+            HDDTemp('127.0.0.1', self.daemon.port, ('CT1000MX500SSD1',)),
+            HDDTemp('127.0.0.1', self.daemon.port, ('ST8000VN004-2M2101',)),
+        ]
+        self.assertIs(inputs[0].client, inputs[2].client)
+
+        registry.begin_tick()
+        self.assertEqual([30, 35, 40], [i.get_value() for i in inputs])
+        self.assertEqual(1, inputs[0].client.fetches)
+        self.assertEqual(1, self.daemon.connections)
+        self.assertTrue(inputs[0].available)
+
+    def test_unavailable_daemon(self):
+        self.daemon.close()
+        hddtemp = HDDTemp('127.0.0.1', self.daemon.port, ('CT1000MX500SSD1',))
+        self.assertEqual(35, hddtemp.get_value())
+        self.assertFalse(hddtemp.available)
+
+    def test_identical_drives_kept_apart(self):
+        self.daemon.close()
+        self.daemon = FakeHDDTempDaemon(b'|/dev/sda|ST8000VN004-2M2101|30|C||/dev/sdb|ST8000VN004-2M2101|50|C||/dev/sdc|CT1000MX500SSD1|40|C|')
+        hddtemp = HDDTemp('127.0.0.1', self.daemon.port, ('ST8000VN004-2M2101',), aggregate=Aggregate('max'))
+        registry.begin_tick()
+        self.assertEqual(50, hddtemp.get_value())
+        self.assertEqual(['/dev/sda', '/dev/sdb'], hddtemp.drives())
+        self.assertEqual([30.0], list(hddtemp.temps.data['/dev/sda']._filled()))
+        self.assertEqual('CT1000MX500SSD1', hddtemp.client.models['/dev/sdc'])
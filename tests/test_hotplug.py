@@ -0,0 +1,204 @@
+import os
+import threading
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyfc.common import PassthroughController
+from pyfc.drivedevice import from_disk_by_id
+from pyfc.hotplug import Reconciler, scan_signature
+from pyfc.lmsensorsdevice import LMSensorsTempInput, LMSensorsOutput
+from pyfc.sensorregistry import registry
+from pyfc.topology import Topology, reset_topology
+
+from benchmarks.fakesysfs import FakeSysfs
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestReconciler(TestCase):
+    def setUp(self) -> None:
+        registry.clear()
+        self.tmp_dir = TemporaryDirectory()
+        self.sysfs = FakeSysfs(Path(self.tmp_dir.name))
+        self.k10temp = self.sysfs.add_chip('k10temp', {1: 45000}, labels={1: 'Tctl'})
+        self.nct6798 = self.sysfs.add_chip('nct6798', {1: 30000}, pwms=(1,))
+        self.sysfs.add_ata_disk('sda', 'ST8000VN004-2M2101_ZA1')
+        reset_topology(Topology(self.sysfs.sysfs_root, self.sysfs.dev_root))
+
+        self.cpu_temp = LMSensorsTempInput.from_path('k10temp', 'temp1_input')[0]
+        self.board_temp = LMSensorsTempInput.from_path('nct6798', 'temp1_input')[0]
+        self.fan = LMSensorsOutput.from_path('nct6798', 'pwm1', 'pwm1_enable')[0]
+        self.drive = from_disk_by_id('ST8000VN004')[0]
+        self.devices = {
+            'cpu':   PassthroughController([self.cpu_temp, self.board_temp], [self.fan]),
+            'disks': PassthroughController([self.drive], []),
+        }
+        self.clock = FakeClock()
+
+    def tearDown(self) -> None:
+        self.fan.disable()
+        for sensor in list(registry._sensors.values()):
+            sensor.close()
+        registry.clear()
+        reset_topology()
+        self.tmp_dir.cleanup()
+
+    def _reconciler(self, use_inotify=True) -> Reconciler:
+        reconciler = Reconciler(self.devices, 30.0, self.sysfs.sysfs_root, self.sysfs.dev_root, use_inotify, self.clock)
+        self.addCleanup(reconciler.close)
+        return reconciler
+
+    def _renumber(self, class_path: Path, number: int, **hwmon) -> Path:
+        """
+        Drops a hwmon dir and brings it back on the same device under a new number, like a driver reload does.
+        """
+        hwmon_path = class_path.resolve()
+        name = hwmon_path.joinpath('name').read_text().strip()
+        device = hwmon_path.parent.parent
+        self.sysfs.remove_hwmon(int(class_path.name[len('hwmon'):]))
+        return self.sysfs.add_hwmon(name, device, number=number, **hwmon)
+
+    def test_signature(self):
+        hwmon_root = self.sysfs.sysfs_root.joinpath('class', 'hwmon')
+        disk_root = self.sysfs.dev_root.joinpath('disk', 'by-id')
+        signature = scan_signature(hwmon_root, disk_root)
+        self.assertEqual(signature, scan_signature(hwmon_root, disk_root))
+        self._renumber(self.k10temp, 7, temps={1: 50000})
+        self.assertNotEqual(signature, scan_signature(hwmon_root, disk_root))
+
+    def test_renumbered_input(self):
+        reconciler = self._reconciler()
+        if reconciler.inotify is None:
+            self.skipTest('inotify is not available')
+        self.assertAlmostEqual(45.0, self.cpu_temp.get_value())
+        self.assertFalse(reconciler.poll())
+
+        self._renumber(self.k10temp, 7, temps={1: 55000}, labels={1: 'Tctl'})
+
+        # inotify wakes the reconciler up well before the rescan interval.
+        self.assertTrue(reconciler.poll())
+        self.assertEqual(1, reconciler.rebinds)
+        self.assertEqual('hwmon7', self.cpu_temp.path.parent.name)
+        self.assertIs(self.cpu_temp, LMSensorsTempInput.shared(self.cpu_temp.path))
+        self.assertEqual(3, len(registry))
+        self.cpu_temp.temp.clear()
+        self.assertAlmostEqual(55.0, self.cpu_temp.get_value())
+        self.assertEqual('hwmon1', self.board_temp.path.parent.name)
+
+    def test_renumbered_input_on_shared_device(self):
+        reconciler = self._reconciler()
+        # amdgpu style: two chips on one device, both with a temp1_input.
+        gpu = self.sysfs.sysfs_root.joinpath('devices', 'pci0000:00', '0000:00:03.0')
+        self.sysfs.add_hwmon('amdgpu', gpu, {1: 60000})
+        mem = self.sysfs.add_hwmon('amdgpu_mem', gpu, {1: 70000})
+        reset_topology(Topology(self.sysfs.sysfs_root, self.sysfs.dev_root))
+        mem_temp = LMSensorsTempInput.from_path('amdgpu_mem', 'temp1_input')[0]
+        self.devices['gpu'] = PassthroughController([mem_temp], [])
+
+        self._renumber(mem, 8, temps={1: 75000})
+        self.clock.now += 31.0
+
+        self.assertTrue(reconciler.poll())
+        self.assertEqual('hwmon8', mem_temp.path.parent.name)
+        mem_temp.temp.clear()
+        self.assertAlmostEqual(75.0, mem_temp.get_value())
+
+    def test_rescan_fallback(self):
+        reconciler = self._reconciler(use_inotify=False)
+        self._renumber(self.k10temp, 7, temps={1: 55000})
+        self.assertFalse(reconciler.poll())
+        self.clock.now = 31
+        self.assertTrue(reconciler.poll())
+        self.assertEqual('hwmon7', self.cpu_temp.path.parent.name)
+        self.assertIs(self.cpu_temp, LMSensorsTempInput.shared(self.cpu_temp.path))
+        self.clock.now = 62
+        self.assertFalse(reconciler.poll())
+        self.assertEqual(1, reconciler.reconciles)
+
+    def test_missing_until_back(self):
+        reconciler = self._reconciler(use_inotify=False)
+        self.sysfs.remove_hwmon(0)
+        self.clock.now = 31
+        self.assertTrue(reconciler.poll())
+        self.assertEqual(0, reconciler.rebinds)
+        self.assertEqual('hwmon0', self.cpu_temp.path.parent.name)
+
+        self.sysfs.add_hwmon('k10temp', self.sysfs.sysfs_root.joinpath('devices', 'platform', 'k10temp.0'), {1: 48000}, number=3)
+        self.clock.now = 62
+        self.assertTrue(reconciler.poll())
+        self.assertEqual(1, reconciler.rebinds)
+        self.assertAlmostEqual(48.0, self.cpu_temp.get_value())
+
+    def test_renumbered_output(self):
+        reconciler = self._reconciler(use_inotify=False)
+        self.fan.enable()
+        self.fan.set_value(50)
+        self.fan.apply()
+        # pwrite at offset 0 overwrites the start of a regular file instead of replacing it like sysfs does.
+        self.assertTrue(self.nct6798.joinpath('pwm1').read_text().startswith('50'))
+
+        hwmon = self._renumber(self.nct6798, 4, temps={1: 31000}, pwms=(1,))
+        self.clock.now = 31
+        self.assertTrue(reconciler.poll())
+        self.assertEqual(2, reconciler.rebinds)
+        self.assertEqual('1', hwmon.joinpath('pwm1_enable').read_text())
+        self.fan.apply()
+        self.assertTrue(hwmon.joinpath('pwm1').read_text().startswith('50'))
+        self.assertEqual(2, self.fan.writes)
+        self.assertAlmostEqual(31.0, self.board_temp.get_value())
+
+    def test_rebind_waits_for_write(self):
+        reconciler = self._reconciler(use_inotify=False)
+        self.fan.enable()
+        writing, release = threading.Event(), threading.Event()
+        real_pwrite = os.pwrite
+
+        def slow_pwrite(*args):
+            writing.set()
+            release.wait(5)
+            return real_pwrite(*args)
+
+        self.addCleanup(setattr, os, 'pwrite', real_pwrite)
+        os.pwrite = slow_pwrite
+        self.fan.set_value(50)
+        # a device tick of the asyncio scheduler, in parallel with the hotplug service.
+        writer = threading.Thread(target=self.fan.apply)
+        writer.start()
+        self.assertTrue(writing.wait(5))
+
+        hwmon = self._renumber(self.nct6798, 4, temps={1: 31000}, pwms=(1,))
+        self.clock.now = 31
+        rebinder = threading.Thread(target=reconciler.poll)
+        rebinder.start()
+        rebinder.join(0.1)
+        self.assertTrue(rebinder.is_alive(), 'Rebinding must wait for the write in progress!')
+
+        release.set()
+        writer.join(5)
+        rebinder.join(5)
+        self.assertEqual(1, self.fan.writes)
+        self.assertEqual(hwmon.joinpath('pwm1').resolve(), self.fan.real_path)
+        self.fan.apply()
+        self.assertTrue(hwmon.joinpath('pwm1').read_text().startswith('50'))
+
+    def test_swapped_drive(self):
+        reconciler = self._reconciler(use_inotify=False)
+        self.assertAlmostEqual(35.0, self.drive.get_value())
+
+        # the same disk comes back on another port, as sdc.
+        self.sysfs.remove_hwmon(2)
+        self.sysfs.add_ata_disk('sdc', 'ST8000VN004-2M2101_ZA1', 41000, host=2)
+        self.clock.now = 31
+        self.assertTrue(reconciler.poll())
+        self.assertEqual(1, reconciler.rebinds)
+        self.assertEqual('sdc', self.drive.real_path.name)
+        self.assertAlmostEqual(41.0, self.drive.get_value())
+        self.assertEqual('hwmon0', self.cpu_temp.path.parent.name)
+        self.assertTrue(os.path.samefile(self.sysfs.dev_root.joinpath('sdc'), self.drive.device_path))
@@ -0,0 +1,179 @@
+import gzip
+import threading
+import time
+from tempfile import TemporaryDirectory
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from unittest.mock import patch
+
+from pyfc.influxoutput import InfluxBatcher, InfluxLineOutput
+from pyfc.spool import LineSpool
+
+
+class FakeInfluxServer(ThreadingHTTPServer):
+    """
+    Accepts influx line protocol writes, optionally stalling every request until released.
+    """
+    daemon_threads = True
+
+    def __init__(self, stall: bool = False):
+        self.received = []
+        self.requests = 0
+        self.down = False
+        self.release = threading.Event()
+        if not stall:
+            self.release.set()
+        super().__init__(('127.0.0.1', 0), FakeInfluxHandler)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/write'
+
+    def close(self):
+        self.release.set()
+        self.shutdown()
+        self.server_close()
+
+
+class FakeInfluxHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.requests += 1
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.release.wait(5)
+        if self.server.down:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.server.received.extend(body.decode('utf-8').split('\n'))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestInfluxBatcher(TestCase):
+    def setUp(self) -> None:
+        InfluxBatcher._batchers.clear()
+
+    def tearDown(self) -> None:
+        InfluxBatcher._batchers.clear()
+
+    def _wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_flush_on_size(self):
+        server = FakeInfluxServer()
+        output = InfluxLineOutput(server.url, None, 'pyfc', 'cpu temp', {'host': 'test'}, batch_lines=4, max_age=60)
+        output.enable()
+        output.set_value(42)
+        for _ in range(4):
+            output.apply()
+
+        self._wait_for(lambda: len(server.received) == 4)
+        self.assertTrue(server.received[0].startswith('pyfc,host=test cpu_temp=42.0 '))
+        output.disable()
+        server.close()
+
+    def test_flush_on_age(self):
+        server = FakeInfluxServer()
+        output = InfluxLineOutput(server.url, None, 'pyfc', 'cpu', {}, batch_lines=100, max_age=0.05)
+        output.enable()
+        output.apply()
+        self._wait_for(lambda: len(server.received) == 1)
+        output.disable()
+        server.close()
+
+    def test_stalled_server_does_not_block_apply(self):
+        server = FakeInfluxServer(stall=True)
+        output = InfluxLineOutput(server.url, None, 'pyfc', 'cpu', {}, batch_lines=2, max_age=60, queue_lines=10, timeout=10, retries=0)
+        output.enable()
+
+        started = time.monotonic()
+        for _ in range(50):
+            output.apply()
+        self.assertLess(time.monotonic() - started, 0.5, 'apply() should never wait on the network!')
+
+        self._wait_for(lambda: server.requests == 1)
+        self.assertGreaterEqual(output.batcher.dropped_lines, 50 - 10 - 2)
+        self.assertLessEqual(len(output.batcher), 10)
+
+        started = time.monotonic()
+        output.disable()
+        self.assertLess(time.monotonic() - started, 0.5, 'disable() should not wait on the network either!')
+        server.release.set()
+        InfluxBatcher.drain()
+        self.assertIsNone(output.batcher._thread)
+        self.assertEqual(50, len(server.received) + output.batcher.dropped_lines)
+        server.close()
+
+    def test_restart_while_stopping(self):
+        server = FakeInfluxServer(stall=True)
+        output = InfluxLineOutput(server.url, None, 'pyfc', 'cpu', {}, batch_lines=1, max_age=60)
+        output.enable()
+        output.apply()
+        self._wait_for(lambda: server.requests == 1)
+        output.disable()
+        thread = output.batcher._thread
+        # e.g. a reload replacing the output, the thread still sending the last batch just carries on.
+        output.enable()
+        self.assertIs(thread, output.batcher._thread)
+        server.release.set()
+        output.apply()
+        self._wait_for(lambda: len(server.received) == 2)
+        output.disable()
+        InfluxBatcher.drain()
+        self.assertFalse(thread.is_alive())
+        server.close()
+
+    def test_shared_batcher_options(self):
+        with TemporaryDirectory() as spool_dir, patch('pyfc.influxoutput.LineSpool') as line_spool:
+            spool_options = {'directory': spool_dir, 'segment_bytes': 256, 'max_bytes': 1024}
+            first = InfluxLineOutput('http://127.0.0.1:1/write', None, 'pyfc', 'cpu', {}, batch_lines=5, spool_options=spool_options)
+            second = InfluxLineOutput('http://127.0.0.1:1/write', None, 'pyfc', 'gpu', {}, batch_lines=5, spool_options=spool_options)
+            self.assertIs(first.batcher, second.batcher)
+            line_spool.assert_called_once_with(**spool_options)
+            with self.assertLogs('pyfc.influxoutput', 'WARNING'):
+                InfluxLineOutput('http://127.0.0.1:1/write', None, 'pyfc', 'case', {}, batch_lines=50, spool_options=spool_options)
+
+    def test_unreachable_server_retries_then_drops(self):
+        server = FakeInfluxServer()
+        url = server.url
+        server.close()
+        batcher = InfluxBatcher(url, None, retries=2, backoff=0.01, timeout=0.5)
+        self.assertFalse(batcher.ship(['pyfc cpu=1 1']))
+        self.assertEqual(1, batcher.failed_batches)
+
+    def test_spool_during_outage_and_replay(self):
+        server = FakeInfluxServer()
+        server.down = True
+        with TemporaryDirectory() as spool_dir:
+            spool = LineSpool(spool_dir, segment_bytes=256)
+            output = InfluxLineOutput(server.url, None, 'pyfc', 'cpu', {}, batch_lines=5, max_age=60, retries=1, backoff=0.01,
+                                      spool=spool, replay_lines=20, replay_rate=1 << 20)
+            output.enable()
+            for idx in range(40):
+                output.set_value(idx)
+                output.apply()
+
+            self._wait_for(lambda: output.batcher.spooled_lines == 40)
+            self.assertEqual([], server.received)
+            self.assertFalse(output.batcher.reachable)
+
+            server.down = False
+            for _ in range(5):
+                output.apply()
+            # the counters are updated once the server has answered, so wait for them too.
+            self._wait_for(lambda: len(server.received) == 45 and output.batcher.replayed_lines == 40 and not spool)
+            self.assertEqual(45, len(server.received))
+            self.assertEqual(40, output.batcher.replayed_lines)
+            self.assertFalse(spool)
+            output.disable()
+        server.close()
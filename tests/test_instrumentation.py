@@ -0,0 +1,121 @@
+import json
+import os
+import signal
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyfc.common import DummyInput, DummyOutput
+from pyfc.fancontroller import FanController
+from pyfc.instrumentation import Histogram, Instrumentation, format_stats, main
+from pyfc.temperaturecontroller import TemperatureController
+
+CURVE = [128] * 110
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 0.0003
+        return self.now
+
+
+class FailingInput(DummyInput):
+    def __init__(self):
+        super().__init__()
+        self.failing = False
+
+    def get_value(self):
+        self.failing = not self.failing
+        return super().get_value()
+
+
+class BrokenInput(DummyInput):
+    def get_value(self):
+        raise IOError('gone')
+
+
+class TestHistogram(TestCase):
+    def test_buckets(self):
+        histogram = Histogram((0.001, 0.01, 0.1))
+        for value in (0.0005, 0.001, 0.005, 0.05, 0.5):
+            histogram.record(value)
+        self.assertEqual([2, 1, 1, 1], list(histogram.counts))
+        self.assertEqual(5, histogram.count)
+        self.assertAlmostEqual(0.5565, histogram.total)
+        self.assertEqual(0.001, histogram.quantile(0.4))
+        self.assertEqual(0.01, histogram.quantile(0.5))
+        self.assertEqual(0.5, histogram.quantile(0.99))
+        self.assertEqual(0.0, Histogram().quantile(0.5))
+
+
+class TestInstrumentation(TestCase):
+    def setUp(self) -> None:
+        self.shared = DummyInput()
+        self.flaky = FailingInput()
+        self.output = DummyOutput()
+        self.devices = {
+            'cpu':  TemperatureController([self.shared, self.flaky], [self.output], CURVE),
+            'case': TemperatureController([self.shared], [DummyOutput()], CURVE),
+        }
+        self.fan_controller = FanController(Path('unused.pid'), 1, self.devices, instrumentation=Instrumentation(clock=FakeClock()))
+        self.instrumentation = self.fan_controller.instrumentation
+        self.instrumentation.instrument(self.fan_controller)
+
+    def _operation(self, kind, source):
+        for (source_id, _), stats in self.instrumentation.operations.items():
+            if stats.kind == kind and source_id == id(source):
+                return stats
+        raise KeyError(kind)
+
+    def test_counts(self):
+        for _ in range(4):
+            self.fan_controller.tick()
+
+        self.assertEqual(4, self._operation('tick', self.fan_controller).latency.count)
+        self.assertEqual(4, self._operation('run', self.devices['cpu']).latency.count)
+        shared = self._operation('input', self.shared)
+        self.assertEqual(['cpu', 'case'], shared.devices)
+        self.assertEqual(8, shared.latency.count)
+        self.assertEqual(0, shared.errors)
+        self.assertEqual(2, self._operation('input', self.flaky).errors)
+        self.assertEqual(4, self._operation('output', self.output).latency.count)
+        self.assertAlmostEqual(0.0003, self._operation('output', self.output).latency.max)
+
+    def test_exceptions(self):
+        broken = BrokenInput()
+        self.devices['broken'] = TemperatureController([broken], [], CURVE)
+        self.instrumentation.instrument(self.fan_controller)
+        with self.assertRaises(IOError):
+            broken.get_value()
+        self.assertEqual(1, self._operation('input', broken).errors)
+        self.assertEqual(1, self._operation('input', broken).latency.count)
+
+    def test_uninstrument(self):
+        self.instrumentation.uninstrument()
+        self.assertNotIn('get_value', vars(self.shared))
+        self.assertNotIn('tick', vars(self.fan_controller))
+        self.fan_controller.tick()
+        self.assertEqual({}, self.instrumentation.operations)
+
+    def test_dump_on_signal(self):
+        self.fan_controller.tick()
+        previous = signal.getsignal(signal.SIGUSR1)
+        with TemporaryDirectory() as tmp_dir:
+            stats_file = Path(tmp_dir).joinpath('run', 'stats.json')
+            try:
+                self.instrumentation.dump_on_signal(stats_file)
+                os.kill(os.getpid(), signal.SIGUSR1)
+            finally:
+                signal.signal(signal.SIGUSR1, previous)
+
+            with stats_file.open() as reader:
+                stats = json.load(reader)
+            self.assertEqual(os.getpid(), stats['pid'])
+            self.assertEqual({'tick', 'run', 'input', 'output'}, {o['kind'] for o in stats['operations']})
+            self.assertEqual(len(self.instrumentation.operations), len(stats['operations']))
+            # header, both ticks, the run of case, the shared input and its output.
+            self.assertEqual(6, len(format_stats(stats, 'case')))
+            self.assertEqual(0, main(['--no-signal', '--stats-file', str(stats_file)]))
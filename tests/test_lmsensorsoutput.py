@@ -0,0 +1,77 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyfc.lmsensorsdevice import LMSensorsOutput
+
+
+class TestLMSensorsOutput(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.hwmon_path = Path(self.tmp_dir.name)
+        self.hwmon_path.joinpath('pwm1').write_text('0\n')
+        self.hwmon_path.joinpath('pwm1_enable').write_text('2\n')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _output(self, refresh_interval=None):
+        output = LMSensorsOutput(self.hwmon_path, 'pwm1', 'pwm1_enable', refresh_interval)
+        output.enable()
+        return output
+
+    def test_enable_disable(self):
+        output = self._output()
+        self.assertTrue(output.enabled)
+        self.assertEqual('1', self.hwmon_path.joinpath('pwm1_enable').read_text())
+        output.disable()
+        self.assertFalse(output.enabled)
+        self.assertEqual('2', self.hwmon_path.joinpath('pwm1_enable').read_text())
+
+    def test_disable_without_enable(self):
+        self.hwmon_path.joinpath('pwm1_enable').write_text('5')
+        output = LMSensorsOutput(self.hwmon_path, 'pwm1', 'pwm1_enable')
+        output.disable()
+        del output
+        self.assertEqual('5', self.hwmon_path.joinpath('pwm1_enable').read_text())
+
+    def test_unchanged_speed_is_not_rewritten(self):
+        output = self._output()
+        output.set_value(128)
+        for _ in range(10):
+            output.apply()
+        self.assertEqual(1, output.writes)
+        self.assertEqual(9, output.writes_skipped)
+        self.assertEqual(128, output.committed)
+        self.assertTrue(self.hwmon_path.joinpath('pwm1').read_text().startswith('128'))
+        output.disable()
+
+    def test_changed_speed_is_written(self):
+        output = self._output()
+        output.set_value(100)
+        output.apply()
+        output.values.update(200)
+        output.values.update(200)
+        output.apply()
+        self.assertEqual(2, output.writes)
+        self.assertEqual(round(output.values.mean()), output.committed)
+        output.disable()
+
+    def test_refresh_interval(self):
+        output = self._output(refresh_interval=0.0)
+        output.set_value(128)
+        output.apply()
+        output.apply()
+        self.assertEqual(2, output.writes)
+        self.assertEqual(0, output.writes_skipped)
+        output.disable()
+
+    def test_reenable_forces_write(self):
+        output = self._output()
+        output.set_value(128)
+        output.apply()
+        output.disable()
+        output.enable()
+        output.apply()
+        self.assertEqual(2, output.writes)
+        output.disable()
@@ -0,0 +1,50 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyfc.lmsensorsdevice import LMSensorsTempInput
+from pyfc.sensorregistry import registry
+
+
+class TestLMSensorsTempInput(TestCase):
+    def setUp(self) -> None:
+        registry.clear()
+        self.tmp_dir = TemporaryDirectory()
+        self.sensor_path = Path(self.tmp_dir.name).joinpath('temp1_input')
+        self.sensor_path.write_text('45000\n')
+        Path(self.tmp_dir.name).joinpath('temp1_label').write_text('Tctl\n')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_label(self):
+        sensor = LMSensorsTempInput(self.sensor_path)
+        self.assertEqual('Tctl', sensor.name)
+
+    def test_persistent_read(self):
+        sensor = LMSensorsTempInput(self.sensor_path)
+        self.assertAlmostEqual(45.0, sensor.get_value())
+        fd = sensor._fd
+        self.assertIsNotNone(fd)
+
+        self.sensor_path.write_text('55500\n')
+        sensor.get_value()
+        self.assertEqual(fd, sensor._fd, 'Descriptor should be reused between reads!')
+        self.assertAlmostEqual(55.5, sensor.temp.last())
+        sensor.close()
+
+    def test_stale_descriptor_reopens(self):
+        sensor = LMSensorsTempInput(self.sensor_path)
+        sensor.get_value()
+        # simulate the driver going away underneath an open descriptor.
+        os.close(sensor._fd)
+        self.sensor_path.write_text('60000\n')
+        sensor.get_value()
+        self.assertAlmostEqual(60.0, sensor.temp.last())
+        sensor.close()
+
+    def test_non_persistent_read(self):
+        sensor = LMSensorsTempInput(self.sensor_path, persistent=False)
+        self.assertAlmostEqual(45.0, sensor.get_value())
+        self.assertIsNone(sensor._fd)
@@ -0,0 +1,146 @@
+import random
+from configparser import ConfigParser
+from unittest import TestCase
+
+from pyfc.common import DummyInput, DummyOutput, lerp
+from pyfc.curve import FanCurve
+from pyfc.pidcontroller import PIDController, generate_pid_controller
+from pyfc.temperaturecontroller import TemperatureController
+
+
+class ThermalPlant:
+    """
+    A heat source cooled by a fan, seen through a lagging, noisy sensor.
+    """
+
+    def __init__(self, seed=1):
+        self.temp = 40.0
+        self.sensor = 40.0
+        self.random = random.Random(seed)
+
+    def reading(self) -> float:
+        return self.sensor + self.random.uniform(-0.25, 0.25)
+
+    def step(self, load: float, fan_percent: float, dt: float):
+        conductance = 1.0 + 4.0 * fan_percent / 100
+        self.temp += (load - conductance * (self.temp - 25)) / 200 * dt
+        self.sensor += (self.temp - self.sensor) / 5 * dt
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def simulate(make_controller, seconds=1800, load_step_at=300, jitter=0.0, seed=1):
+    """
+    Steps the load from 30W to 110W and records the sensor temperature and every change of the applied PWM value.
+    """
+    plant = ThermalPlant(seed)
+    clock = Clock()
+    dummy_input, dummy_output = DummyInput(), DummyOutput()
+    controller = make_controller(dummy_input, dummy_output, clock)
+    controller.enable()
+    timing = random.Random(seed + 1)
+
+    temps, pwm_changes, last_speed = [], 0, None
+    while clock.now < seconds:
+        dt = 1.0 + timing.uniform(-jitter, jitter)
+        dummy_input.set_value(plant.reading())
+        controller.run()
+        dummy_output.apply()
+        if dummy_output.speed != last_speed:
+            pwm_changes += 1
+            last_speed = dummy_output.speed
+        plant.step(30 if clock.now < load_step_at else 110, lerp(dummy_output.speed, 0, 255, 0, 100), dt)
+        clock.now += dt
+        temps.append((clock.now, plant.sensor))
+
+    return temps, pwm_changes
+
+
+def settling_time(temps, load_step_at=300, band=1.0):
+    """
+    Time from the load step until the temperature stays within band of where it ends up.
+    """
+    final = sum(t for _, t in temps[-60:]) / 60
+    settled_at = load_step_at
+    for now, temp in temps:
+        if now > load_step_at and abs(temp - final) > band:
+            settled_at = now
+    return settled_at - load_step_at, final
+
+
+class TestPIDController(TestCase):
+    def setUp(self) -> None:
+        self.curve = FanCurve.from_config({'temps': '45, 52 | 50, 54', 'minimumSpeed': 20, 'maximumSpeed': 100})
+
+    def _curve_controller(self, dummy_input, dummy_output, clock):
+        return TemperatureController([dummy_input], [dummy_output], self.curve)
+
+    @staticmethod
+    def _pid_controller(dummy_input, dummy_output, clock):
+        return PIDController([dummy_input], [dummy_output], 50, minimum_speed=20, maximum_speed=100, clock=clock)
+
+    def test_holds_target(self):
+        temps, _ = simulate(self._pid_controller)
+        _, final = settling_time(temps)
+        self.assertAlmostEqual(50, final, delta=0.5)
+
+    def test_against_curve(self):
+        curve_temps, curve_changes = simulate(self._curve_controller)
+        pid_temps, pid_changes = simulate(self._pid_controller)
+        curve_settling, _ = settling_time(curve_temps)
+        pid_settling, _ = settling_time(pid_temps)
+
+        self.assertLess(pid_settling, curve_settling)
+        self.assertLess(pid_changes * 2, curve_changes)
+
+    def test_irregular_ticks(self):
+        regular_temps, _ = simulate(self._pid_controller)
+        irregular_temps, _ = simulate(self._pid_controller, jitter=0.5)
+        regular_settling, _ = settling_time(regular_temps)
+        irregular_settling, final = settling_time(irregular_temps)
+
+        self.assertAlmostEqual(50, final, delta=0.5)
+        self.assertAlmostEqual(regular_settling, irregular_settling, delta=regular_settling * 0.25)
+
+    def test_anti_windup(self):
+        clock = Clock()
+        controller = PIDController([DummyInput()], [DummyOutput()], 50, minimum_speed=20, maximum_speed=100, clock=clock)
+        # an unreachable target for a long time must not wind the integrator up past the maximum.
+        for _ in range(600):
+            clock.now += 1
+            self.assertEqual(100, controller.update(70))
+        self.assertLessEqual(controller.integral, 100)
+
+        for _ in range(30):
+            clock.now += 1
+            controller.update(45)
+        self.assertLess(controller.output, 100, 'Output should come off the maximum right after the load drops!')
+
+    def test_stalled_tick_is_bounded(self):
+        clock = Clock()
+        controller = PIDController([DummyInput()], [DummyOutput()], 50, kp=0, kd=0, ki=1, max_dt=10, clock=clock)
+        controller.update(51)
+        clock.now += 3600
+        controller.update(51)
+        self.assertAlmostEqual(20 + 10, controller.integral)
+
+    def test_run_sets_outputs(self):
+        dummy_input, dummy_output = DummyInput(), DummyOutput()
+        controller = PIDController([dummy_input], [dummy_output], 50, minimum_speed=20, maximum_speed=100, clock=Clock())
+        controller.enable()
+        dummy_input.set_value(90)
+        controller.run()
+        dummy_output.apply()
+        self.assertEqual(255, dummy_output.speed)
+
+    def test_section_without_target(self):
+        config = ConfigParser()
+        config.read_string('[cpu]\ncontrollerType = pid\nminimumSpeed = 20\nmaximumSpeed = 100\n')
+        with self.assertRaisesRegex(ValueError, 'targetTemperature'):
+            generate_pid_controller(config['cpu'], [DummyInput()], [DummyOutput()])
@@ -0,0 +1,145 @@
+import configparser
+import gc
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from pyfc.deviceloader import create_device
+from pyfc.drivedevice import ATADrive, NVMeDrive
+from pyfc.lmsensorsdevice import LMSensorsTempInput, LMSensorsOutput
+from pyfc.plan import create_devices, plan_key
+from pyfc.sensorregistry import registry
+from pyfc.topology import Topology, reset_topology
+
+from benchmarks.fakesysfs import FakeSysfs
+
+CONFIG = """
+[DEFAULT]
+minimumSpeed = 20
+maximumSpeed = 100
+temps = 30, 55 | 50, 80
+inputType = componentTemp
+outputType = fanPWM
+
+[base]
+devices = cpu, disks
+
+[cpu]
+temperatureMonitorDeviceName = k10temp
+temperatureMonitor = temp1_input
+outputDeviceName = nct6798
+device = pwm1
+outputEnabler = pwm1_enable
+
+[disks]
+inputType = driveDevice
+diskIDs = ST8000VN004, Samsung_SSD
+outputDeviceName = nct6798
+device = pwm2
+outputEnabler = pwm2_enable
+controllerType = pid
+targetTemperature = 40
+"""
+
+
+class TestPlan(TestCase):
+    def setUp(self) -> None:
+        registry.clear()
+        self.tmp_dir = TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+        self.sysfs = FakeSysfs(self.root)
+        self.sysfs.add_chip('k10temp', {1: 45000}, labels={1: 'Tctl'})
+        self.sysfs.add_chip('nct6798', {1: 30000}, pwms=(1, 2))
+        self.sysfs.add_ata_disk('sda', 'ST8000VN004-2M2101_ZA1')
+        self.sysfs.add_nvme_disk(0, 'Samsung_SSD_980_PRO_1TB_S5GX')
+
+        self.config_path = self.root.joinpath('settings.ini')
+        self.config_path.write_text(CONFIG)
+        self.boot_id_path = self.root.joinpath('boot_id')
+        self.boot_id_path.write_text('8a2c4f6e-0000-4000-8000-000000000001\n')
+        self.cache_path = self.root.joinpath('cache', 'plan.json')
+
+    def tearDown(self) -> None:
+        # controllers hand their fans back on garbage collection, which has to happen while the tree still exists.
+        gc.collect()
+        for sensor in list(registry._sensors.values()):
+            sensor.close()
+        registry.clear()
+        reset_topology()
+        self.tmp_dir.cleanup()
+
+    def _create(self):
+        config = configparser.ConfigParser(converters={'list': lambda x: [i.strip() for i in x.split(',')]})
+        config.read(self.config_path)
+        registry.clear()
+        reset_topology(Topology(self.sysfs.sysfs_root, self.sysfs.dev_root))
+        return create_devices(config, ['cpu', 'disks'], self.config_path, self.cache_path, self.sysfs.sysfs_root, self.boot_id_path)
+
+    def _key(self):
+        return plan_key(self.config_path, self.sysfs.sysfs_root, self.boot_id_path)
+
+    def _assert_devices(self, devices):
+        cpu, disks = devices['cpu'], devices['disks']
+        self.assertEqual(['Tctl'], [i.name for i in cpu.inputs])
+        self.assertIsInstance(cpu.inputs[0], LMSensorsTempInput)
+        self.assertEqual([LMSensorsOutput], [type(o) for o in cpu.outputs])
+        self.assertEqual(255, cpu.speeds(80))
+        self.assertEqual({ATADrive, NVMeDrive}, {type(i) for i in disks.inputs})
+        self.assertEqual([35.0, 40.0], sorted(i.get_value() for i in disks.inputs))
+        self.assertEqual('pwm2', disks.outputs[0].output_file.name)
+        self.assertEqual(40, disks.target)
+        self.assertTrue(all(d.valid() for d in devices.values()))
+
+    def test_cold_then_warm_start(self):
+        cold = self._create()
+        self._assert_devices(cold)
+        with self.cache_path.open() as reader:
+            plan = json.load(reader)
+        self.assertEqual(self._key(), plan['key'])
+
+        with patch('pyfc.plan.create_device', wraps=create_device) as factory, \
+                patch('pyfc.lmsensorsdevice.get_topology', side_effect=AssertionError('discovery on warm start')), \
+                patch('pyfc.drivedevice.get_topology', side_effect=AssertionError('discovery on warm start')):
+            warm = self._create()
+            for call in factory.call_args_list:
+                self.assertIsNotNone(call.args[2])
+                self.assertIsNotNone(call.args[3])
+        self._assert_devices(warm)
+        self.assertEqual(cold['cpu'].speeds, warm['cpu'].speeds)
+
+    def test_key_changes(self):
+        key = self._key()
+        self.boot_id_path.write_text('8a2c4f6e-0000-4000-8000-000000000002\n')
+        self.assertNotEqual(key, self._key())
+        key = self._key()
+        self.config_path.write_text(CONFIG.replace('targetTemperature = 40', 'targetTemperature = 42'))
+        self.assertNotEqual(key, self._key())
+        key = self._key()
+        self.sysfs.add_chip('amdgpu', {1: 50000})
+        self.assertNotEqual(key, self._key())
+
+    def test_rebuild_on_boot_change(self):
+        self._create()
+        self.boot_id_path.write_text('8a2c4f6e-0000-4000-8000-000000000002\n')
+        with patch('pyfc.plan.build_device') as build_device:
+            self._assert_devices(self._create())
+            build_device.assert_not_called()
+        with self.cache_path.open() as reader:
+            self.assertEqual(self._key(), json.load(reader)['key'])
+
+    def test_rebuild_on_missing_path(self):
+        self._create()
+        nct6798 = Topology(self.sysfs.sysfs_root, self.sysfs.dev_root).hwmon_named('nct6798')[0]
+        nct6798.path.joinpath('pwm2_enable').unlink()
+        with patch('pyfc.plan.build_device') as build_device:
+            self._create()
+            build_device.assert_not_called()
+        with self.cache_path.open() as reader:
+            self.assertEqual(self._key(), json.load(reader)['key'])
+
+    def test_corrupt_plan(self):
+        self.cache_path.parent.mkdir()
+        self.cache_path.write_text('{"version": 1, "key": ')
+        self._assert_devices(self._create())
@@ -0,0 +1,111 @@
+import gc
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from urllib.request import urlopen
+
+from pyfc.fancontroller import FanController
+from pyfc.lmsensorsdevice import LMSensorsOutput, LMSensorsTempInput
+from pyfc.prometheus import PrometheusExporter, escape_label, parse_listen
+from pyfc.sampler import ConcurrentSampler
+from pyfc.temperaturecontroller import TemperatureController
+
+
+class CountingInput(LMSensorsTempInput):
+    reads = 0
+
+    def get_value(self) -> float:
+        CountingInput.reads += 1
+        return super().get_value()
+
+
+class TestPrometheusExporter(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.hwmon_path = Path(self.tmp_dir.name)
+        self.hwmon_path.joinpath('temp1_input').write_text('45000\n')
+        self.hwmon_path.joinpath('pwm1').write_text('0\n')
+        self.hwmon_path.joinpath('pwm1_enable').write_text('2\n')
+        self.input = CountingInput(self.hwmon_path.joinpath('temp1_input'), label='Tctl')
+        self.output = LMSensorsOutput(self.hwmon_path, 'pwm1', 'pwm1_enable')
+        self.fan_controller = FanController(Path('unused.pid'), 1, {'cpu': TemperatureController([self.input], [self.output], [100] * 110)})
+
+    def tearDown(self) -> None:
+        # the controller disables its outputs once collected, which needs the files still there.
+        del self.fan_controller, self.input, self.output
+        gc.collect()
+        self.tmp_dir.cleanup()
+
+    def _tick(self, exporter: PrometheusExporter):
+        self.output.enable()
+        exporter.bind(self.fan_controller)
+        self.fan_controller.tick()
+        exporter.update()
+
+    def test_snapshot(self):
+        exporter = PrometheusExporter()
+        self._tick(exporter)
+        text = exporter.snapshot.decode()
+        labels = f'controller="cpu",input="Tctl",source="{self.hwmon_path.joinpath("temp1_input")}"'
+        self.assertIn(f'pyfc_temperature_celsius{{{labels}}} 45.0\n', text)
+        self.assertIn(f'pyfc_input_read_errors_total{{{labels}}} 0\n', text)
+        self.assertIn(f'pyfc_output_pwm{{controller="cpu",output="pwm1",source="{self.hwmon_path.joinpath("pwm1")}"}} 100\n', text)
+        self.assertIn('# TYPE pyfc_output_writes_total counter\n', text)
+        self.assertNotIn('pyfc_input_read_timeouts_total', text)
+
+        reads = CountingInput.reads
+        self.hwmon_path.joinpath('temp1_input').write_text('garbage')
+        self.assertIn(f'pyfc_temperature_celsius{{{labels}}} 45.0\n', exporter.render().decode())
+        self.assertEqual(reads, CountingInput.reads, 'Rendering must not read sensors')
+
+        self.fan_controller.tick()
+        exporter.update()
+        self.assertIn(f'pyfc_input_read_errors_total{{{labels}}} 1\n', exporter.snapshot.decode())
+        self.assertIn(f'pyfc_input_failing{{{labels}}} 1\n', exporter.snapshot.decode())
+
+    def test_sampler_timeouts(self):
+        sampler = ConcurrentSampler(1, 0.5)
+        try:
+            self.fan_controller = FanController(Path('unused.pid'), 1, self.fan_controller.devices, sampler=sampler)
+            exporter = PrometheusExporter()
+            self._tick(exporter)
+            self.assertIn('pyfc_input_read_timeouts_total{controller="cpu",input="Tctl"', exporter.snapshot.decode())
+            self.assertIn('pyfc_temperature_celsius{controller="cpu",input="Tctl"', exporter.snapshot.decode())
+        finally:
+            sampler.shutdown()
+
+    def test_http(self):
+        exporter = PrometheusExporter(('127.0.0.1', 0))
+        exporter.start(self.fan_controller)
+        try:
+            self.fan_controller.tick()
+            exporter.update()
+            with urlopen(f'http://127.0.0.1:{exporter.address[1]}/metrics', timeout=5) as response:
+                self.assertEqual(exporter.snapshot, response.read())
+                self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+        finally:
+            exporter.stop()
+
+    def test_textfile(self):
+        now = [0.0]
+        textfile = self.hwmon_path.joinpath('pyfc.prom')
+        exporter = PrometheusExporter(textfile=textfile, textfile_interval=10, clock=lambda: now[0])
+        self._tick(exporter)
+        self.assertEqual(exporter.snapshot, textfile.read_bytes())
+        first = exporter.snapshot
+
+        now[0] = 5
+        self.fan_controller.tick()
+        exporter.update()
+        self.assertEqual(first, textfile.read_bytes())
+        now[0] = 10
+        exporter.update()
+        self.assertEqual(exporter.snapshot, textfile.read_bytes())
+
+        exporter.stop()
+        self.assertFalse(textfile.exists())
+
+    def test_helpers(self):
+        self.assertEqual(('127.0.0.1', 9789), parse_listen('9789'))
+        self.assertEqual(('::1', 9789), parse_listen('[::1]:9789'))
+        self.assertEqual('a\\"b\\\\c\\n', escape_label('a"b\\c\n'))
@@ -0,0 +1,195 @@
+import gc
+import json
+import threading
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyfc.deviceloader import create_device
+from pyfc.fancontroller import FanController
+from pyfc.reload import ConfigDiff, Reloader, read_config, snapshot
+from pyfc.sensorregistry import registry
+from pyfc.topology import Topology, reset_topology
+
+from benchmarks.fakesysfs import FakeSysfs
+
+CONFIG = """
+[DEFAULT]
+minimumSpeed = 20
+maximumSpeed = 100
+temps = 30, 55 | 50, 80
+inputType = componentTemp
+outputType = fanPWM
+controllerType = temperature
+temperatureMonitor = temp1_input
+outputDeviceName = nct6798
+
+[base]
+pid_file = unused.pid
+devices = {devices}
+interval = 1
+
+[cpu]
+temperatureMonitorDeviceName = k10temp
+device = {cpu_pwm}
+outputEnabler = {cpu_pwm}_enable
+{cpu_extra}
+
+[case]
+temperatureMonitorDeviceName = nct6798
+device = pwm2
+outputEnabler = pwm2_enable
+interval = 0.02
+
+[gpu]
+temperatureMonitorDeviceName = nct6798
+device = pwm2
+outputEnabler = pwm2_enable
+temps = 30, 40 | 60, 100
+interval = 0.02
+"""
+
+
+class TestReloader(TestCase):
+    def setUp(self) -> None:
+        registry.clear()
+        self.tmp_dir = TemporaryDirectory()
+        self.sysfs = FakeSysfs(Path(self.tmp_dir.name))
+        self.sysfs.add_chip('k10temp', {1: 45000}, labels={1: 'Tctl'})
+        self.nct6798 = self.sysfs.add_chip('nct6798', {1: 30000}, pwms=(1, 2, 3))
+        reset_topology(Topology(self.sysfs.sysfs_root, self.sysfs.dev_root))
+
+        self.config_path = Path(self.tmp_dir.name).joinpath('settings.ini')
+        self.status_file = Path(self.tmp_dir.name).joinpath('run', 'reload.json')
+        config = self._write_config()
+        devices = {name: create_device(name, config[name]) for name in ('cpu', 'case')}
+        self.reloader = Reloader(self.config_path, config, self.status_file)
+        self.fan_controller = FanController(Path('unused.pid'), 1, devices, {'case': 0.02}, reloader=self.reloader)
+        for device in devices.values():
+            device.enable()
+
+    def tearDown(self) -> None:
+        for device in self.fan_controller.devices.values():
+            device.disable()
+        del self.fan_controller, self.reloader
+        gc.collect()
+        for sensor in list(registry._sensors.values()):
+            sensor.close()
+        registry.clear()
+        reset_topology()
+        self.tmp_dir.cleanup()
+
+    def _write_config(self, devices='cpu, case', cpu_pwm='pwm1', cpu_extra=''):
+        self.config_path.write_text(CONFIG.format(devices=devices, cpu_pwm=cpu_pwm, cpu_extra=cpu_extra))
+        return read_config(self.config_path)
+
+    def _enable_file(self, pwm: str) -> str:
+        return self.nct6798.joinpath(f'{pwm}_enable').read_text()
+
+    def _reload(self, **config) -> dict:
+        self._write_config(**config)
+        self.reloader.request()
+        self.fan_controller.tick()
+        return self.reloader.last_result
+
+    def test_diff(self):
+        old = snapshot(self._write_config())
+        new = snapshot(self._write_config('cpu, gpu', 'pwm3', 'temps = 30, 60\noutputSlewUp = 10'))
+        diff = ConfigDiff(old, new)
+        self.assertEqual(['gpu'], diff.added)
+        self.assertEqual(['case'], diff.removed)
+        self.assertEqual({'cpu': {'curve', 'outputs', 'shaping'}}, diff.changed)
+        self.assertEqual([], diff.restart)
+        self.assertFalse(ConfigDiff(old, old))
+
+    def test_curve_is_swapped_in_place(self):
+        self.fan_controller.tick()
+        cpu = self.fan_controller.devices['cpu']
+        output, sensor = cpu.outputs[0], cpu.inputs[0]
+        history = len(sensor.temp)
+
+        result = self._reload(cpu_extra='temps = 30, 60')
+        self.assertEqual({'cpu': ['curve']}, result['changed'])
+        self.assertIs(cpu, self.fan_controller.devices['cpu'])
+        self.assertIs(output, cpu.outputs[0])
+        self.assertIs(sensor, cpu.inputs[0])
+        self.assertEqual(history + 1, len(sensor.temp))
+        self.assertEqual(153, cpu.speeds(45))
+        self.assertEqual('1', self._enable_file('pwm1'))
+        self.assertEqual(result, json.loads(self.status_file.read_text()))
+
+    def test_outputs_are_kept_or_handed_back(self):
+        case_output = self.fan_controller.devices['case'].outputs[0]
+        result = self._reload(devices='cpu, gpu', cpu_pwm='pwm3')
+        self.assertEqual(['gpu'], result['added'])
+        self.assertEqual(['case'], result['removed'])
+        self.assertEqual({'cpu': ['outputs']}, result['changed'])
+
+        # pwm1 isn't configured anymore, pwm2 moved from case to gpu without ever leaving manual mode.
+        self.assertEqual('2', self._enable_file('pwm1'))
+        self.assertEqual('1', self._enable_file('pwm2'))
+        self.assertEqual('1', self._enable_file('pwm3'))
+        self.assertIs(case_output, self.fan_controller.devices['gpu'].outputs[0])
+        self.assertEqual('2', case_output.old_value)
+        self.assertEqual(0.02, self.fan_controller.intervals['gpu'])
+
+        gc.collect()
+        self.assertEqual('1', self._enable_file('pwm2'))
+
+    def test_topology_is_rescanned(self):
+        # a chip whose driver got loaded after the daemon started.
+        it8686 = self.sysfs.add_chip('it8686', {1: 50000}, pwms=(1,))
+        result = self._reload(cpu_extra='outputDeviceName = it8686')
+        self.assertEqual({}, result['errors'])
+        self.assertEqual({'cpu': ['outputs']}, result['changed'])
+        self.assertEqual('1', it8686.joinpath('pwm1_enable').read_text())
+        self.assertEqual('2', self._enable_file('pwm1'))
+
+    def test_adaptive_interval(self):
+        cpu = self.fan_controller.devices['cpu']
+        result = self._reload(cpu_extra='adaptiveInterval = yes\nadaptiveMaximumInterval = 20')
+        self.assertEqual({'cpu': ['interval']}, result['changed'])
+        self.assertIs(cpu, self.fan_controller.devices['cpu'])
+        self.assertEqual(20, self.fan_controller.adaptive['cpu'].maximum)
+
+        result = self._reload()
+        self.assertEqual({'cpu': ['interval']}, result['changed'])
+        self.assertNotIn('cpu', self.fan_controller.adaptive)
+
+    def test_failed_section_is_kept_and_retried(self):
+        cpu = self.fan_controller.devices['cpu']
+        result = self._reload(cpu_extra='temps = 30, 70 | nonsense')
+        self.assertIn('cpu', result['errors'])
+        self.assertIs(cpu, self.fan_controller.devices['cpu'])
+
+        result = self._reload(cpu_extra='controllerType = pid\ntargetTemperature = 60')
+        self.assertEqual({}, result['errors'])
+        self.assertEqual(60, self.fan_controller.devices['cpu'].target)
+        self.assertIs(cpu.inputs[0], self.fan_controller.devices['cpu'].inputs[0])
+        self.assertEqual([], cpu.outputs)
+        self.assertEqual('1', self._enable_file('pwm1'))
+
+    def test_asyncio_tasks_follow_devices(self):
+        # start() enables the devices itself.
+        for device in self.fan_controller.devices.values():
+            device.disable()
+        self.fan_controller.scheduler = 'asyncio'
+        self.fan_controller.runnable = True
+        thread = threading.Thread(target=self.fan_controller.start)
+        thread.start()
+        try:
+            time.sleep(0.1)
+            self._write_config(devices='cpu, gpu')
+            self.reloader.request()
+            deadline = time.monotonic() + 5
+            while 'gpu' not in self.fan_controller.stats and time.monotonic() < deadline:
+                time.sleep(0.02)
+            time.sleep(0.1)
+            self.assertNotIn('case', self.fan_controller.stats)
+            self.assertGreater(self.fan_controller.stats['gpu'].ticks, 1)
+        finally:
+            self.fan_controller.stop()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual('2', self._enable_file('pwm2'))
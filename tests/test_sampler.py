@@ -0,0 +1,83 @@
+import threading
+import time
+from unittest import TestCase
+
+from pyfc.common import DummyInput, DummyOutput, PassthroughController
+from pyfc.sampler import ConcurrentSampler, SampledInput
+
+
+class BlockingInput(DummyInput):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def get_value(self):
+        self.release.wait(5)
+        return super().get_value()
+
+
+class FailingInput(DummyInput):
+    def get_value(self):
+        raise IOError('sensor went away')
+
+
+class TestConcurrentSampler(TestCase):
+    def setUp(self) -> None:
+        self.sampler = ConcurrentSampler(max_workers=4, timeout=0.05)
+
+    def tearDown(self) -> None:
+        self.sampler.shutdown()
+
+    def test_sample(self):
+        fast = DummyInput()
+        fast.set_value(42)
+        self.sampler.sample([fast, fast])
+        self.assertEqual(42, self.sampler.value(fast))
+        self.assertEqual({}, self.sampler.timeouts)
+
+    def test_timeout_falls_back_to_last_good(self):
+        slow = BlockingInput()
+        slow.set_value(50)
+        slow.release.set()
+        self.sampler.sample([slow])
+        self.assertEqual(50, self.sampler.value(slow))
+
+        slow.release.clear()
+        slow.set_value(70)
+        started = time.monotonic()
+        self.sampler.sample([slow])
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(50, self.sampler.value(slow))
+        self.assertEqual(1, self.sampler.timeouts[slow])
+
+        # the read still in flight is not duplicated, and its value is picked up once it finishes.
+        slow.release.set()
+        self.sampler.sample([slow])
+        self.assertEqual(70, self.sampler.value(slow))
+
+    def test_slow_read_does_not_delay_others(self):
+        slow = BlockingInput()
+        fast = DummyInput()
+        fast.set_value(30)
+        started = time.monotonic()
+        self.sampler.sample([slow, fast])
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(30, self.sampler.value(fast))
+        self.assertEqual(self.sampler.default_value, self.sampler.value(slow))
+        slow.release.set()
+
+    def test_error_keeps_last_good(self):
+        failing = FailingInput()
+        self.sampler.sample([failing])
+        self.assertEqual(1, self.sampler.errors[failing])
+        self.assertEqual(self.sampler.default_value, self.sampler.value(failing))
+
+    def test_sampled_input_in_controller(self):
+        source = DummyInput()
+        source.set_value(100)
+        output = DummyOutput()
+        controller = PassthroughController([SampledInput(source, self.sampler)], [output])
+        controller.enable()
+        self.sampler.sample([source])
+        controller.run()
+        self.assertEqual(100, output.speed)
@@ -0,0 +1,78 @@
+import threading
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyfc.common import DummyOutput
+from pyfc.fancontroller import FanController
+from pyfc.lmsensorsdevice import LMSensorsTempInput
+from pyfc.sensorregistry import registry
+from pyfc.temperaturecontroller import TemperatureController
+
+
+class TestSensorRegistry(TestCase):
+    def setUp(self) -> None:
+        registry.clear()
+        self.tmp_dir = TemporaryDirectory()
+        self.sensor_path = Path(self.tmp_dir.name).joinpath('temp1_input')
+        self.sensor_path.write_text('45000\n')
+
+    def tearDown(self) -> None:
+        registry.clear()
+        self.tmp_dir.cleanup()
+
+    def test_same_path_is_shared(self):
+        first = LMSensorsTempInput.shared(self.sensor_path)
+        second = LMSensorsTempInput.shared(Path(self.tmp_dir.name).joinpath('.', 'temp1_input'))
+        self.assertIs(first, second)
+        self.assertEqual(1, len(registry))
+        first.close()
+
+    def test_conflicting_settings_warn(self):
+        first = LMSensorsTempInput.shared(self.sensor_path)
+        with self.assertLogs('pyfc.lmsensorsdevice', 'WARNING'):
+            self.assertIs(first, LMSensorsTempInput.shared(self.sensor_path, persistent=False))
+        self.assertTrue(first.persistent)
+        first.close()
+
+    def test_read_once_per_tick(self):
+        sensor = LMSensorsTempInput.shared(self.sensor_path)
+        speeds = [128] * 102
+        fan_controller = FanController(Path('unused.pid'), 1, {
+            'cpu':         TemperatureController([sensor], [DummyOutput()], speeds),
+            'cpu_exhaust': TemperatureController([LMSensorsTempInput.shared(self.sensor_path)], [DummyOutput()], speeds),
+        })
+
+        for _ in range(3):
+            fan_controller.tick()
+        self.assertEqual(3, len(sensor.temp), 'Shared sensor should be read once per tick!')
+        sensor.close()
+
+    def test_no_caching_without_ticks(self):
+        sensor = LMSensorsTempInput.shared(self.sensor_path)
+        sensor.get_value()
+        sensor.get_value()
+        self.assertEqual(2, len(sensor.temp))
+        sensor.close()
+
+    def test_read_once_per_tick_across_threads(self):
+        sensor = LMSensorsTempInput.shared(self.sensor_path)
+        read = sensor._read_persistent
+
+        def slow_read():
+            # wide open window between the epoch check and the update, as a slow sysfs read has.
+            time.sleep(0.01)
+            return read()
+
+        sensor._read_persistent = slow_read
+        registry.begin_tick()
+        values = []
+        threads = [threading.Thread(target=lambda: values.append(sensor.get_value())) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(sensor.temp))
+        self.assertEqual([45.0] * 4, values, 'No thread should get the value from before the read of this tick!')
+        sensor.close()
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from unittest import TestCase
+
+from pyfc.serialoutput import SerialLink, SerialOutput, checksum, frame
+
+
+class FakeFanBoard:
+    """
+    The microcontroller end of a pty pair, acknowledging every well formed frame.
+    """
+
+    def __init__(self, corrupt_acks: int = 0):
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        self.received = []
+        self.raw = b''
+        self.corrupt_acks = corrupt_acks
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self.master, 1024)
+            except OSError:
+                return
+            if not chunk:
+                return
+            data += chunk
+            self.raw += chunk
+            while b'\n' in data:
+                line, data = data.split(b'\n', 1)
+                self.received.append(line)
+                payload, _, cs = line[1:].partition(b'*')
+                if self.corrupt_acks:
+                    self.corrupt_acks -= 1
+                    os.write(self.master, b'ACK 00\n')
+                elif line.startswith(b'<') and int(cs, 16) == checksum(payload):
+                    os.write(self.master, b'ACK %s\n' % cs)
+
+    def close(self):
+        os.close(self._slave)
+        os.close(self.master)
+
+
+class TestFrame(TestCase):
+    def test_frame(self):
+        data = frame({'2': 200, '1': 128})
+        self.assertTrue(data.startswith(b'<1:128,2:200*'))
+        self.assertEqual(checksum(b'1:128,2:200'), int(data[-3:-1], 16))
+
+
+class TestSerialOutput(TestCase):
+    def setUp(self) -> None:
+        SerialLink._links.clear()
+
+    def tearDown(self) -> None:
+        SerialLink._links.clear()
+
+    def _outputs(self, board: FakeFanBoard, protocol='framed'):
+        outputs = [SerialOutput(channel, port=board.port, protocol=protocol, ack_timeout=1) for channel in (1, 2)]
+        for output in outputs:
+            output.enable()
+            self.assertTrue(output.serial_available)
+        return outputs
+
+    def _apply(self, outputs, *speeds):
+        for output, speed in zip(outputs, speeds):
+            output.values.clear()
+            output.set_value(speed)
+            output.apply()
+
+    def test_framed_channels_coalesced(self):
+        board = FakeFanBoard()
+        outputs = self._outputs(board)
+        link = outputs[0].link
+        self.assertIs(link, outputs[1].link)
+
+        self._apply(outputs, 128, 200)
+        self.assertEqual([b'<1:128,2:200*%02X' % checksum(b'1:128,2:200')], board.received)
+        self.assertEqual(1, link.acks)
+
+        self._apply(outputs, 128, 200)
+        self.assertEqual(1, len(board.received), 'Unchanged speeds should not be written!')
+        self.assertEqual(1, link.skipped)
+
+        self._apply(outputs, 128, 255)
+        self.assertEqual(2, len(board.received))
+        for output in outputs:
+            output.disable()
+        self.assertFalse(link.available)
+        board.close()
+
+    def test_framed_retry_on_bad_ack(self):
+        board = FakeFanBoard(corrupt_acks=1)
+        outputs = self._outputs(board)
+        self._apply(outputs, 100, 100)
+        self.assertEqual(2, len(board.received))
+        self.assertEqual(1, outputs[0].link.naks)
+        self.assertEqual({'1': 100, '2': 100}, outputs[0].link.committed)
+        for output in outputs:
+            output.disable()
+        board.close()
+
+    def test_legacy(self):
+        board = FakeFanBoard()
+        outputs = self._outputs(board, 'legacy')
+        self._apply(outputs, 10, 20)
+        self._apply(outputs, 10, 30)
+        deadline = time.monotonic() + 2
+        while len(board.raw) < 15 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for output in outputs:
+            output.disable()
+        self.assertEqual(b'1/10/2/20/2/30/', board.raw)
+        board.close()
+
+    def test_channels_at_different_intervals(self):
+        board = FakeFanBoard()
+        outputs = self._outputs(board)
+        # only channel 1 ticks, its second speed sends the first right away instead of waiting for channel 2.
+        self._apply(outputs[:1], 100)
+        self.assertEqual([], board.received)
+        self._apply(outputs[:1], 110)
+        self.assertEqual([b'<1:110*%02X' % checksum(b'1:110')], board.received)
+
+        # the end of the tick sends whatever was submitted.
+        self._apply(outputs[1:], 150)
+        outputs[1].flush()
+        self.assertEqual(b'<1:110,2:150*%02X' % checksum(b'1:110,2:150'), board.received[-1])
+        outputs[1].flush()
+        self.assertEqual(2, len(board.received))
+        for output in outputs:
+            output.disable()
+        board.close()
+
+    def test_failed_open_does_not_register(self):
+        output = SerialOutput(1, port='/dev/pyfc-no-such-port')
+        with self.assertLogs('pyfc.serialoutput', 'ERROR'):
+            output.enable()
+        self.assertFalse(output.enabled)
+        self.assertEqual(set(), output.link.channels)
+
+        board = FakeFanBoard()
+        outputs = self._outputs(board)
+        outputs[1].disable()
+        self.assertEqual({'1'}, outputs[0].link.channels)
+        # channel 2 is gone, so channel 1 alone completes the tick.
+        self._apply(outputs[:1], 100)
+        self.assertEqual(1, len(board.received))
+        outputs[0].disable()
+        board.close()
@@ -0,0 +1,67 @@
+from unittest import TestCase
+
+from pyfc.common import DummyOutput
+from pyfc.shaping import OutputShaper
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestOutputShaper(TestCase):
+    def setUp(self) -> None:
+        self.clock = Clock()
+
+    def _shape(self, shaper, *requests, dt=1.0):
+        shaped = []
+        for requested in requests:
+            self.clock.now += dt
+            shaped.append(shaper.shape(requested))
+        return shaped
+
+    def test_passthrough(self):
+        shaper = OutputShaper(clock=self.clock)
+        self.assertEqual([100, 101, 99, 200], self._shape(shaper, 100, 101, 99, 200))
+        self.assertEqual(0, shaper.writes_avoided)
+
+    def test_deadband(self):
+        shaper = OutputShaper(deadband=3, clock=self.clock)
+        self.assertEqual([100, 100, 100, 103, 103, 90], self._shape(shaper, 100, 101, 98, 103, 101, 90))
+        self.assertEqual(3, shaper.writes_avoided)
+
+    def test_hysteresis_down(self):
+        shaper = OutputShaper(deadband=2, hysteresis_down=4, clock=self.clock)
+        self.assertEqual([100, 103, 103, 97], self._shape(shaper, 100, 103, 98, 97))
+        self.assertEqual(1, shaper.writes_avoided)
+
+    def test_slew(self):
+        shaper = OutputShaper(slew_up=50, slew_down=10, clock=self.clock)
+        self.assertEqual([50, 100, 150, 200, 190, 180], self._shape(shaper, 50, 200, 200, 200, 0, 0))
+        self.assertEqual([175], self._shape(shaper, 0, dt=0.5))
+
+    def test_from_config(self):
+        self.assertIsNone(OutputShaper.from_config(_Config({})))
+        shaper = OutputShaper.from_config(_Config({'outputDeadband': '2', 'outputSlewDown': '5'}))
+        self.assertEqual(2, shaper.deadband)
+        self.assertEqual(5, shaper.slew_down)
+        self.assertIsNone(shaper.slew_up)
+
+    def test_output_device(self):
+        output = DummyOutput()
+        output.shaper = OutputShaper(deadband=5, clock=self.clock)
+        output.enable()
+        output.set_value(100)
+        output.apply()
+        output.set_value(104)
+        output.apply()
+        self.assertEqual(100, output.speed)
+        self.assertEqual(1, output.shaper.writes_avoided)
+
+
+class _Config(dict):
+    def getfloat(self, key, fallback=None):
+        return float(self[key]) if key in self else fallback
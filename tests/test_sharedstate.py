@@ -0,0 +1,103 @@
+import gc
+import threading
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyfc.common import DummyInput, DummyOutput
+from pyfc.fancontroller import FanController
+from pyfc.lmsensorsdevice import LMSensorsOutput, LMSensorsTempInput
+from pyfc.sharedstate import SEQUENCE, SharedStatePublisher, SharedStateReader, format_snapshot
+from pyfc.scheduler import TickStats
+from pyfc.temperaturecontroller import TemperatureController
+
+
+class TestSharedState(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.hwmon_path = Path(self.tmp_dir.name)
+        self.hwmon_path.joinpath('temp1_input').write_text('45000\n')
+        self.hwmon_path.joinpath('pwm1').write_text('0\n')
+        self.hwmon_path.joinpath('pwm1_enable').write_text('2\n')
+        self.input = LMSensorsTempInput(self.hwmon_path.joinpath('temp1_input'), label='Tctl')
+        self.output = LMSensorsOutput(self.hwmon_path, 'pwm1', 'pwm1_enable')
+        self.output.enable()
+        self.path = self.hwmon_path.joinpath('run', 'state')
+        self.publisher = SharedStatePublisher(self.path)
+        self.fan_controller = FanController(Path('unused.pid'), 1, {
+            'cpu':  TemperatureController([self.input], [self.output], [100] * 110),
+            'case': TemperatureController([self.input], [], [50] * 110),
+        }, shared_state=self.publisher)
+        self.fan_controller.stats['tick'] = TickStats('tick', 1)
+
+    def tearDown(self) -> None:
+        self.publisher.stop()
+        del self.fan_controller, self.input, self.output
+        gc.collect()
+        self.tmp_dir.cleanup()
+
+    def test_snapshot(self):
+        self.publisher.start(self.fan_controller)
+        with SharedStateReader(self.path) as reader:
+            snapshot = reader.snapshot()
+            self.assertTrue(snapshot.live)
+            self.assertEqual([None], [slot['value'] for slot in snapshot.temperatures()])
+
+            self.fan_controller.tick()
+            self.fan_controller.stats['tick'].record_tick(0.0, 0.001, 10.0)
+            self.publisher.publish()
+            snapshot = reader.snapshot()
+            self.assertEqual(0, snapshot.sequence % 2)
+            temperature, = snapshot.temperatures()
+            self.assertEqual(('Tctl', 45.0, ['cpu', 'case']), (temperature['name'], temperature['value'], temperature['controllers']))
+            self.assertEqual([100], [slot['value'] for slot in snapshot.speeds()])
+            self.assertEqual({'started': 10.0, 'period': 0.0, 'duration': 0.001, 'ticks': 1, 'overruns': 0}, snapshot.loops()['tick'])
+            self.assertEqual(4, len(format_snapshot(snapshot)))
+
+    def test_relayout_and_stop(self):
+        self.publisher.start(self.fan_controller)
+        reader = SharedStateReader(self.path)
+        try:
+            self.assertEqual(1, len(reader.snapshot().speeds()))
+            del self.fan_controller.devices['cpu']
+            self.publisher.bind(self.fan_controller)
+            self.publisher.publish()
+            self.assertEqual(0, len(reader.snapshot().speeds()))
+            self.assertTrue(reader.snapshot().live)
+
+            self.publisher.stop()
+            self.assertFalse(self.path.exists())
+            self.assertFalse(reader.snapshot().live)
+        finally:
+            reader.close()
+
+    def test_torn_reads_are_retried(self):
+        inputs = [DummyInput(), DummyInput()]
+        fan_controller = FanController(Path('unused.pid'), 1, {'zone': TemperatureController(inputs, [DummyOutput()], [100] * 110)})
+        self.publisher.start(fan_controller)
+        reader = SharedStateReader(self.path)
+        running = True
+
+        def write():
+            value = 0
+            while running:
+                value += 1
+                for input_dev in inputs:
+                    input_dev.set_value(value)
+                self.publisher.publish()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for _ in range(2000):
+                first, second = (slot['value'] for slot in reader.snapshot().temperatures())
+                self.assertEqual(first, second)
+        finally:
+            running = False
+            writer.join()
+
+        self.publisher._mapping.words[SEQUENCE] += 1
+        with self.assertRaises(RuntimeError):
+            reader.snapshot(timeout=0.01)
+        self.publisher._mapping.words[SEQUENCE] += 1
+        reader.close()
@@ -0,0 +1,56 @@
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyfc.spool import LineSpool
+
+
+class TestLineSpool(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _drain(self, spool: LineSpool, batch: int):
+        lines = []
+        while spool:
+            peeked, token = spool.peek(batch)
+            lines.extend(peeked)
+            spool.commit(token)
+        return lines
+
+    def test_append_and_replay_in_order(self):
+        spool = LineSpool(self.tmp_dir.name, segment_bytes=64)
+        expected = [f'pyfc cpu={idx} {idx}' for idx in range(50)]
+        for idx in range(0, 50, 5):
+            spool.append(expected[idx:idx + 5])
+        self.assertGreater(len(list(spool.directory.glob('*.lines'))), 1)
+
+        self.assertEqual(expected, self._drain(spool, 7))
+        self.assertFalse(spool)
+        self.assertEqual([], list(spool.directory.glob('*.lines')))
+
+    def test_peek_without_commit_does_not_consume(self):
+        spool = LineSpool(self.tmp_dir.name)
+        spool.append(['a', 'b', 'c'])
+        self.assertEqual(['a', 'b'], spool.peek(2)[0])
+        self.assertEqual(['a', 'b'], spool.peek(2)[0])
+
+    def test_survives_restart(self):
+        spool = LineSpool(self.tmp_dir.name, segment_bytes=4)
+        spool.append(['a', 'b'])
+        spool.append(['c'])
+        lines, token = spool.peek(1)
+        spool.commit(token)
+
+        reopened = LineSpool(self.tmp_dir.name, segment_bytes=4)
+        reopened.append(['d'])
+        self.assertEqual(['b', 'c', 'd'], self._drain(reopened, 10))
+
+    def test_size_cap_drops_oldest(self):
+        spool = LineSpool(self.tmp_dir.name, segment_bytes=10, max_bytes=30)
+        for idx in range(10):
+            spool.append([f'line{idx:04d}'])
+        self.assertLessEqual(spool.size, 30 + 10)
+        self.assertGreater(spool.dropped_bytes, 0)
+        self.assertEqual('line0009', self._drain(spool, 100)[-1])
@@ -0,0 +1,72 @@
+from configparser import ConfigParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyfc.drivedevice import from_disk_by_id, generate_drive_input, ATADrive, NVMeDrive
+from pyfc.lmsensorsdevice import LMSensorsTempInput
+from pyfc.sensorregistry import registry
+from pyfc.topology import Topology, reset_topology, get_topology
+
+from benchmarks.fakesysfs import FakeSysfs
+
+
+class TestTopology(TestCase):
+    def setUp(self) -> None:
+        registry.clear()
+        self.tmp_dir = TemporaryDirectory()
+        self.sysfs = FakeSysfs(Path(self.tmp_dir.name))
+        self.sysfs.add_chip('k10temp', {1: 45000, 3: 50000}, labels={1: 'Tctl'})
+        self.sysfs.add_chip('nct6798', {1: 30000}, pwms=(1, 2))
+        self.sysfs.add_ata_disk('sda', 'ST8000VN004-2M2101_ZA1')
+        self.sysfs.add_ata_disk('sdb', 'ST8000VN004-2M2101_ZA2', 38000, host=1)
+        self.sysfs.add_nvme_disk(0, 'Samsung_SSD_980_PRO_1TB_S5GX')
+        reset_topology(Topology(self.sysfs.sysfs_root, self.sysfs.dev_root))
+
+    def tearDown(self) -> None:
+        for sensor in list(registry._sensors.values()):
+            sensor.close()
+        registry.clear()
+        reset_topology()
+        self.tmp_dir.cleanup()
+
+    def test_index(self):
+        topology = get_topology()
+        self.assertEqual(['k10temp'], [d.name for d in topology.hwmon_named('k10')])
+        self.assertEqual(2, len(topology.hwmon_named('drivetemp')))
+        self.assertEqual(2, len(topology.hwmon_named('k10temp')[0].temp_inputs))
+        self.assertEqual([], topology.hwmon_named('amdgpu'))
+        self.assertEqual(3, len([d for d in topology.disk_ids if not d.partition]))
+
+    def test_labels(self):
+        k10temp = get_topology().hwmon_named('k10temp')[0]
+        self.assertEqual('Tctl', get_topology().label(k10temp.path.joinpath('temp1_input')))
+        self.assertEqual('temp3_input', get_topology().label(k10temp.path.joinpath('temp3_input')))
+
+    def test_component_temp_input(self):
+        sensors = LMSensorsTempInput.from_path('k10temp', 'temp1_input')
+        self.assertEqual(1, len(sensors))
+        self.assertEqual('Tctl', sensors[0].name)
+        self.assertAlmostEqual(45.0, sensors[0].get_value())
+
+    def test_missing_chip(self):
+        with self.assertRaises(FileNotFoundError):
+            LMSensorsTempInput.path_from_device_name('amdgpu')
+
+    def test_ata_drives(self):
+        drives = from_disk_by_id('ST8000VN004')
+        self.assertEqual(2, len(drives))
+        self.assertTrue(all(isinstance(d, ATADrive) for d in drives))
+        self.assertEqual([35.0, 38.0], sorted(d.get_value() for d in drives))
+
+    def test_drive_input_keeps_order(self):
+        config = ConfigParser(converters={'list': lambda x: [i.strip() for i in x.split(',')]})
+        config.read_string('[disks]\ndiskIDs = ST8000VN004-2M2101_ZA2, ST8000VN004\n')
+        drives = generate_drive_input(config['disks'])
+        self.assertEqual(['sdb', 'sda'], [d.real_path.name for d in drives])
+
+    def test_nvme_drive(self):
+        drives = from_disk_by_id('Samsung_SSD_980_PRO', 'Composite')
+        self.assertEqual(1, len(drives))
+        self.assertIsInstance(drives[0], NVMeDrive)
+        self.assertAlmostEqual(40.0, drives[0].get_value())
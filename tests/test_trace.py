@@ -0,0 +1,180 @@
+import gc
+import math
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pyfc.fancontroller import FanController
+from pyfc.lmsensorsdevice import LMSensorsOutput, LMSensorsTempInput
+from pyfc.reload import read_config
+from pyfc.temperaturecontroller import TemperatureController
+from pyfc.trace import Replay, TraceReader, TraceRecorder, TraceWriter, format_report
+
+CANDIDATE = """
+[DEFAULT]
+minimumSpeed = 20
+maximumSpeed = 100
+temps = 30, 60
+
+[cpu]
+{extra}
+"""
+
+DESCRIPTION = {
+    'channels': [
+        {'kind': 'input', 'name': 'Tctl', 'source': '/sys/class/hwmon/hwmon0/temp1_input'},
+        {'kind': 'output', 'name': 'pwm1', 'source': '/sys/class/hwmon/hwmon1/pwm1'},
+    ],
+    'controllers': {'cpu': {'inputs': [0], 'outputs': [1]}, 'gone': {'inputs': [0], 'outputs': []}},
+}
+
+
+class TestTraceFile(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name).joinpath('test.pyfctrace')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        writer = TraceWriter(self.path, DESCRIPTION, 3, 1000.0)
+        writer.append(1000.0, [45.5, None])
+
+        # readable while being written, up to the last complete record.
+        with TraceReader(self.path) as trace:
+            self.assertEqual(1, trace.count)
+            self.assertEqual(DESCRIPTION['channels'], trace.channels)
+            self.assertEqual(45.5, trace.column(0)[0])
+            self.assertTrue(math.isnan(trace.column(1)[0]))
+
+        writer.append(1001.0, [46.0, 128])
+        writer.append(1002.5, [47.0, 130])
+        self.assertFalse(writer.append(1003.0, [48.0, 131]))
+        self.assertTrue(writer.full)
+        writer.close()
+
+        with TraceReader(self.path) as trace:
+            self.assertEqual([1000.0, 1001.0, 1002.5], list(trace.times))
+            self.assertEqual([128, 130], list(trace.column(1)[1:]))
+            self.assertEqual(2.5, trace.duration)
+            self.assertEqual(1000.0, trace.created)
+
+        self.path.write_bytes(b'not a trace at all, but long enough for a header')
+        with self.assertRaises(ValueError):
+            TraceReader(self.path)
+
+
+class TestTraceRecorder(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.hwmon_path = Path(self.tmp_dir.name)
+        self.hwmon_path.joinpath('temp1_input').write_text('45000\n')
+        self.hwmon_path.joinpath('pwm1').write_text('0\n')
+        self.hwmon_path.joinpath('pwm1_enable').write_text('2\n')
+        self.input = LMSensorsTempInput(self.hwmon_path.joinpath('temp1_input'), label='Tctl')
+        self.output = LMSensorsOutput(self.hwmon_path, 'pwm1', 'pwm1_enable')
+        self.output.enable()
+        self.recorder = TraceRecorder(self.hwmon_path.joinpath('trace'), capacity=2, keep_files=2, clock=lambda: 1000.0 + self.recorder.records)
+        self.fan_controller = FanController(Path('unused.pid'), 1, {
+            'cpu':  TemperatureController([self.input], [self.output], [100] * 110),
+            'case': TemperatureController([self.input], [], [50] * 110),
+        }, recorder=self.recorder)
+
+    def tearDown(self) -> None:
+        self.recorder.stop()
+        del self.fan_controller, self.input, self.output
+        gc.collect()
+        self.tmp_dir.cleanup()
+
+    def _tick(self, temperature: int):
+        self.hwmon_path.joinpath('temp1_input').write_text(f'{temperature}\n')
+        self.fan_controller.tick()
+        self.recorder.record()
+
+    def test_records_and_rolls_over(self):
+        self.recorder.start(self.fan_controller)
+        for temperature in (45000, 47000, 49000, 51000, 53000):
+            self._tick(temperature)
+        self.recorder.stop()
+
+        traces = sorted(self.hwmon_path.joinpath('trace').glob('*.pyfctrace'))
+        self.assertEqual(2, len(traces), 'Only the newest keep_files traces are kept')
+        with TraceReader(traces[0]) as trace:
+            self.assertEqual({'cpu': {'inputs': [0], 'outputs': [1]}, 'case': {'inputs': [0], 'outputs': []}}, trace.controllers)
+            self.assertEqual([49.0, 51.0], list(trace.column(0)))
+            self.assertEqual([100, 100], list(trace.column(1)))
+            self.assertEqual([1002.0, 1003.0], list(trace.times))
+        with TraceReader(traces[1]) as trace:
+            self.assertEqual([53.0], list(trace.column(0)))
+
+    def test_new_file_when_devices_change(self):
+        self.recorder.start(self.fan_controller)
+        self._tick(45000)
+        first = self.recorder.writer.path
+        del self.fan_controller.devices['case']
+        self.recorder.bind(self.fan_controller)
+        self._tick(46000)
+        self.assertNotEqual(first, self.recorder.writer.path)
+        self.recorder.bind(self.fan_controller)
+        self._tick(47000)
+        self.assertEqual(2, self.recorder.writer.count)
+
+
+class TestReplay(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name).joinpath('test.pyfctrace')
+        # an hour at one tick per second, 40°C with a 60°C hour quarter in the middle, recorded fans at 50%.
+        writer = TraceWriter(self.path, DESCRIPTION, 3600, 0.0)
+        for tick in range(3600):
+            writer.append(float(tick), [60.0 if 1200 <= tick < 2100 else 40.0, 128])
+        writer.close()
+        self.trace = TraceReader(self.path)
+
+    def tearDown(self) -> None:
+        self.trace.close()
+        self.tmp_dir.cleanup()
+
+    def _replay(self, extra: str = '', **kwargs) -> dict:
+        config_path = Path(self.tmp_dir.name).joinpath('candidate.ini')
+        config_path.write_text(CANDIDATE.format(extra=extra))
+        return Replay(self.trace, read_config(config_path), **kwargs).run()
+
+    def test_temperature_controller(self):
+        report = self._replay(speed_threshold=90, temperature_threshold=50)
+        self.assertEqual(3600, report['ticks'])
+        self.assertEqual(['cpu'], list(report['controllers']))
+        cpu = report['controllers']['cpu']
+        self.assertEqual(900, cpu['time_above_temperature'])
+        self.assertEqual(60, cpu['max_temperature'])
+
+        pwm1 = cpu['outputs'][0]
+        self.assertEqual('pwm1', pwm1['name'])
+        self.assertEqual(0, pwm1['recorded']['speed_changes'])
+        self.assertEqual(128, pwm1['recorded']['mean_speed'])
+        # the smoothing of the input spreads every step over 32 ticks.
+        self.assertEqual(pwm1['writes'], pwm1['candidate']['speed_changes'] + 1)
+        self.assertGreater(pwm1['candidate']['time_above_speed'], 800)
+        self.assertLess(pwm1['candidate']['time_above_speed'], 900)
+        self.assertEqual(255, pwm1['candidate']['max_speed'])
+        self.assertEqual(3, len(format_report(report)))
+
+    def test_shaping_and_refresh_follow_recorded_time(self):
+        plain = self._replay()['controllers']['cpu']['outputs'][0]
+        shaped = self._replay('outputSlewUp = 1\noutputSlewDown = 1\npwmRefreshInterval = 60')['controllers']['cpu']['outputs'][0]
+        # 40°C asks for 119 and 60°C for 255, slewing takes one step per recorded second up and back down.
+        self.assertEqual(272, plain['candidate']['travel'])
+        self.assertEqual(272, shaped['candidate']['travel'])
+        self.assertEqual(272, shaped['candidate']['speed_changes'])
+        self.assertLess(plain['candidate']['speed_changes'], shaped['candidate']['speed_changes'])
+        # unchanged speeds are written again every 60 recorded seconds.
+        self.assertGreater(shaped['writes'], shaped['candidate']['speed_changes'] + 50)
+
+    def test_pid_controller(self):
+        report = self._replay('controllerType = pid\ntargetTemperature = 50')
+        pwm1 = report['controllers']['cpu']['outputs'][0]
+        self.assertGreater(pwm1['candidate']['max_speed'], 250)
+        # the integrator saw recorded seconds, not the milliseconds the replay took.
+        self.assertGreater(pwm1['candidate']['time_above_speed'], 800)
+        self.assertGreater(report['ticks'] / report['elapsed'], 1000)
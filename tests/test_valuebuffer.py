@@ -0,0 +1,50 @@
+from collections import deque
+from unittest import TestCase
+
+from pyfc.common import ValueBuffer
+
+
+class TestValueBuffer(TestCase):
+    def setUp(self) -> None:
+        self.buffer = ValueBuffer('test', 35, capacity=4)
+
+    def test_default_value(self):
+        self.assertEqual(35, self.buffer.mean())
+        self.assertEqual(35, self.buffer.last())
+        self.assertEqual(35, self.buffer.first())
+        self.assertEqual(35, self.buffer.min())
+        self.assertEqual(35, self.buffer.max())
+        self.assertEqual(35, self.buffer.ewma())
+        self.assertEqual(0, len(self.buffer))
+
+    def test_partially_filled(self):
+        self.buffer.update(10)
+        self.buffer.update(20)
+        self.assertAlmostEqual(15.0, self.buffer.mean())
+        self.assertEqual(20.0, self.buffer.last())
+        self.assertEqual(10.0, self.buffer.min())
+        self.assertEqual(20.0, self.buffer.max())
+        self.assertEqual([10.0, 20.0], list(self.buffer))
+
+    def test_matches_deque(self):
+        reference = deque(maxlen=4)
+        for value in (1, 5, 3, 9, 7, 2, 8, 6, 4, 0, 11):
+            reference.append(value)
+            self.buffer.update(value)
+            self.assertAlmostEqual(sum(reference) / len(reference), self.buffer.mean())
+            self.assertEqual(list(map(float, reference)), list(self.buffer))
+            self.assertEqual(min(reference), self.buffer.min())
+            self.assertEqual(max(reference), self.buffer.max())
+            self.assertEqual(value, self.buffer.last())
+            self.assertEqual(reference[0], self.buffer.first())
+
+    def test_ewma(self):
+        self.buffer.update(0)
+        self.buffer.update(100)
+        self.assertAlmostEqual(25.0, self.buffer.ewma())
+
+    def test_clear(self):
+        self.buffer.update(50)
+        self.buffer.clear()
+        self.assertEqual(35, self.buffer.mean())
+        self.assertEqual([], list(self.buffer))